@@ -0,0 +1,255 @@
+"""
+Bulk processing CLI.
+
+Runs a JSONL file of summarize, classify, extract or generate items through
+the job worker's operation handlers and appends one JSONL result record per
+item to the output file, in completion order:
+
+    python -m app.bulk items.jsonl results.jsonl --operation classify
+
+Each line is an operation's request body (with --operation) or an envelope
+{"id", "operation", "payload"}. The output file is the checkpoint: running
+the same command again after a crash or Ctrl-C skips the lines it already
+holds and appends the rest.
+
+With --provider-batch, items the OpenAI Batch API can run as one prompt
+(single-chunk summaries, classifications without examples, generations; gpt-
+models) are submitted as batches at half the online price and collected when
+they finish, within 24 hours. Everything else, including requests a batch
+could not complete, is left for a regular run on the same output.
+"""
+import argparse
+import asyncio
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from platform_common.codec import dumps, dumps_str, loads
+
+from .models import ClassifyRequest, GenerateRequest, SummarizeRequest
+from .services.ai_service import classification_prompt, summary_prompt
+from .services.bulk_service import BulkCheckpoint, BulkService, read_chunks, split_lines
+from .services.classification_service import ClassificationService
+from .services.provider_batch import OpenAIBatch
+from .services.scheduler import RequestContext
+from .services.tokenizer import count_tokens
+from .worker import HANDLERS, ai_service, embedding_service, redis_service
+from .config import settings
+
+bulk_service = BulkService(redis_service)
+
+
+def load_output(path: str) -> BulkCheckpoint:
+    """
+    Lines already in the output file. A record cut short or garbled by a crash
+    is removed together with everything after it; those lines are redone.
+    """
+    checkpoint = BulkCheckpoint()
+    if not os.path.exists(path):
+        return checkpoint
+    with open(path, "rb+") as f:
+        complete = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                number = loads(line)["line"]
+            except (ValueError, TypeError, KeyError):
+                break
+            if not isinstance(number, int) or number < 1:
+                break
+            checkpoint.add(number)
+            complete += len(line)
+        f.truncate(complete)
+    return checkpoint
+
+
+def _item(line: bytes, operation: Optional[str]) -> Tuple[Dict[str, Any], Optional[str], Any]:
+    """Request body, operation and id of an input line"""
+    item = loads(line)
+    if "payload" in item:
+        return item["payload"], item.get("operation") or operation, item.get("id")
+    return item, operation, item.get("id")
+
+
+async def run_online(args: argparse.Namespace, context: RequestContext) -> Dict[str, int]:
+    checkpoint = load_output(args.output)
+    counts = {"resumed": len(checkpoint), "completed": 0, "failed": 0}
+    with open(args.input, "rb") as source, open(args.output, "ab") as output:
+        lines = split_lines(read_chunks(source))
+        async for record in bulk_service.run(lines, HANDLERS, context, args.operation, checkpoint, args.concurrency):
+            output.write(dumps(record) + b"\n")
+            output.flush()
+            counts[record["status"]] += 1
+    return counts
+
+
+# Provider batch mode
+
+def batch_request(number: int, operation: Optional[str], payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Batch API request of an item, or None when the item needs the online path"""
+    if operation == "summarize":
+        request = SummarizeRequest(**payload)
+        if count_tokens(request.text, request.model) > settings.summarize_chunk_tokens:
+            return None  # map-reduce
+        prompt, max_tokens = summary_prompt(request.text, request.max_length), 1000
+    elif operation == "classify":
+        request = ClassifyRequest(**payload)
+        if request.examples:
+            return None  # mostly answered by the embedding fast path
+        prompt, max_tokens = classification_prompt(request.text, request.categories), 1000
+    elif operation == "generate":
+        request = GenerateRequest(**payload)
+        prompt, max_tokens = request.prompt, request.max_tokens
+    else:
+        return None
+    if not request.model.startswith("gpt-"):
+        return None
+    return OpenAIBatch.request(f"line-{number}", request.model, [{"role": "user", "content": prompt}], max_tokens)
+
+
+def batch_record(meta: Dict[str, Any], output: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Result record of a batch output line, or None when the request did not succeed"""
+    response = output.get("response") or {}
+    if output.get("error") or response.get("status_code") != 200:
+        return None
+    body = response["body"]
+    text = body["choices"][0]["message"]["content"] or ""
+    if meta["operation"] == "summarize":
+        data = {"summary": text}
+    elif meta["operation"] == "classify":
+        data = {"classification": ClassificationService.match(text, meta["categories"]), "confidence": None, "method": "llm"}
+    else:
+        data = {"generated_content": text}
+    record = {"line": meta["line"], "operation": meta["operation"], "status": "completed"}
+    if meta.get("id") is not None:
+        record["id"] = meta["id"]
+    record["result"] = {"data": data, "model_used": body.get("model"), "tokens_used": body["usage"]["total_tokens"]}
+    return record
+
+
+def _read_jsonl(path: str) -> List[Dict[str, Any]]:
+    with open(path, "rb") as f:
+        return [loads(line) for line in f if line.strip()]
+
+
+async def _submit_batches(args: argparse.Namespace, adapter: OpenAIBatch, done: BulkCheckpoint, batches: List[Dict[str, Any]]) -> int:
+    """Write and submit batches of the items not done or submitted yet; returns how many were left out"""
+    submitted = BulkCheckpoint()
+    for batch in batches:
+        for meta in _read_jsonl(batch["meta"]):
+            submitted.add(meta["line"])
+
+    left = 0
+    requests = metas = None
+    size = 0
+
+    async def submit():
+        nonlocal requests, metas, size
+        requests.close()
+        metas.close()
+        batch = {"batch_id": await adapter.submit(requests.name), "input": requests.name, "meta": metas.name}
+        with open(f"{args.output}.batches", "ab") as state:
+            state.write(dumps(batch) + b"\n")
+        batches.append(batch)
+        print(f"Submitted batch {batch['batch_id']} ({size} requests)")
+        requests = metas = None
+        size = 0
+
+    with open(args.input, "rb") as source:
+        async for number, line in split_lines(read_chunks(source)):
+            if line is None or not line.strip() or number in done or number in submitted:
+                continue
+            try:
+                payload, operation, item_id = _item(line, args.operation)
+                request = batch_request(number, operation, payload)
+            except Exception:
+                request = None  # reported as failed by the regular run
+            if request is None:
+                left += 1
+                continue
+            if requests is None:
+                # Named after its first line, which no other batch holds
+                name = f"{args.output}.batch-{number}"
+                requests, metas = open(f"{name}.jsonl", "wb"), open(f"{name}.meta.jsonl", "wb")
+            requests.write(dumps(request) + b"\n")
+            metas.write(dumps({"line": number, "id": item_id, "operation": operation, "categories": payload.get("categories")}) + b"\n")
+            size += 1
+            if size >= settings.bulk_provider_batch_size:
+                await submit()
+    if requests is not None:
+        await submit()
+    return left
+
+
+async def run_provider_batch(args: argparse.Namespace) -> Dict[str, int]:
+    if not hasattr(ai_service, "openai_client"):
+        raise SystemExit("--provider-batch needs OPENAI_API_KEY")
+    adapter = OpenAIBatch(ai_service.openai_client)
+    done = load_output(args.output)
+    state_path = f"{args.output}.batches"
+    # Batches whose files are gone were collected by an earlier run
+    batches = [batch for batch in _read_jsonl(state_path) if os.path.exists(batch["meta"])] if os.path.exists(state_path) else []
+    left = await _submit_batches(args, adapter, done, batches)
+    counts = {"resumed": len(done), "completed": 0, "unfinished": 0, "left_for_regular_run": left}
+
+    with open(args.output, "ab") as output:
+        for batch in batches:
+            result = await adapter.wait(batch["batch_id"])
+            print(f"Batch {batch['batch_id']} {result.status}")
+            # At most bulk_provider_batch_size entries
+            metas = {meta["line"]: meta for meta in _read_jsonl(batch["meta"])}
+            async for line in adapter.results(result):
+                meta = metas.pop(int(line["custom_id"].split("-", 1)[1]), None)
+                if meta is None or meta["line"] in done:
+                    continue
+                record = batch_record(meta, line)
+                if record is None:
+                    counts["unfinished"] += 1
+                    continue
+                output.write(dumps(record) + b"\n")
+                output.flush()
+                counts["completed"] += 1
+            # Requests an expired or cancelled batch never reached
+            counts["unfinished"] += len([number for number in metas if number not in done])
+            os.remove(batch["input"])
+            os.remove(batch["meta"])
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    return counts
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m app.bulk", description="Process a JSONL file of AI operation items.")
+    parser.add_argument("input", help="JSONL file of items")
+    parser.add_argument("output", help="JSONL file of result records (appended to when resuming)")
+    parser.add_argument("--operation", choices=sorted(HANDLERS), help="Operation of lines that are bare request bodies")
+    parser.add_argument("--concurrency", type=int, default=settings.bulk_max_concurrency,
+                        help="Items in flight (at most BULK_MAX_CONCURRENCY)")
+    parser.add_argument("--company-id", default=None, help="Tenant the items are scheduled as")
+    parser.add_argument("--plan", default=settings.scheduler_default_plan,
+                        help="Scheduler plan of the tenant, which also caps concurrent provider calls")
+    parser.add_argument("--provider-batch", action="store_true",
+                        help="Submit the items the OpenAI Batch API can run as batches (half price, up to 24h)")
+    return parser.parse_args()
+
+
+async def main(args: argparse.Namespace):
+    await redis_service.connect()
+    await ai_service.connect()
+    try:
+        if args.provider_batch:
+            counts = await run_provider_batch(args)
+        else:
+            counts = await run_online(args, RequestContext(args.company_id or "anonymous", args.plan, "batch"))
+    finally:
+        await embedding_service.close()
+        await ai_service.disconnect()
+        await redis_service.disconnect()
+    print(f"Bulk run finished: {dumps_str(counts)}")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(parse_args()))
+    except KeyboardInterrupt:
+        raise SystemExit("Interrupted; run the same command again to resume")
@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, List, Optional
 
 class Settings(BaseSettings):
     # API Keys
@@ -9,6 +9,11 @@ class Settings(BaseSettings):
     
     # Redis Configuration
     redis_url: str = "redis://redis:6379"
+    redis_max_connections: int = 64
+    redis_socket_timeout: float = 5.0
+    redis_health_check_interval: float = 5.0
+    redis_max_backoff_seconds: float = 30.0
+    redis_auto_pipeline: bool = True
     
     # Database Configuration
     database_url: Optional[str] = None
@@ -22,6 +27,161 @@ class Settings(BaseSettings):
     max_tokens: int = 1000
     temperature: float = 0.7
     
+    # Summarization Configuration
+    summarize_chunk_tokens: int = 3000
+    summarize_chunk_overlap_tokens: int = 200
+    summarize_max_concurrency: int = 8
+    
+    # Chat Context Budget Configuration
+    chat_context_policy: str = "pin_system"
+    chat_context_budget: Optional[int] = None
+    chat_summary_block: int = 8
+    chat_summary_max_tokens: int = 400
+    
+    # Cache Refresh Configuration (per operation; seconds)
+    # Entries are fresh until soft_ttl, then served stale while one background refresh runs,
+    # until hard_ttl. Both are jittered by +/- jitter; beta > 0 refreshes probabilistically early.
+    cache_policies: Dict[str, Dict[str, float]] = {
+        "default": {"soft_ttl": 3600, "hard_ttl": 7200, "jitter": 0.1, "beta": 1.0},
+        "summarize": {"soft_ttl": 3600, "hard_ttl": 86400, "jitter": 0.1, "beta": 1.0},
+        "summarize_chunk": {"soft_ttl": 43200, "hard_ttl": 86400, "jitter": 0.1, "beta": 1.0},
+        "chat_summary": {"soft_ttl": 43200, "hard_ttl": 86400, "jitter": 0.1, "beta": 1.0}
+    }
+    cache_refresh_lock_seconds: int = 120
+    cache_miss_wait_seconds: float = 30.0
+    
+    # Cache Storage Configuration
+    # Values are stored as msgpack, compressed ("zstd", "zlib" or "none") from cache_compression_min_size bytes
+    cache_compression: str = "zstd"
+    cache_compression_level: int = 3
+    cache_compression_min_size: int = 1024
+    # Redis memory budget per key namespace (bytes); entries nearest to expiry are evicted first
+    cache_namespace_budgets: Dict[str, int] = {
+        "summarize": 256 * 1024 * 1024,
+        "summarize:chunk": 512 * 1024 * 1024,
+        "chat_summary": 128 * 1024 * 1024,
+        "ai_logs": 128 * 1024 * 1024
+    }
+    
+    # Chat Session Configuration
+    chat_session_ttl: int = 86400
+    chat_session_max_messages: int = 500
+    chat_session_max_bytes: int = 1000000
+    
+    # Prompt Caching Configuration (providers ignore shorter cache prefixes)
+    prompt_cache_min_tokens: int = 1024
+    
+    # Knowledge Base Configuration
+    knowledge_base_dir: str = "/app/data/knowledge_bases"
+    embedding_model: str = "all-MiniLM-L6-v2"
+    embedding_batch_size: int = 64
+    kb_chunk_tokens: int = 256
+    kb_chunk_overlap_tokens: int = 32
+    kb_flush_chunks: int = 1024
+    kb_max_document_bytes: int = 10000000
+    kb_ingest_job_ttl: int = 86400
+    # File sources must resolve inside this directory
+    kb_ingest_root: str = "/app/data/ingest"
+    
+    # Outbound Request Configuration (ingestion URLs and job webhooks)
+    # Hosts are exact names or ".example.com" for a domain and its subdomains; empty allows any
+    # host, as long as it resolves to public addresses only (unless outbound_allow_private)
+    outbound_url_schemes: List[str] = ["https", "http"]
+    outbound_allowed_hosts: List[str] = []
+    outbound_allow_private: bool = False
+    
+    # Embedding API Configuration
+    embedding_batch_wait_ms: float = 5.0
+    embedding_max_batch_size: int = 128
+    embedding_cache_size: int = 10000
+    embedding_max_texts: int = 256
+    # Ingestion embeds in slices of this many texts, so queries wait for at most one slice
+    embedding_bulk_slice_size: int = 64
+    
+    # Server Configuration
+    workers: int = 1
+    shutdown_grace_seconds: float = 25.0
+    embedding_preload: bool = False
+    embedding_threads: int = 0
+    
+    # Response Configuration
+    response_compression_min_size: int = 1024
+    
+    # Internal gRPC Configuration
+    # Gateway-facing gRPC interface next to the HTTP API (0 disables it)
+    grpc_port: int = 50053
+    grpc_max_message_bytes: int = 32 * 1024 * 1024
+    
+    # Diagnostics Configuration
+    # Request profiling (X-Profile header) and the /debug endpoints need this token
+    diagnostics_token: Optional[str] = None
+    diagnostics_loop_monitor: bool = True
+    diagnostics_slow_callback_ms: float = 250.0
+    diagnostics_sample_interval_ms: float = 5.0
+    
+    # Job Queue Configuration
+    job_stream: str = "ai_jobs"
+    job_group: str = "ai_workers"
+    job_worker_concurrency: int = 8
+    job_max_attempts: int = 3
+    job_claim_idle_ms: int = 60000
+    job_result_ttl: int = 86400
+    job_max_wait_seconds: float = 25.0
+    job_webhook_timeout: float = 10.0
+
+    # Bulk Processing Configuration (JSONL bulk endpoint and `python -m app.bulk`)
+    bulk_max_concurrency: int = 32
+    bulk_max_attempts: int = 3
+    bulk_max_line_bytes: int = 10000000
+    bulk_checkpoint_ttl: int = 604800
+    # Provider batch APIs take at most this many requests per batch
+    bulk_provider_batch_size: int = 50000
+    bulk_provider_batch_poll_seconds: float = 60.0
+
+    # Tenant Scheduler Configuration (per worker process; plans match the gateway's rate-limit tiers)
+    scheduler_max_concurrency: int = 64
+    scheduler_default_plan: str = "pro"
+    scheduler_plan_weights: Dict[str, float] = {"free": 1.0, "pro": 4.0, "enterprise": 16.0}
+    scheduler_plan_concurrency: Dict[str, int] = {"free": 4, "pro": 16, "enterprise": 48}
+    scheduler_priority_weights: Dict[str, float] = {"interactive": 8.0, "batch": 1.0}
+    scheduler_max_wait_seconds: Dict[str, float] = {"interactive": 30.0, "batch": 600.0}
+    scheduler_urgent_seconds: float = 2.0
+    
+    # Load Shedding Configuration (per worker process; 0 disables the in-flight limit)
+    max_inflight_requests: int = 512
+    scheduler_max_queue: int = 1024
+    scheduler_max_tenant_queue: int = 256
+    scheduler_shed_wait_seconds: float = 10.0
+    provider_timeout_seconds: float = 60.0
+    
+    # Classification Configuration (embedding fast path; below the thresholds the LLM decides)
+    # The best category needs an absolute cosine similarity, a margin over the runner-up and a
+    # softmax confidence (scores / temperature). At temperature 0.05 the 0.1 margin alone means
+    # a confidence of at least 0.88 between two categories (a 0.05 gap would only give 0.73).
+    classifier_fast_path: bool = True
+    classifier_confidence_threshold: float = 0.6
+    classifier_min_similarity: float = 0.35
+    classifier_min_margin: float = 0.1
+    classifier_temperature: float = 0.05
+    classifier_label_cache_size: int = 512
+    
+    # Structured Extraction Configuration
+    extraction_max_tokens: int = 2000
+    extraction_max_reasks: int = 1
+    extraction_schema_cache_size: int = 256
+    
+    # Vector Index Configuration
+    vector_index_dtype: str = "float16"  # float16 or int8
+    vector_max_open_shards: int = 256
+    vector_compact_segments: int = 8
+    vector_ivf_min_rows: int = 50000
+    vector_ivf_max_lists: int = 4096
+    vector_ivf_nprobe: int = 16
+    
+    # Hybrid Retrieval Configuration
+    retrieval_candidate_factor: int = 4
+    lexical_plan_cache_size: int = 1024
+    
     class Config:
         env_file = ".env"
         case_sensitive = False
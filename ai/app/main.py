@@ -1,10 +1,18 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Path, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer
+import asyncio
 import os
+import hashlib
+import tempfile
 import time
 import uuid
-from typing import Dict, Any, List, Optional
+from contextlib import asynccontextmanager
+from typing import Dict, Any, AsyncIterator, List, Optional
+
+from platform_common.codec import CompressionMiddleware, FastJSONResponse, dumps, dumps_str, loads
+from platform_common.diagnostics import CaptureInProgress, Diagnostics, ProfilingMiddleware
 
 from .models import (
     AIRequest, 
@@ -14,14 +22,58 @@ from .models import (
     ClassifyRequest,
     GenerateRequest,
     ChatRequest,
-    ChatResponse
+    ChatResponse,
+    IngestRequest,
+    EmbedRequest,
+    JobRequest,
+    RetrieveRequest
 )
 from .services.ai_service import AIService
 from .services.cache_service import CacheService
 from .services.logging_service import LoggingService
+from .services.summarization_service import SummarizationService
+from .services.classification_service import ClassificationService
+from .services.context_budget import ContextBudgetService
+from .services.session_service import SessionService
+from .services.embedding_service import EmbeddingService
+from .services.ingestion_service import IngestionService
+from .services.vector_index import VectorIndex
+from .services.job_service import JobService
+from .services.bulk_service import BulkHandler, BulkService, read_chunks, split_lines
+from .services.redis_service import RedisService
+from .services.structured_output import StructuredOutputError
+from .rpc import RpcServer
+from .services.scheduler import Overloaded, RequestContext, RequestContextMiddleware, TenantScheduler, request_context
 from .config import settings
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Per-worker resources.
+    
+    The shared Redis pools, provider clients and the embedding thread are
+    created here, in each worker process after fork, never at import time. On
+    shutdown the server has already drained in-flight requests; background
+    ingestion jobs get settings.shutdown_grace_seconds to finish before they
+    are cancelled.
+    """
+    await redis_service.connect()
+    await ai_service.connect()
+    await session_service.connect()
+    diagnostics.start()
+    if settings.grpc_port:
+        await rpc_server.start(settings.grpc_port)
+    yield
+    await rpc_server.stop(settings.shutdown_grace_seconds)
+    await diagnostics.stop()
+    await ingestion_service.disconnect()
+    await embedding_service.close()
+    await ai_service.disconnect()
+    await redis_service.disconnect()
+
 app = FastAPI(
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
     title="AI Agent Platform - AI Service",
     description="""
     # AI Agent Platform - AI Service
@@ -91,26 +143,62 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if settings.response_compression_min_size:
+    app.add_middleware(CompressionMiddleware, minimum_size=settings.response_compression_min_size)
+app.add_middleware(RequestContextMiddleware)
+
+# Loop monitor and on-demand profiling of this worker
+diagnostics = Diagnostics(
+    settings.diagnostics_token,
+    sample_interval=settings.diagnostics_sample_interval_ms / 1000,
+    loop_monitor=settings.diagnostics_loop_monitor,
+    slow_callback=settings.diagnostics_slow_callback_ms / 1000
+)
+app.add_middleware(ProfilingMiddleware, diagnostics=diagnostics)
 
 # Security
 security = HTTPBearer()
 
 # Services
-ai_service = AIService()
-cache_service = CacheService()
-logging_service = LoggingService()
-
-@app.on_event("startup")
-async def startup_event():
-    """Initialize services on startup"""
-    await cache_service.connect()
-    await logging_service.connect()
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Cleanup on shutdown"""
-    await cache_service.disconnect()
-    await logging_service.disconnect()
+scheduler = TenantScheduler()
+redis_service = RedisService()
+ai_service = AIService(scheduler)
+cache_service = CacheService(redis_service)
+logging_service = LoggingService(redis_service)
+session_service = SessionService(redis_service)
+embedding_service = EmbeddingService()
+ingestion_service = IngestionService(embedding_service, redis_service)
+vector_index = VectorIndex(embedding_service)
+classification_service = ClassificationService(ai_service, embedding_service)
+summarization_service = SummarizationService(ai_service, cache_service)
+context_budget_service = ContextBudgetService(ai_service, cache_service)
+job_service = JobService(redis_service)
+bulk_service = BulkService(redis_service)
+
+# Request models of the operations that can run as asynchronous jobs
+JOB_OPERATIONS = {
+    "summarize": SummarizeRequest,
+    "extract": ExtractRequest,
+    "classify": ClassifyRequest,
+    "generate": GenerateRequest
+}
+
+def _model_response(model: type, **fields: Any) -> FastJSONResponse:
+    """
+    Respond with a response model's fields without constructing and re-validating it.
+    
+    Returning a Response skips FastAPI's response_model pass; the model still
+    documents the endpoint.
+    """
+    content = {
+        name: fields[name] if name in fields else field.default
+        for name, field in model.model_fields.items()
+    }
+    return FastJSONResponse(content)
+
+# Load the embedding model before workers fork so its weights are shared copy-on-write
+if settings.embedding_preload:
+    embedding_service.preload()
 
 @app.get("/health", 
     summary="Health Check",
@@ -145,6 +233,7 @@ async def summarize_text(request: SummarizeRequest):
     
     This endpoint uses AI to create concise summaries of provided text. The service supports
     multiple AI providers and includes intelligent caching to reduce costs and improve performance.
+    Documents longer than a single prompt are summarized with a parallel map-reduce pipeline.
     
     Args:
         request (SummarizeRequest): The text to summarize and model configuration
@@ -158,24 +247,23 @@ async def summarize_text(request: SummarizeRequest):
     start_time = time.time()
     
     try:
-        # Check cache first
-        cache_key = f"summarize:{hash(request.text)}"
-        cached_result = await cache_service.get(cache_key)
-        if cached_result:
-            return AIResponse(
+        # Served from cache (stale entries are refreshed in the background) or processed with AI
+        with ai_service.track_usage() as usage:
+            summary, cached = await cache_service.get_or_refresh(
+                _summary_cache_key(request),
+                lambda: summarization_service.summarize(request.text, request.model, request.max_length),
+                "summarize"
+            )
+        if cached:
+            return _model_response(
+                AIResponse,
                 success=True,
-                data={"summary": cached_result},
+                data={"summary": summary},
                 model_used="cached",
                 tokens_used=0,
                 execution_time_ms=int((time.time() - start_time) * 1000)
             )
         
-        # Process with AI
-        summary = await ai_service.summarize_text(request.text, request.model)
-        
-        # Cache result
-        await cache_service.set(cache_key, summary, expire=3600)
-        
         # Log request
         await logging_service.log_request(
             service_name="ai",
@@ -183,18 +271,22 @@ async def summarize_text(request: SummarizeRequest):
             request_data={"text_length": len(request.text)},
             response_data={"summary_length": len(summary)},
             model_used=request.model,
+            tokens_used=usage.total_tokens,
             execution_time_ms=int((time.time() - start_time) * 1000),
             status="success"
         )
         
-        return AIResponse(
+        return _model_response(
+            AIResponse,
             success=True,
             data={"summary": summary},
             model_used=request.model,
-            tokens_used=ai_service.get_last_token_count(),
+            tokens_used=usage.total_tokens,
             execution_time_ms=int((time.time() - start_time) * 1000)
         )
         
+    except Overloaded as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
     except Exception as e:
         await logging_service.log_request(
             service_name="ai",
@@ -206,17 +298,48 @@ async def summarize_text(request: SummarizeRequest):
         )
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/summarize/stream",
+    summary="Summarize Text (Streaming Progress)",
+    description="Summarize long text, streaming map-reduce progress as server-sent events.",
+    tags=["AI Operations"]
+)
+async def summarize_text_stream(request: SummarizeRequest):
+    """
+    Summarize text while streaming progress events.
+    
+    Emits `chunked`, `chunk_done`, `reduce` and `finalize` events while the document is
+    processed, then a final `done` event carrying the summary (or an `error` event).
+    """
+    async def event_stream():
+        started = time.monotonic()
+        async for event in summarization_service.stream(request.text, request.model, request.max_length):
+            if event["event"] == "done":
+                await cache_service.set_entry(
+                    _summary_cache_key(request), event["summary"], "summarize", time.monotonic() - started
+                )
+            yield f"data: {dumps_str(event)}\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+def _summary_cache_key(request: SummarizeRequest) -> str:
+    """Stable cache key for a whole-document summary"""
+    digest = hashlib.sha256(
+        f"{request.model}\0{request.max_length}\0{request.text}".encode("utf-8")
+    ).hexdigest()
+    return f"summarize:{digest}"
+
 @app.post("/extract", response_model=AIResponse)
 async def extract_data(request: ExtractRequest):
-    """Extract structured data from text"""
+    """Extract structured data from text, validated against the request schema"""
     start_time = time.time()
     
     try:
-        extracted_data = await ai_service.extract_data(
-            request.text, 
-            request.schema, 
-            request.model
-        )
+        with ai_service.track_usage() as usage:
+            extracted_data = await ai_service.extract_data(
+                request.text, 
+                request.schema, 
+                request.model
+            )
         
         await logging_service.log_request(
             service_name="ai",
@@ -224,18 +347,22 @@ async def extract_data(request: ExtractRequest):
             request_data={"text_length": len(request.text)},
             response_data={"extracted_fields": len(extracted_data)},
             model_used=request.model,
+            tokens_used=usage.total_tokens,
             execution_time_ms=int((time.time() - start_time) * 1000),
             status="success"
         )
         
-        return AIResponse(
+        return _model_response(
+            AIResponse,
             success=True,
             data={"extracted_data": extracted_data},
             model_used=request.model,
-            tokens_used=ai_service.get_last_token_count(),
+            tokens_used=usage.total_tokens,
             execution_time_ms=int((time.time() - start_time) * 1000)
         )
         
+    except Overloaded as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
     except Exception as e:
         await logging_service.log_request(
             service_name="ai",
@@ -245,38 +372,68 @@ async def extract_data(request: ExtractRequest):
             execution_time_ms=int((time.time() - start_time) * 1000),
             status="error"
         )
+        if isinstance(e, StructuredOutputError):
+            raise HTTPException(status_code=422, detail=str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/extract/stream",
+    summary="Extract Data (Streaming Fields)",
+    description="Extract structured data, streaming each field as server-sent events as soon as it is parsed.",
+    tags=["AI Operations"]
+)
+async def extract_data_stream(request: ExtractRequest):
+    """
+    Extract structured data while streaming fields.
+    
+    Emits a `field` event per top-level field as soon as the model has written it,
+    then a `done` event carrying the validated object (or an `error` event).
+    """
+    async def event_stream():
+        try:
+            async for event in ai_service.stream_extract(request.text, request.schema, request.model):
+                yield f"data: {dumps_str(event)}\n\n"
+        except Exception as e:
+            yield f"data: {dumps_str({'event': 'error', 'message': str(e)})}\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.post("/classify", response_model=AIResponse)
 async def classify_text(request: ClassifyRequest):
-    """Classify text into categories"""
+    """Classify text into categories (embedding fast path, LLM for ambiguous texts)"""
     start_time = time.time()
     
     try:
-        classification = await ai_service.classify_text(
-            request.text,
-            request.categories,
-            request.model
-        )
+        with ai_service.track_usage() as usage:
+            result = await classification_service.classify(
+                request.text,
+                request.categories,
+                request.model,
+                request.examples
+            )
+        model_used = request.model if result["method"] == "llm" else settings.embedding_model
         
         await logging_service.log_request(
             service_name="ai",
             request_type="classify",
             request_data={"text_length": len(request.text)},
-            response_data={"classification": classification},
-            model_used=request.model,
+            response_data=result,
+            model_used=model_used,
+            tokens_used=usage.total_tokens,
             execution_time_ms=int((time.time() - start_time) * 1000),
             status="success"
         )
         
-        return AIResponse(
+        return _model_response(
+            AIResponse,
             success=True,
-            data={"classification": classification},
-            model_used=request.model,
-            tokens_used=ai_service.get_last_token_count(),
+            data=result,
+            model_used=model_used,
+            tokens_used=usage.total_tokens,
             execution_time_ms=int((time.time() - start_time) * 1000)
         )
         
+    except Overloaded as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
     except Exception as e:
         await logging_service.log_request(
             service_name="ai",
@@ -288,17 +445,23 @@ async def classify_text(request: ClassifyRequest):
         )
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/classify/metrics", tags=["Health"])
+async def get_classification_metrics():
+    """How many classifications the embedding fast path answered in this worker process"""
+    return classification_service.metrics()
+
 @app.post("/generate", response_model=AIResponse)
 async def generate_content(request: GenerateRequest):
     """Generate content based on prompt"""
     start_time = time.time()
     
     try:
-        generated_content = await ai_service.generate_content(
-            request.prompt,
-            request.max_tokens,
-            request.model
-        )
+        with ai_service.track_usage() as usage:
+            generated_content = await ai_service.generate_content(
+                request.prompt,
+                request.max_tokens,
+                request.model
+            )
         
         await logging_service.log_request(
             service_name="ai",
@@ -306,18 +469,24 @@ async def generate_content(request: GenerateRequest):
             request_data={"prompt_length": len(request.prompt)},
             response_data={"content_length": len(generated_content)},
             model_used=request.model,
+            tokens_used=usage.total_tokens,
+            cached_tokens=usage.cached_tokens,
             execution_time_ms=int((time.time() - start_time) * 1000),
             status="success"
         )
         
-        return AIResponse(
+        return _model_response(
+            AIResponse,
             success=True,
             data={"generated_content": generated_content},
             model_used=request.model,
-            tokens_used=ai_service.get_last_token_count(),
+            tokens_used=usage.total_tokens,
+            cached_tokens=usage.cached_tokens,
             execution_time_ms=int((time.time() - start_time) * 1000)
         )
         
+    except Overloaded as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
     except Exception as e:
         await logging_service.log_request(
             service_name="ai",
@@ -329,36 +498,203 @@ async def generate_content(request: GenerateRequest):
         )
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/jobs",
+    status_code=202,
+    summary="Submit AI Job",
+    description="Queue a summarize, extract, classify or generate request for a worker and return a job id immediately.",
+    tags=["Jobs"]
+)
+async def submit_job(request: JobRequest):
+    """
+    Submit a long-running AI operation as a job.
+    
+    The result can be polled (or long-polled with `wait`) at `/jobs/{job_id}`, or
+    delivered to `webhook_url`.
+    """
+    request_model = JOB_OPERATIONS.get(request.operation)
+    if request_model is None:
+        raise HTTPException(status_code=400, detail=f"Unsupported job operation: {request.operation}")
+    try:
+        payload = request_model(**request.payload).model_dump()
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    
+    try:
+        context = request_context.get()
+        job_id = await job_service.submit(
+            request.operation,
+            payload,
+            request.company_id,
+            request.webhook_url,
+            plan=context.plan if context else None,
+            token_reservation_id=request.token_reservation_id
+        )
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    return {"success": True, "job_id": job_id, "status": "queued"}
+
+@app.get("/jobs/{job_id}", tags=["Jobs"])
+async def get_job(job_id: str, company_id: str, wait: float = 0):
+    """Get a job of the company, waiting up to `wait` seconds for it to finish"""
+    job = await job_service.get(job_id, wait)
+    if not job or job.get("company_id") != company_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/bulk",
+    summary="Bulk Processing (JSONL)",
+    description="Run a JSONL upload of summarize, classify, extract or generate items, streaming back one JSONL result record per item.",
+    tags=["Jobs"]
+)
+async def process_bulk(
+    request: Request,
+    operation: Optional[str] = None,
+    company_id: Optional[str] = None,
+    bulk_id: Optional[str] = None,
+    concurrency: Optional[int] = Query(default=None, ge=1)
+):
+    """
+    Bulk processing for offline workloads (throughput, not latency).
+    
+    The body is JSONL (`application/x-ndjson`): request bodies of `operation`, or
+    envelopes {"id", "operation", "payload"}. Items run as the tenant's batch
+    work with bounded concurrency, and their result records are streamed back as
+    they finish, each carrying its input `line`. With a `bulk_id`, delivered
+    lines are checkpointed per tenant: sending the same input with the same id
+    after an interruption only processes the lines that were not delivered, and
+    a different input under that id is rejected with 409.
+    """
+    if operation is not None and operation not in BULK_HANDLERS:
+        raise HTTPException(status_code=400, detail=f"Unsupported bulk operation: {operation}")
+    # Spooled to disk first: the streamed response listens for the client
+    # disconnecting on the channel the body arrives on
+    upload = tempfile.TemporaryFile()
+    digest = hashlib.sha256()
+    try:
+        async for chunk in request.stream():
+            digest.update(chunk)
+            await asyncio.to_thread(upload.write, chunk)
+    except BaseException:
+        upload.close()
+        raise
+    upload.seek(0)
+    
+    context = request_context.get()
+    item_context = RequestContext(
+        company_id or (context.tenant if context else "anonymous"),
+        context.plan if context else settings.scheduler_default_plan,
+        "batch"
+    )
+    
+    checkpoint = None
+    if bulk_id:
+        try:
+            checkpoint = await bulk_service.load_checkpoint(item_context.tenant, bulk_id, digest.hexdigest())
+        except ValueError as e:
+            upload.close()
+            raise HTTPException(status_code=409, detail=str(e))
+        except RuntimeError as e:
+            upload.close()
+            raise HTTPException(status_code=503, detail=str(e))
+    
+    async def result_stream():
+        try:
+            lines = split_lines(read_chunks(upload))
+            async for record in bulk_service.run(lines, BULK_HANDLERS, item_context, operation, checkpoint, concurrency):
+                yield dumps(record) + b"\n"
+                if bulk_id:
+                    await bulk_service.mark(item_context.tenant, bulk_id, record["line"])
+        finally:
+            upload.close()
+    
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat_completion(request: ChatRequest):
-    """Chat completion with conversation history"""
+    """
+    Chat completion with conversation history, trimmed to the context budget.
+    
+    With a session_id the history is kept server-side and the request only carries
+    the new messages of the turn; they are appended together with the reply.
+    """
     start_time = time.time()
     
+    if request.session_id and not request.company_id:
+        raise HTTPException(status_code=400, detail="company_id is required with session_id")
+    
     try:
-        response = await ai_service.chat_completion(
-            request.messages,
-            request.model,
-            request.temperature
-        )
+        new_messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+        history = []
+        if request.session_id:
+            history = await session_service.get_history(request.company_id, request.session_id)
+        
+        with ai_service.track_usage() as usage:
+            messages, token_accounting = await context_budget_service.fit(
+                history + new_messages,
+                request.model,
+                request.max_tokens,
+                request.context_budget,
+                request.context_policy
+            )
+            summary_tokens = usage.total_tokens
+            response = await ai_service.chat_completion(
+                messages,
+                request.model,
+                request.temperature,
+                request.max_tokens
+            )
+        
+        if request.session_id:
+            await session_service.append(
+                request.company_id,
+                request.session_id,
+                new_messages + [{"role": "assistant", "content": response}]
+            )
+        
+        token_accounting.update({
+            "summary_tokens": summary_tokens,
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "cached_tokens": usage.cached_tokens,
+            "cache_write_tokens": usage.cache_write_tokens,
+            "total_tokens": usage.total_tokens
+        })
         
         await logging_service.log_request(
             service_name="ai",
             request_type="chat",
-            request_data={"messages_count": len(request.messages)},
+            request_data={
+                "messages_count": len(request.messages),
+                "history_count": len(history),
+                "sent_messages": len(messages)
+            },
             response_data={"response_length": len(response)},
             model_used=request.model,
+            tokens_used=usage.total_tokens,
+            cached_tokens=usage.cached_tokens,
             execution_time_ms=int((time.time() - start_time) * 1000),
             status="success"
         )
         
-        return ChatResponse(
+        return _model_response(
+            ChatResponse,
             success=True,
             message=response,
+            session_id=request.session_id,
             model_used=request.model,
-            tokens_used=ai_service.get_last_token_count(),
-            execution_time_ms=int((time.time() - start_time) * 1000)
+            tokens_used=usage.total_tokens,
+            prompt_tokens=usage.prompt_tokens,
+            completion_tokens=usage.completion_tokens,
+            cached_tokens=usage.cached_tokens,
+            execution_time_ms=int((time.time() - start_time) * 1000),
+            token_accounting=token_accounting
         )
         
+    except Overloaded as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
     except Exception as e:
         await logging_service.log_request(
             service_name="ai",
@@ -370,6 +706,277 @@ async def chat_completion(request: ChatRequest):
         )
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _chat_stream_events(request: ChatRequest) -> AsyncIterator[Dict[str, Any]]:
+    """
+    One chat turn, streamed: {"delta": text} events, then {"usage": {...}} once
+    the reply is complete and the session has been updated. Shared by
+    /chat/stream and the gRPC ChatStream method.
+    """
+    start_time = time.time()
+    
+    if request.session_id and not request.company_id:
+        raise HTTPException(status_code=400, detail="company_id is required with session_id")
+    
+    try:
+        new_messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+        history = []
+        if request.session_id:
+            history = await session_service.get_history(request.company_id, request.session_id)
+        
+        chunks: List[str] = []
+        with ai_service.track_usage() as usage:
+            messages, _ = await context_budget_service.fit(
+                history + new_messages,
+                request.model,
+                request.max_tokens,
+                request.context_budget,
+                request.context_policy
+            )
+            async for delta in ai_service.stream_chat(messages, request.model, request.temperature, request.max_tokens):
+                chunks.append(delta)
+                yield {"delta": delta}
+        response = "".join(chunks)
+        
+        if request.session_id:
+            await session_service.append(
+                request.company_id,
+                request.session_id,
+                new_messages + [{"role": "assistant", "content": response}]
+            )
+        
+        await logging_service.log_request(
+            service_name="ai",
+            request_type="chat_stream",
+            request_data={
+                "messages_count": len(request.messages),
+                "history_count": len(history),
+                "sent_messages": len(messages)
+            },
+            response_data={"response_length": len(response)},
+            model_used=request.model,
+            tokens_used=usage.total_tokens,
+            cached_tokens=usage.cached_tokens,
+            execution_time_ms=int((time.time() - start_time) * 1000),
+            status="success"
+        )
+        
+        yield {"usage": {
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "cached_tokens": usage.cached_tokens,
+            "total_tokens": usage.total_tokens
+        }}
+    
+    except Overloaded:
+        raise
+    except Exception as e:
+        await logging_service.log_request(
+            service_name="ai",
+            request_type="chat_stream",
+            request_data={"messages_count": len(request.messages)},
+            error_message=str(e),
+            execution_time_ms=int((time.time() - start_time) * 1000),
+            status="error"
+        )
+        raise
+
+@app.post("/chat/stream",
+    summary="Chat Completion (Streaming)",
+    description="Chat completion streamed as plain text deltas.",
+    tags=["AI Operations"]
+)
+async def chat_completion_stream(request: ChatRequest):
+    """Chat completion streamed as plain text; sessions are updated once the reply is complete"""
+    if request.session_id and not request.company_id:
+        raise HTTPException(status_code=400, detail="company_id is required with session_id")
+    
+    async def text_stream():
+        async for event in _chat_stream_events(request):
+            if "delta" in event:
+                yield event["delta"]
+    
+    return StreamingResponse(text_stream(), media_type="text/plain; charset=utf-8")
+
+@app.delete("/chat/sessions/{session_id}")
+async def delete_chat_session(session_id: str, company_id: str):
+    """Delete a server-side chat session"""
+    deleted = await session_service.delete(company_id, session_id)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"success": True, "session_id": session_id}
+
+@app.post("/knowledge-bases/{knowledge_base_id}/ingest",
+    status_code=202,
+    summary="Ingest Knowledge Base",
+    description="Start a background job that incrementally ingests and embeds a knowledge base's documents.",
+    tags=["Knowledge Bases"]
+)
+async def ingest_knowledge_base(
+    request: IngestRequest,
+    knowledge_base_id: str = Path(..., pattern=r"^[A-Za-z0-9_-]+$", max_length=128)
+):
+    """
+    Start an incremental ingestion job.
+    
+    Only chunks whose content changed since the last sync are embedded; the returned
+    job id can be polled for progress.
+    """
+    try:
+        job_id = await ingestion_service.start(
+            request.company_id,
+            knowledge_base_id,
+            request.source_type,
+            request.source_config,
+            request.prune_missing
+        )
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    return {"success": True, "job_id": job_id, "knowledge_base_id": knowledge_base_id}
+
+@app.get("/knowledge-bases/ingest/{job_id}", tags=["Knowledge Bases"])
+async def get_ingestion_job(job_id: str, company_id: str):
+    """Get the progress of a knowledge base ingestion job of the company"""
+    job = await ingestion_service.get_job(job_id)
+    if not job or job.get("company_id") != company_id:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+    return job
+
+@app.post("/embed",
+    summary="Embed Texts",
+    description="Embed texts with the shared sentence-transformers model. Concurrent requests are micro-batched.",
+    tags=["Embeddings"]
+)
+async def embed_texts(request: EmbedRequest):
+    """Return L2-normalized embeddings of the given texts"""
+    if len(request.texts) > settings.embedding_max_texts:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.embedding_max_texts} texts can be embedded per request"
+        )
+    start_time = time.time()
+    
+    try:
+        embeddings = await embedding_service.embed(request.texts)
+    except Exception as e:
+        await logging_service.log_request(
+            service_name="ai",
+            request_type="embed",
+            request_data={"texts": len(request.texts)},
+            error_message=str(e),
+            execution_time_ms=int((time.time() - start_time) * 1000),
+            status="error"
+        )
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return {
+        "success": True,
+        "model": settings.embedding_model,
+        "dimension": embeddings.shape[1],
+        "embeddings": embeddings.tolist(),
+        "execution_time_ms": int((time.time() - start_time) * 1000)
+    }
+
+@app.get("/embed/metrics", tags=["Embeddings"])
+async def get_embedding_metrics():
+    """Batching throughput and cache metrics of this worker's embedding model"""
+    return embedding_service.metrics()
+
+@app.post("/retrieve",
+    summary="Retrieve Knowledge",
+    description="Find the knowledge base chunks most relevant to a query by BM25 and vector similarity.",
+    tags=["Knowledge Bases"]
+)
+async def retrieve(request: RetrieveRequest):
+    """Hybrid search over a company's knowledge bases, optionally filtered by document"""
+    start_time = time.time()
+    
+    try:
+        results = await vector_index.search(
+            request.company_id,
+            request.knowledge_base_ids,
+            request.query,
+            request.top_k,
+            request.document_ids,
+            request.mode
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        await logging_service.log_request(
+            service_name="ai",
+            request_type="retrieve",
+            request_data={"query_length": len(request.query)},
+            error_message=str(e),
+            execution_time_ms=int((time.time() - start_time) * 1000),
+            status="error"
+        )
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return {
+        "success": True,
+        "results": results,
+        "execution_time_ms": int((time.time() - start_time) * 1000)
+    }
+
+@app.get("/redis/metrics", tags=["Health"])
+async def get_redis_metrics():
+    """Redis health, auto-pipelining and connection pool metrics of this worker process"""
+    return redis_service.metrics()
+
+@app.get("/cache/metrics", tags=["Health"])
+async def get_cache_metrics():
+    """Cache value compression of this worker and Redis memory use per budgeted namespace"""
+    return await cache_service.metrics()
+
+@app.get("/scheduler/metrics", tags=["Health"])
+async def get_scheduler_metrics():
+    """Provider-call queue metrics of this worker, per tenant"""
+    return scheduler.metrics()
+
+def require_diagnostics_token(x_diagnostics_token: Optional[str] = Header(default=None)):
+    """Guard of the /debug endpoints, which do not exist without a configured token"""
+    if diagnostics.token is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not diagnostics.authorized(x_diagnostics_token):
+        raise HTTPException(status_code=403, detail="Invalid diagnostics token")
+
+@app.get("/debug/loop", tags=["Diagnostics"], dependencies=[Depends(require_diagnostics_token)])
+async def get_loop_diagnostics():
+    """Event-loop lag and recent stalls (with the blocking stack) of this worker"""
+    return diagnostics.metrics()
+
+@app.post("/debug/profile", tags=["Diagnostics"], dependencies=[Depends(require_diagnostics_token)])
+async def capture_cpu_profile(seconds: float = Query(default=10.0, gt=0, le=60)):
+    """Sample every thread of this worker for a while; folded stacks for flamegraph tools"""
+    try:
+        return PlainTextResponse(await diagnostics.capture_cpu(seconds))
+    except CaptureInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/debug/profiles/{profile_id}", tags=["Diagnostics"], dependencies=[Depends(require_diagnostics_token)])
+async def get_request_profile(profile_id: str):
+    """Folded stacks of a request profiled with the X-Profile header (named by its X-Profile-Id)"""
+    profile = diagnostics.profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(profile)
+
+@app.post("/debug/memory", tags=["Diagnostics"], dependencies=[Depends(require_diagnostics_token)])
+async def capture_memory_snapshot(
+    seconds: float = Query(default=5.0, ge=0, le=60),
+    limit: int = Query(default=25, ge=1, le=500)
+):
+    """Allocations of this worker that were made during the window and are still alive"""
+    try:
+        return await diagnostics.capture_memory(seconds, limit)
+    except CaptureInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
 @app.get("/models")
 async def list_available_models():
     """List available AI models"""
@@ -382,6 +989,40 @@ async def list_available_models():
         ]
     }
 
+def _bulk_handler(model: type, endpoint: Any) -> BulkHandler:
+    """Run an endpoint function on a bulk item's payload, returning its response body"""
+    async def handler(payload: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            response = await endpoint(model.model_validate(payload))
+        except HTTPException as e:
+            if e.headers and "Retry-After" in e.headers:
+                # Shed: the bulk run waits and retries it
+                raise Overloaded(str(e.detail), e.status_code, float(e.headers["Retry-After"]))
+            raise Exception(str(e.detail))
+        return loads(response.body)
+    return handler
+
+# Operations of the bulk endpoint
+BULK_HANDLERS = {
+    "summarize": _bulk_handler(SummarizeRequest, summarize_text),
+    "extract": _bulk_handler(ExtractRequest, extract_data),
+    "classify": _bulk_handler(ClassifyRequest, classify_text),
+    "generate": _bulk_handler(GenerateRequest, generate_content)
+}
+
+# Internal gRPC interface: the same handlers as the HTTP endpoints
+rpc_server = RpcServer(
+    unary={
+        "Chat": (ChatRequest, chat_completion),
+        "Summarize": (SummarizeRequest, summarize_text),
+        "Extract": (ExtractRequest, extract_data),
+        "Classify": (ClassifyRequest, classify_text),
+        "Generate": (GenerateRequest, generate_content)
+    },
+    streams={"ChatStream": (ChatRequest, _chat_stream_events)}
+)
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Multi-process serving: gunicorn -c gunicorn.conf.py app.main:app
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, workers=settings.workers)
@@ -15,6 +15,7 @@ class AIResponse(BaseModel):
     data: Dict[str, Any] = Field(description="Response data from the AI operation")
     model_used: str = Field(description="The AI model that was used")
     tokens_used: int = Field(description="Number of tokens consumed")
+    cached_tokens: int = Field(default=0, description="Prompt tokens served from the provider's prompt cache")
     execution_time_ms: int = Field(description="Execution time in milliseconds")
     error_message: Optional[str] = Field(default=None, description="Error message if operation failed")
 
@@ -39,7 +40,11 @@ class ExtractRequest(AIRequest):
 class ClassifyRequest(AIRequest):
     """Request model for text classification"""
     text: str = Field(..., description="Text to classify")
-    categories: List[str] = Field(..., description="Categories to classify into")
+    categories: List[str] = Field(..., min_length=1, description="Categories to classify into")
+    examples: Optional[Dict[str, List[str]]] = Field(
+        default=None,
+        description="Labeled example texts per category, used by the embedding fast path"
+    )
 
 class GenerateRequest(AIRequest):
     """Request model for content generation"""
@@ -53,14 +58,95 @@ class ChatMessage(BaseModel):
 
 class ChatRequest(AIRequest):
     """Request model for chat completion"""
-    messages: List[ChatMessage] = Field(..., description="Conversation history")
+    messages: List[ChatMessage] = Field(
+        ...,
+        description="Conversation history, or only the new messages of the turn when session_id is set"
+    )
+    session_id: Optional[str] = Field(
+        default=None,
+        description="Server-side session holding the conversation history"
+    )
+    company_id: Optional[str] = Field(
+        default=None,
+        description="Company owning the session (required with session_id)"
+    )
     temperature: float = Field(default=0.7, description="Temperature for response generation")
+    max_tokens: int = Field(default=1000, description="Maximum tokens to generate")
+    context_budget: Optional[int] = Field(
+        default=None,
+        description="Prompt token budget for the conversation (defaults to the model's context window minus max_tokens)"
+    )
+    context_policy: Optional[str] = Field(
+        default=None,
+        description="How to fit the conversation into the budget: sliding_window, pin_system or summarize"
+    )
+
+class IngestRequest(BaseModel):
+    """Request model for knowledge base ingestion"""
+    company_id: str = Field(
+        ...,
+        pattern=r"^[A-Za-z0-9_-]+$",
+        max_length=128,
+        description="Company owning the knowledge base"
+    )
+    source_type: str = Field(
+        default="document",
+        description="Knowledge base source type: document, file, website or api"
+    )
+    source_config: Dict[str, Any] = Field(
+        default_factory=dict,
+        description="Source settings: a `path` under the ingestion root, `urls`, or inline `documents` ([{id, text}])"
+    )
+    prune_missing: bool = Field(
+        default=True,
+        description="Remove documents that are no longer present in the source"
+    )
+
+class EmbedRequest(BaseModel):
+    """Request model for text embeddings"""
+    texts: List[str] = Field(..., min_length=1, description="Texts to embed")
+
+class JobRequest(BaseModel):
+    """Request model for an asynchronous AI job"""
+    operation: str = Field(..., description="Operation to run: summarize, extract, classify or generate")
+    payload: Dict[str, Any] = Field(..., description="Request body of the operation's endpoint")
+    company_id: str = Field(..., description="Company submitting the job; only it can read the job")
+    webhook_url: Optional[str] = Field(
+        default=None,
+        description="URL that receives a POST with the job result when it finishes"
+    )
+    token_reservation_id: Optional[str] = Field(
+        default=None,
+        pattern=r"^[0-9a-f-]{36}$",
+        description="Id of the gateway's token reservation for the job's estimate; "
+                    "settled against the tokens it used when it finishes"
+    )
+
+class RetrieveRequest(BaseModel):
+    """Request model for knowledge base retrieval"""
+    company_id: str = Field(..., description="Company owning the knowledge bases")
+    knowledge_base_ids: List[str] = Field(..., description="Knowledge bases to search")
+    query: str = Field(..., description="Search query")
+    top_k: int = Field(default=5, ge=1, le=100, description="Number of chunks to return")
+    document_ids: Optional[List[str]] = Field(
+        default=None,
+        description="Only return chunks of these documents"
+    )
+    mode: str = Field(
+        default="hybrid",
+        description="Retrieval mode: 'hybrid' (BM25 + vector, rank-fused), 'vector' or 'lexical'"
+    )
 
 class ChatResponse(BaseModel):
     """Response model for chat completion"""
     success: bool
     message: str
+    session_id: Optional[str] = None
     model_used: str
     tokens_used: int
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
     execution_time_ms: int
+    token_accounting: Optional[Dict[str, Any]] = None
     error_message: Optional[str] = None
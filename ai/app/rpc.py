@@ -0,0 +1,149 @@
+"""
+Internal gRPC interface of the AI service, for the gateway.
+
+The operations below are served on settings.grpc_port next to the HTTP API, so
+the gateway can multiplex all of its calls over one long-lived HTTP/2 channel
+instead of a JSON request per HTTP/1.1 connection. Methods of ai.AIService take
+the operation's JSON request body and answer with exactly the body the HTTP
+endpoint returns; ChatStream sends one message per event ({"delta": text},
+then {"usage": {...}}). There is no generated code: payloads are the
+orjson / pydantic-core JSON both paths already produce and validate.
+
+Metadata carries x-tenant-id, x-tenant-plan and x-request-priority like the
+HTTP headers, and the gRPC deadline becomes the request deadline. Failures
+carry the HTTP status in the x-http-status trailer (and retry-after when the
+request was shed), so the gateway answers exactly as over HTTP.
+"""
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple, Type
+
+import grpc
+from fastapi import HTTPException
+from pydantic import BaseModel, ValidationError
+from starlette.responses import Response
+
+from platform_common.codec import dumps
+
+from .services.scheduler import Overloaded, RequestContext, request_context
+from .config import settings
+
+SERVICE = "ai.AIService"
+
+GRPC_STATUS = {
+    400: grpc.StatusCode.INVALID_ARGUMENT,
+    403: grpc.StatusCode.PERMISSION_DENIED,
+    404: grpc.StatusCode.NOT_FOUND,
+    422: grpc.StatusCode.INVALID_ARGUMENT,
+    429: grpc.StatusCode.RESOURCE_EXHAUSTED,
+    503: grpc.StatusCode.UNAVAILABLE,
+    504: grpc.StatusCode.DEADLINE_EXCEEDED
+}
+
+UnaryHandler = Callable[[Any], Awaitable[Any]]
+StreamHandler = Callable[[Any], AsyncIterator[Dict[str, Any]]]
+
+
+def _body(result: Any) -> bytes:
+    """Wire form of an endpoint's return value (rendered responses are sent as they are)"""
+    if isinstance(result, Response):
+        return result.body
+    if isinstance(result, BaseModel):
+        return dumps(result.model_dump())
+    return dumps(result)
+
+
+class RpcServer:
+    """gRPC server exposing endpoint functions, each with the request model its payload is validated by"""
+
+    def __init__(
+        self,
+        unary: Dict[str, Tuple[Type[BaseModel], UnaryHandler]],
+        streams: Dict[str, Tuple[Type[BaseModel], StreamHandler]]
+    ):
+        self.unary = unary
+        self.streams = streams
+        self.server: Optional[grpc.aio.Server] = None
+
+    async def start(self, port: int) -> int:
+        """Serve on the port (per worker process; workers share it with SO_REUSEPORT); returns the bound port"""
+        handlers = {
+            name: grpc.unary_unary_rpc_method_handler(self._unary_call(model, handler))
+            for name, (model, handler) in self.unary.items()
+        }
+        handlers.update({
+            name: grpc.unary_stream_rpc_method_handler(self._stream_call(model, handler))
+            for name, (model, handler) in self.streams.items()
+        })
+        self.server = grpc.aio.server(
+            # Beyond this the server answers RESOURCE_EXHAUSTED, like the HTTP in-flight cap
+            maximum_concurrent_rpcs=settings.max_inflight_requests or None,
+            options=[
+                ("grpc.so_reuseport", 1),
+                ("grpc.max_receive_message_length", settings.grpc_max_message_bytes),
+                ("grpc.max_send_message_length", settings.grpc_max_message_bytes)
+            ]
+        )
+        self.server.add_generic_rpc_handlers((grpc.method_handlers_generic_handler(SERVICE, handlers),))
+        bound = self.server.add_insecure_port(f"[::]:{port}")
+        await self.server.start()
+        return bound
+
+    async def stop(self, grace: float):
+        """Stop accepting calls and let running ones finish for up to grace seconds"""
+        if self.server is not None:
+            await self.server.stop(grace)
+            self.server = None
+
+    @staticmethod
+    def _bind(context: grpc.aio.ServicerContext):
+        """Bind the call's tenant metadata and deadline to the RequestContext"""
+        metadata = dict(context.invocation_metadata() or ())
+        remaining = context.time_remaining()
+        return request_context.set(RequestContext(
+            metadata.get("x-tenant-id", "anonymous"),
+            metadata.get("x-tenant-plan", settings.scheduler_default_plan),
+            metadata.get("x-request-priority", "interactive"),
+            time.time() + remaining if remaining is not None else None
+        ))
+
+    @staticmethod
+    async def _abort(context: grpc.aio.ServicerContext, error: Exception):
+        """End the call with the gRPC status and HTTP status trailer the error maps to"""
+        retry_after = None
+        if isinstance(error, ValidationError):
+            status_code, detail = 422, str(error)
+        elif isinstance(error, Overloaded):
+            status_code, detail, retry_after = error.status_code, str(error), error.headers["Retry-After"]
+        elif isinstance(error, HTTPException):
+            status_code, detail = error.status_code, str(error.detail)
+            retry_after = (error.headers or {}).get("Retry-After")
+        else:
+            status_code, detail = 500, str(error)
+        trailers = [("x-http-status", str(status_code))]
+        if retry_after is not None:
+            trailers.append(("retry-after", retry_after))
+        context.set_trailing_metadata(tuple(trailers))
+        await context.abort(GRPC_STATUS.get(status_code, grpc.StatusCode.INTERNAL), detail)
+
+    def _unary_call(self, model: Type[BaseModel], handler: UnaryHandler):
+        async def call(request: bytes, context: grpc.aio.ServicerContext) -> bytes:
+            token = self._bind(context)
+            try:
+                return _body(await handler(model.model_validate_json(request)))
+            except Exception as e:
+                await self._abort(context, e)
+            finally:
+                request_context.reset(token)
+        return call
+
+    def _stream_call(self, model: Type[BaseModel], handler: StreamHandler):
+        async def call(request: bytes, context: grpc.aio.ServicerContext) -> AsyncIterator[bytes]:
+            # Not reset: each call runs in its own task, and a cancelled stream is
+            # closed from another context, where resetting the token would fail
+            self._bind(context)
+            try:
+                async for event in handler(model.model_validate_json(request)):
+                    yield dumps(event)
+            except Exception as e:
+                await self._abort(context, e)
+        return call
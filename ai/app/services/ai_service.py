@@ -1,26 +1,93 @@
 import os
-import json
 import asyncio
-from typing import Dict, Any, List, Optional
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional
 from langchain.llms import OpenAI
 from langchain.chat_models import ChatOpenAI, ChatAnthropic
 from langchain.schema import HumanMessage, SystemMessage
 import openai
 import google.generativeai as genai
-from anthropic import Anthropic
+from anthropic import AsyncAnthropic
+from .prompt_cache import plan_prompt_cache, to_anthropic
+from .scheduler import TenantScheduler, remaining_seconds
+from .structured_output import (
+    EXTRACTION_TOOL, CompiledSchema, IncrementalObjectParser, StructuredOutputError,
+    compile_schema, extraction_prompt, reask_prompt
+)
 from ..config import settings
 
-class AIService:
+
+class TokenUsage:
+    """Token usage accumulated across the provider calls made for one request"""
+
     def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        # Prompt tokens served from / written to the provider's prompt cache
+        self.cached_tokens = 0
+        self.cache_write_tokens = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0, cache_write_tokens: int = 0):
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cached_tokens += cached_tokens
+        self.cache_write_tokens += cache_write_tokens
+
+
+def summary_prompt(text: str, max_length: Optional[int] = None) -> str:
+    """Single-prompt summary instruction"""
+    if max_length:
+        return (
+            f"Please provide a concise summary of the following text "
+            f"in at most {max_length} characters:\n\n{text}"
+        )
+    return f"Please provide a concise summary of the following text:\n\n{text}"
+
+
+def classification_prompt(text: str, categories: List[str]) -> str:
+    """Instruction to answer with one of the categories"""
+    categories_str = ", ".join(categories)
+    return f"""
+        Classify the following text into one of these categories: {categories_str}
+        
+        Text: {text}
+        
+        Return only the category name, no additional text.
+        """
+
+
+# Usage accumulator of the current request; child tasks share it via context copy
+_current_usage: ContextVar[Optional[TokenUsage]] = ContextVar("ai_token_usage", default=None)
+
+
+class AIService:
+    def __init__(self, scheduler: Optional[TenantScheduler] = None):
         self.last_token_count = 0
+        self.scheduler = scheduler
+    
+    async def connect(self):
+        """Create provider clients (per worker process, after fork)"""
         self._initialize_clients()
     
+    async def disconnect(self):
+        """Close provider clients' connection pools"""
+        for name in ('openai_client', 'anthropic_client'):
+            client = getattr(self, name, None)
+            if client is not None:
+                await client.close()
+                delattr(self, name)
+    
     def _initialize_clients(self):
         """Initialize AI client connections"""
         # OpenAI
         if settings.openai_api_key:
             openai.api_key = settings.openai_api_key
-            self.openai_client = openai.OpenAI(api_key=settings.openai_api_key)
+            self.openai_client = openai.AsyncOpenAI(api_key=settings.openai_api_key)
         
         # Google Generative AI
         if settings.google_api_key:
@@ -29,7 +96,7 @@ class AIService:
         
         # Anthropic
         if settings.anthropic_api_key:
-            self.anthropic_client = Anthropic(api_key=settings.anthropic_api_key)
+            self.anthropic_client = AsyncAnthropic(api_key=settings.anthropic_api_key)
     
     def _get_client_for_model(self, model: str):
         """Get the appropriate client for the specified model"""
@@ -48,130 +115,277 @@ class AIService:
         else:
             raise ValueError(f"Unsupported model: {model}")
     
-    async def summarize_text(self, text: str, model: str = "gpt-3.5-turbo") -> str:
-        """Summarize text using AI"""
-        prompt = f"Please provide a concise summary of the following text:\n\n{text}"
-        
-        if model.startswith('gpt-'):
-            response = await self._openai_completion(prompt, model)
-        elif model.startswith('gemini-'):
-            response = await self._google_completion(prompt, model)
-        elif model.startswith('claude-'):
-            response = await self._anthropic_completion(prompt, model)
-        else:
+    @contextmanager
+    def track_usage(self) -> Iterator[TokenUsage]:
+        """Accumulate the token usage of every provider call made inside the block"""
+        usage = TokenUsage()
+        token = _current_usage.set(usage)
+        try:
+            yield usage
+        finally:
+            _current_usage.reset(token)
+    
+    def _record_usage(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0, cache_write_tokens: int = 0):
+        """Record the token usage of a provider call (prompt_tokens includes cached tokens)"""
+        self.last_token_count = prompt_tokens + completion_tokens
+        usage = _current_usage.get()
+        if usage is not None:
+            usage.add(prompt_tokens, completion_tokens, cached_tokens, cache_write_tokens)
+    
+    def _provider_slot(self):
+        """Fair-share slot for one provider call (a no-op without a scheduler)"""
+        return self.scheduler.slot() if self.scheduler else nullcontext()
+    
+    @staticmethod
+    def _timeout() -> float:
+        """Provider call timeout: what is left of the request deadline, at most provider_timeout_seconds"""
+        return remaining_seconds(settings.provider_timeout_seconds)
+    
+    async def complete(self, prompt: str, model: str = "gpt-3.5-turbo", max_tokens: int = 1000) -> str:
+        """Single-prompt completion routed to the provider of the model"""
+        if not model.startswith(('gpt-', 'gemini-', 'claude-')):
             raise ValueError(f"Unsupported model: {model}")
-        
-        return response
+        async with self._provider_slot():
+            if model.startswith('gpt-'):
+                return await self._openai_completion(prompt, model, max_tokens)
+            elif model.startswith('gemini-'):
+                return await self._google_completion(prompt, model)
+            else:
+                return await self._anthropic_completion(prompt, model, max_tokens)
+    
+    async def summarize_text(self, text: str, model: str = "gpt-3.5-turbo", max_length: Optional[int] = None) -> str:
+        """Summarize text using AI"""
+        return await self.complete(summary_prompt(text, max_length), model)
     
     async def extract_data(self, text: str, schema: Dict[str, Any], model: str = "gpt-3.5-turbo") -> Dict[str, Any]:
-        """Extract structured data from text"""
-        schema_str = json.dumps(schema, indent=2)
-        prompt = f"""
-        Extract the following data from the text below and return it as JSON:
-        
-        Schema: {schema_str}
-        
-        Text: {text}
+        """Extract structured data from text, validated against the schema"""
+        data: Dict[str, Any] = {}
+        async for event in self.stream_extract(text, schema, model):
+            if event["event"] == "done":
+                data = event["data"]
+        return data
+    
+    async def stream_extract(self, text: str, schema: Dict[str, Any], model: str = "gpt-3.5-turbo") -> AsyncIterator[Dict[str, Any]]:
+        """
+        Structured extraction, yielding each top-level field as soon as it has been
+        streamed ({"event": "field", "name", "value"}) and finally the validated
+        object ({"event": "done", "data"}).
         
-        Return only the JSON object, no additional text.
+        The schema is enforced natively where the provider supports it (forced tool
+        call on OpenAI, a prefilled JSON object on Anthropic). Malformed output is
+        repaired locally; what repair cannot fix costs one targeted re-ask (only the
+        missing fields when that is the problem). StructuredOutputError is raised if
+        the output still does not validate.
         """
+        compiled = compile_schema(schema)
+        parser = IncrementalObjectParser()
+        chunks: List[str] = []
+        async for delta in self._extract_stream(extraction_prompt(text, compiled), compiled, model):
+            chunks.append(delta)
+            for name, value in parser.feed(delta):
+                yield {"event": "field", "name": name, "value": value}
         
-        if model.startswith('gpt-'):
-            response = await self._openai_completion(prompt, model)
-        elif model.startswith('gemini-'):
-            response = await self._google_completion(prompt, model)
-        elif model.startswith('claude-'):
-            response = await self._anthropic_completion(prompt, model)
-        else:
+        output = "".join(chunks)
+        data, errors = compiled.parse(output)
+        for _ in range(settings.extraction_max_reasks):
+            if not errors:
+                break
+            prompt, fields = reask_prompt(text, compiled, output, errors)
+            target = compile_schema(compiled.subset(fields)) if fields else compiled
+            output = "".join([delta async for delta in self._extract_stream(prompt, target, model)])
+            if fields:
+                patch, patch_errors = target.parse(output)
+                if not patch_errors:
+                    data, errors = compiled.validate({**data, **patch})
+            else:
+                data, errors = compiled.parse(output)
+        if errors:
+            raise StructuredOutputError("Extraction output does not match the schema", errors)
+        yield {"event": "done", "data": data}
+    
+    async def _extract_stream(self, prompt: str, compiled: CompiledSchema, model: str) -> AsyncIterator[str]:
+        """Stream the raw JSON text of one extraction call"""
+        if not model.startswith(('gpt-', 'gemini-', 'claude-')):
             raise ValueError(f"Unsupported model: {model}")
-        
-        try:
-            # Try to parse JSON from response
-            return json.loads(response)
-        except json.JSONDecodeError:
-            # If JSON parsing fails, return raw response
-            return {"raw_response": response}
+        async with self._provider_slot():
+            if model.startswith('gpt-'):
+                async for delta in self._openai_extract_stream(prompt, compiled, model):
+                    yield delta
+            elif model.startswith('gemini-'):
+                # No native JSON mode in this SDK; the whole answer arrives at once
+                yield await self._google_completion(prompt, model)
+            else:
+                async for delta in self._anthropic_extract_stream(prompt, compiled, model):
+                    yield delta
     
     async def classify_text(self, text: str, categories: List[str], model: str = "gpt-3.5-turbo") -> str:
         """Classify text into categories"""
-        categories_str = ", ".join(categories)
-        prompt = f"""
-        Classify the following text into one of these categories: {categories_str}
-        
-        Text: {text}
-        
-        Return only the category name, no additional text.
-        """
-        
-        if model.startswith('gpt-'):
-            response = await self._openai_completion(prompt, model)
-        elif model.startswith('gemini-'):
-            response = await self._google_completion(prompt, model)
-        elif model.startswith('claude-'):
-            response = await self._anthropic_completion(prompt, model)
-        else:
-            raise ValueError(f"Unsupported model: {model}")
+        response = await self.complete(classification_prompt(text, categories), model)
         
         return response.strip()
     
     async def generate_content(self, prompt: str, max_tokens: int = 1000, model: str = "gpt-3.5-turbo") -> str:
         """Generate content based on prompt"""
-        if model.startswith('gpt-'):
-            response = await self._openai_completion(prompt, model, max_tokens)
-        elif model.startswith('gemini-'):
-            response = await self._google_completion(prompt, model)
-        elif model.startswith('claude-'):
-            response = await self._anthropic_completion(prompt, model)
-        else:
-            raise ValueError(f"Unsupported model: {model}")
-        
-        return response
+        return await self.complete(prompt, model, max_tokens)
     
-    async def chat_completion(self, messages: List[Dict[str, str]], model: str = "gpt-3.5-turbo", temperature: float = 0.7) -> str:
+    async def chat_completion(
+        self,
+        messages: List[Dict[str, str]],
+        model: str = "gpt-3.5-turbo",
+        temperature: float = 0.7,
+        max_tokens: int = 1000
+    ) -> str:
         """Chat completion with conversation history"""
-        if model.startswith('gpt-'):
-            response = await self._openai_chat(messages, model, temperature)
-        elif model.startswith('gemini-'):
-            response = await self._google_chat(messages, model, temperature)
-        elif model.startswith('claude-'):
-            response = await self._anthropic_chat(messages, model, temperature)
-        else:
+        if not model.startswith(('gpt-', 'gemini-', 'claude-')):
             raise ValueError(f"Unsupported model: {model}")
+        async with self._provider_slot():
+            if model.startswith('gpt-'):
+                response = await self._openai_chat(messages, model, temperature, max_tokens)
+            elif model.startswith('gemini-'):
+                response = await self._google_chat(messages, model, temperature)
+            else:
+                response = await self._anthropic_chat(messages, model, temperature, max_tokens)
         
         return response
     
+    async def stream_chat(
+        self,
+        messages: List[Dict[str, str]],
+        model: str = "gpt-3.5-turbo",
+        temperature: float = 0.7,
+        max_tokens: int = 1000
+    ) -> AsyncIterator[str]:
+        """Chat completion streamed as text deltas (usage is recorded when the stream ends)"""
+        if not model.startswith(('gpt-', 'gemini-', 'claude-')):
+            raise ValueError(f"Unsupported model: {model}")
+        async with self._provider_slot():
+            if model.startswith('gpt-'):
+                async for delta in self._openai_chat_stream(messages, model, temperature, max_tokens):
+                    yield delta
+            elif model.startswith('gemini-'):
+                # The synchronous SDK is not streamed; the whole answer arrives at once
+                yield await self._google_chat(messages, model, temperature)
+            else:
+                async for delta in self._anthropic_chat_stream(messages, model, temperature, max_tokens):
+                    yield delta
+    
     async def _openai_completion(self, prompt: str, model: str, max_tokens: int = 1000) -> str:
         """OpenAI completion"""
         try:
-            response = self.openai_client.chat.completions.create(
+            response = await self.openai_client.chat.completions.create(
                 model=model,
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=max_tokens,
-                temperature=0.7
+                temperature=0.7,
+                timeout=self._timeout()
             )
-            self.last_token_count = response.usage.total_tokens
+            self._record_usage(response.usage.prompt_tokens, response.usage.completion_tokens)
             return response.choices[0].message.content
         except Exception as e:
             raise Exception(f"OpenAI API error: {str(e)}")
     
-    async def _openai_chat(self, messages: List[Dict[str, str]], model: str, temperature: float) -> str:
+    async def _openai_chat(self, messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int = 1000) -> str:
         """OpenAI chat completion"""
         try:
-            response = self.openai_client.chat.completions.create(
+            # OpenAI caches repeated prompt prefixes automatically; keep the stable part first
+            plan = plan_prompt_cache(messages, model)
+            extra_body = {"prompt_cache_key": plan.prefix_key} if plan.cacheable and plan.prefix_key else None
+            response = await self.openai_client.chat.completions.create(
                 model=model,
-                messages=messages,
-                temperature=temperature
+                messages=plan.messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                extra_body=extra_body,
+                timeout=self._timeout()
+            )
+            details = getattr(response.usage, "prompt_tokens_details", None)
+            self._record_usage(
+                response.usage.prompt_tokens,
+                response.usage.completion_tokens,
+                cached_tokens=getattr(details, "cached_tokens", 0) or 0
             )
-            self.last_token_count = response.usage.total_tokens
             return response.choices[0].message.content
         except Exception as e:
             raise Exception(f"OpenAI API error: {str(e)}")
     
+    async def _openai_chat_stream(self, messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int = 1000) -> AsyncIterator[str]:
+        """OpenAI chat completion, streamed"""
+        try:
+            plan = plan_prompt_cache(messages, model)
+            extra_body: Dict[str, Any] = {"stream_options": {"include_usage": True}}
+            if plan.cacheable and plan.prefix_key:
+                extra_body["prompt_cache_key"] = plan.prefix_key
+            stream = await self.openai_client.chat.completions.create(
+                model=model,
+                messages=plan.messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True,
+                extra_body=extra_body,
+                timeout=self._timeout()
+            )
+            async for chunk in stream:
+                usage = getattr(chunk, "usage", None)
+                if usage:
+                    details = getattr(usage, "prompt_tokens_details", None)
+                    self._record_usage(
+                        usage.prompt_tokens,
+                        usage.completion_tokens,
+                        cached_tokens=getattr(details, "cached_tokens", 0) or 0
+                    )
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            raise Exception(f"OpenAI API error: {str(e)}")
+    
+    async def _openai_extract_stream(self, prompt: str, compiled: CompiledSchema, model: str) -> AsyncIterator[str]:
+        """OpenAI extraction: the schema is the parameters of a function the model must call"""
+        kwargs: Dict[str, Any] = {}
+        if compiled.is_object:
+            kwargs["tools"] = [{
+                "type": "function",
+                "function": {
+                    "name": EXTRACTION_TOOL,
+                    "description": "Record the data extracted from the text",
+                    "parameters": compiled.schema
+                }
+            }]
+            kwargs["tool_choice"] = {"type": "function", "function": {"name": EXTRACTION_TOOL}}
+        try:
+            stream = await self.openai_client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=settings.extraction_max_tokens,
+                temperature=0,
+                stream=True,
+                extra_body={"stream_options": {"include_usage": True}},
+                timeout=self._timeout(),
+                **kwargs
+            )
+            async for chunk in stream:
+                usage = getattr(chunk, "usage", None)
+                if usage:
+                    self._record_usage(usage.prompt_tokens, usage.completion_tokens)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.tool_calls:
+                    for call in delta.tool_calls:
+                        if call.function and call.function.arguments:
+                            yield call.function.arguments
+                elif delta.content:
+                    yield delta.content
+        except Exception as e:
+            raise Exception(f"OpenAI API error: {str(e)}")
+    
     async def _google_completion(self, prompt: str, model: str) -> str:
         """Google Generative AI completion"""
         try:
-            response = self.google_client.generate_content(prompt)
-            self.last_token_count = 0  # Google doesn't provide token count in the same way
+            # The Google SDK is synchronous; keep it off the event loop
+            response = await asyncio.wait_for(
+                asyncio.to_thread(self.google_client.generate_content, prompt), self._timeout()
+            )
+            self._record_usage(0, 0)  # Google doesn't provide token count in the same way
             return response.text
         except Exception as e:
             raise Exception(f"Google API error: {str(e)}")
@@ -187,38 +401,113 @@ class AIService:
                 elif msg['role'] == 'assistant':
                     google_messages.append({"role": "model", "parts": [msg['content']]})
             
-            response = self.google_client.generate_content(google_messages)
-            self.last_token_count = 0
+            response = await asyncio.wait_for(
+                asyncio.to_thread(self.google_client.generate_content, google_messages), self._timeout()
+            )
+            self._record_usage(0, 0)
             return response.text
         except Exception as e:
             raise Exception(f"Google API error: {str(e)}")
     
-    async def _anthropic_completion(self, prompt: str, model: str) -> str:
+    async def _anthropic_completion(self, prompt: str, model: str, max_tokens: int = 1000) -> str:
         """Anthropic completion"""
         try:
-            response = self.anthropic_client.messages.create(
+            response = await self.anthropic_client.messages.create(
                 model=model,
-                max_tokens=1000,
-                messages=[{"role": "user", "content": prompt}]
+                max_tokens=max_tokens,
+                messages=[{"role": "user", "content": prompt}],
+                timeout=self._timeout()
             )
-            self.last_token_count = response.usage.input_tokens + response.usage.output_tokens
+            self._record_usage(response.usage.input_tokens, response.usage.output_tokens)
             return response.content[0].text
         except Exception as e:
             raise Exception(f"Anthropic API error: {str(e)}")
     
-    async def _anthropic_chat(self, messages: List[Dict[str, str]], model: str, temperature: float) -> str:
+    async def _anthropic_extract_stream(self, prompt: str, compiled: CompiledSchema, model: str) -> AsyncIterator[str]:
+        """Anthropic extraction: the answer is prefilled with "{" so the model can only continue the object"""
+        prefill = "{" if compiled.is_object else "["
+        try:
+            stream = await self.anthropic_client.messages.create(
+                model=model,
+                max_tokens=settings.extraction_max_tokens,
+                temperature=0,
+                messages=[{"role": "user", "content": prompt}, {"role": "assistant", "content": prefill}],
+                stream=True,
+                timeout=self._timeout()
+            )
+            yield prefill
+            prompt_tokens = completion_tokens = 0
+            async for event in stream:
+                if event.type == "message_start":
+                    prompt_tokens = event.message.usage.input_tokens
+                elif event.type == "content_block_delta":
+                    text = getattr(event.delta, "text", None)
+                    if text:
+                        yield text
+                elif event.type == "message_delta":
+                    completion_tokens = event.usage.output_tokens
+            self._record_usage(prompt_tokens, completion_tokens)
+        except Exception as e:
+            raise Exception(f"Anthropic API error: {str(e)}")
+    
+    async def _anthropic_chat(self, messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int = 1000) -> str:
         """Anthropic chat completion"""
         try:
-            response = self.anthropic_client.messages.create(
+            # Mark stable prefixes (system prompts, prior history) for Anthropic prompt caching
+            system, anthropic_messages = to_anthropic(plan_prompt_cache(messages, model))
+            kwargs = {"system": system} if system else {}
+            response = await self.anthropic_client.messages.create(
                 model=model,
-                max_tokens=1000,
-                messages=messages
+                max_tokens=max_tokens,
+                temperature=temperature,
+                messages=anthropic_messages,
+                timeout=self._timeout(),
+                **kwargs
+            )
+            # input_tokens excludes the tokens read from or written to the cache
+            cached_tokens = getattr(response.usage, "cache_read_input_tokens", 0) or 0
+            cache_write_tokens = getattr(response.usage, "cache_creation_input_tokens", 0) or 0
+            self._record_usage(
+                response.usage.input_tokens + cached_tokens + cache_write_tokens,
+                response.usage.output_tokens,
+                cached_tokens=cached_tokens,
+                cache_write_tokens=cache_write_tokens
             )
-            self.last_token_count = response.usage.input_tokens + response.usage.output_tokens
             return response.content[0].text
         except Exception as e:
             raise Exception(f"Anthropic API error: {str(e)}")
     
+    async def _anthropic_chat_stream(self, messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int = 1000) -> AsyncIterator[str]:
+        """Anthropic chat completion, streamed"""
+        try:
+            system, anthropic_messages = to_anthropic(plan_prompt_cache(messages, model))
+            kwargs = {"system": system} if system else {}
+            stream = await self.anthropic_client.messages.create(
+                model=model,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                messages=anthropic_messages,
+                stream=True,
+                timeout=self._timeout(),
+                **kwargs
+            )
+            prompt_tokens = completion_tokens = cached_tokens = cache_write_tokens = 0
+            async for event in stream:
+                if event.type == "message_start":
+                    usage = event.message.usage
+                    cached_tokens = getattr(usage, "cache_read_input_tokens", 0) or 0
+                    cache_write_tokens = getattr(usage, "cache_creation_input_tokens", 0) or 0
+                    prompt_tokens = usage.input_tokens + cached_tokens + cache_write_tokens
+                elif event.type == "content_block_delta":
+                    text = getattr(event.delta, "text", None)
+                    if text:
+                        yield text
+                elif event.type == "message_delta":
+                    completion_tokens = event.usage.output_tokens
+            self._record_usage(prompt_tokens, completion_tokens, cached_tokens=cached_tokens, cache_write_tokens=cache_write_tokens)
+        except Exception as e:
+            raise Exception(f"Anthropic API error: {str(e)}")
+    
     def get_last_token_count(self) -> int:
         """Get the token count from the last request"""
         return self.last_token_count
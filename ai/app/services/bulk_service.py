@@ -0,0 +1,214 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, BinaryIO, Callable, Dict, Optional, Tuple
+
+import redis.asyncio as redis
+
+from platform_common.codec import loads
+
+from .redis_service import RedisService
+from .scheduler import Overloaded, RequestContext, request_context
+from ..config import settings
+
+BulkHandler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+READ_CHUNK_BYTES = 1 << 20
+
+logger = logging.getLogger(__name__)
+
+
+class BulkCheckpoint:
+    """
+    Input lines (1-based) already processed, one bit per line, most significant
+    bit first like a Redis bitmap. A million lines take 125 KB.
+    """
+
+    def __init__(self, bits: bytes = b""):
+        self.bits = bytearray(bits)
+
+    def __contains__(self, line: int) -> bool:
+        index = line >> 3
+        return index < len(self.bits) and bool(self.bits[index] & (0x80 >> (line & 7)))
+
+    def __len__(self) -> int:
+        return sum(byte.bit_count() for byte in self.bits)
+
+    def add(self, line: int):
+        index = line >> 3
+        if index >= len(self.bits):
+            self.bits.extend(bytes(index + 1 - len(self.bits)))
+        self.bits[index] |= 0x80 >> (line & 7)
+
+
+async def read_chunks(f: BinaryIO) -> AsyncIterator[bytes]:
+    """Chunks of a binary file, read off the event loop"""
+    while True:
+        chunk = await asyncio.to_thread(f.read, READ_CHUNK_BYTES)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def split_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+    """
+    Numbered lines of a byte stream, holding at most one line in memory. Lines
+    longer than bulk_max_line_bytes are dropped and yielded as None.
+    """
+    buffer = bytearray()
+    number = 0
+    oversized = False
+    async for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end < 0:
+                if not oversized:
+                    buffer += chunk[start:]
+                    if len(buffer) > settings.bulk_max_line_bytes:
+                        oversized = True
+                        buffer.clear()
+                break
+            number += 1
+            if oversized:
+                yield number, None
+            else:
+                buffer += chunk[start:end]
+                yield number, None if len(buffer) > settings.bulk_max_line_bytes else bytes(buffer)
+            buffer.clear()
+            oversized = False
+            start = end + 1
+    if buffer or oversized:
+        yield number + 1, None if oversized else bytes(buffer)
+
+
+class BulkService:
+    """
+    Bulk processing of JSONL items for offline workloads.
+
+    Each input line is one item: an operation's request body (the operation
+    given for the whole run), or an envelope {"id", "operation", "payload"}.
+    Items are dispatched to the operation handlers with bounded concurrency,
+    as the tenant's batch work, and stop being read while all slots are busy,
+    so memory stays constant however long the input is. One result record per
+    line is produced in completion order, carrying the line number; lines in
+    the checkpoint (processed by an earlier, interrupted run) are skipped.
+    """
+
+    def __init__(self, redis_service: RedisService):
+        self.redis = redis_service
+
+    @property
+    def redis_client(self) -> Optional[redis.Redis]:
+        """Shared Redis client, or None while Redis is unreachable"""
+        return self.redis.get()
+
+    @staticmethod
+    def _key(company_id: str, bulk_id: str) -> str:
+        return f"bulk:{company_id}:{bulk_id}"
+
+    async def load_checkpoint(self, company_id: str, bulk_id: str, input_digest: str) -> BulkCheckpoint:
+        """
+        Lines of a resumable run recorded in Redis. The first run of an id records
+        the digest of its input; a different input under the same id raises
+        ValueError, as its line numbers would not match the checkpoint.
+        """
+        if not self.redis_client:
+            raise RuntimeError("Bulk checkpoint store unavailable")
+        key = self._key(company_id, bulk_id)
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.set(f"{key}:input", input_digest, nx=True, ex=settings.bulk_checkpoint_ttl)
+            pipe.get(f"{key}:input")
+            pipe.get(key)
+            _, recorded, bits = await pipe.execute()
+        if recorded is not None and recorded.decode() != input_digest:
+            raise ValueError(f"Bulk id {bulk_id} belongs to a different input")
+        return BulkCheckpoint(bits or b"")
+
+    async def mark(self, company_id: str, bulk_id: str, line: int):
+        """Record a delivered line of a resumable run (best effort: unrecorded lines are redone)"""
+        if not self.redis_client:
+            return
+        key = self._key(company_id, bulk_id)
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.setbit(key, line, 1)
+                pipe.expire(key, settings.bulk_checkpoint_ttl)
+                pipe.expire(f"{key}:input", settings.bulk_checkpoint_ttl)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning("Bulk checkpoint error for %s: %s", key, e)
+
+    async def run(
+        self,
+        lines: AsyncIterator[Tuple[int, Optional[bytes]]],
+        handlers: Dict[str, BulkHandler],
+        context: RequestContext,
+        operation: Optional[str] = None,
+        checkpoint: Optional[BulkCheckpoint] = None,
+        concurrency: Optional[int] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Result records of the lines not in the checkpoint, as items finish"""
+        limit = max(1, min(concurrency or settings.bulk_max_concurrency, settings.bulk_max_concurrency))
+        running: set = set()
+        try:
+            async for number, line in lines:
+                if (checkpoint is not None and number in checkpoint) or (line is not None and not line.strip()):
+                    continue
+                if len(running) >= limit:
+                    done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+                running.add(asyncio.create_task(self._process(number, line, handlers, context, operation)))
+            while running:
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            # The consumer stopped early (client gone, interrupted): drop unfinished items
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+    async def _process(
+        self,
+        number: int,
+        line: Optional[bytes],
+        handlers: Dict[str, BulkHandler],
+        context: RequestContext,
+        operation: Optional[str]
+    ) -> Dict[str, Any]:
+        # Runs in its own task, so the context stays bound to this item only
+        request_context.set(context)
+        record: Dict[str, Any] = {"line": number}
+        try:
+            if line is None:
+                raise ValueError(f"Line longer than {settings.bulk_max_line_bytes} bytes")
+            item = loads(line)
+            if not isinstance(item, dict):
+                raise ValueError("Line is not a JSON object")
+            if item.get("id") is not None:
+                record["id"] = item["id"]
+            if "payload" in item:
+                operation, item = item.get("operation") or operation, item["payload"]
+            record["operation"] = operation
+            handler = handlers.get(operation)
+            if handler is None:
+                raise ValueError(f"Unsupported bulk operation: {operation}")
+            record["result"] = await self._attempt(handler, item)
+            record["status"] = "completed"
+        except Exception as e:
+            record["status"] = "failed"
+            record["error"] = str(e)
+        return record
+
+    @staticmethod
+    async def _attempt(handler: BulkHandler, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Run an item, waiting out shed provider calls instead of failing them"""
+        for attempt in range(1, settings.bulk_max_attempts + 1):
+            try:
+                return await handler(payload)
+            except Overloaded as e:
+                if attempt == settings.bulk_max_attempts:
+                    raise
+                await asyncio.sleep(e.retry_after)
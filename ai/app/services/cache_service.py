@@ -1,25 +1,64 @@
+import asyncio
+import math
+import random
+import time
 import redis.asyncio as redis
-import json
-from typing import Any, Optional
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from . import value_codec
+from .memory_budget import MemoryBudgets
+from .redis_service import RedisService
+from .scheduler import RequestContext, request_context
 from ..config import settings
 
+# Marks values stored with refresh metadata (neither JSON nor encoded values start with this byte)
+ENTRY_PREFIX = b"\x1eswr"
+
+# Result of a shared computation abandoned by its owner (cancelled): waiters try again themselves
+_RETRY = object()
+
+
+class CachePolicy:
+    """Soft/hard expiry, TTL jitter and early-refresh factor of one operation's cache entries"""
+
+    def __init__(self, soft_ttl: float, hard_ttl: float, jitter: float = 0.1, beta: float = 1.0):
+        self.soft_ttl = soft_ttl
+        self.hard_ttl = max(hard_ttl, soft_ttl)
+        self.jitter = jitter
+        self.beta = beta
+
+    @classmethod
+    def named(cls, operation: str) -> "CachePolicy":
+        policies = settings.cache_policies
+        return cls(**policies.get(operation, policies["default"]))
+
+    def jittered(self, ttl: float) -> float:
+        """Spread expirations so entries written together do not expire together"""
+        return ttl * (1 + random.uniform(-self.jitter, self.jitter))
+
+
 class CacheService:
-    def __init__(self):
-        self.redis_client: Optional[redis.Redis] = None
-    
-    async def connect(self):
-        """Connect to Redis"""
-        try:
-            self.redis_client = redis.from_url(settings.redis_url)
-            await self.redis_client.ping()
-        except Exception as e:
-            print(f"Failed to connect to Redis: {e}")
-            self.redis_client = None
+    """
+    Redis cache.
+
+    get/set store plain values with a fixed TTL. get_or_refresh serves entries
+    with soft and hard expirations instead: after the soft TTL readers get the
+    stale value at once while a single background refresh (guarded by a Redis
+    lock) recomputes it. Refreshes start probabilistically early as the soft TTL
+    approaches (XFetch: the slower the computation, the earlier), so popular
+    entries are renewed before they expire and concurrent misses share one
+    computation instead of stampeding the provider.
+    """
+
+    def __init__(self, redis_service: RedisService):
+        self.redis = redis_service
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._refreshes: set = set()
+        self.budgets = MemoryBudgets()
     
-    async def disconnect(self):
-        """Disconnect from Redis"""
-        if self.redis_client:
-            await self.redis_client.close()
+    @property
+    def redis_client(self) -> Optional[redis.Redis]:
+        """Shared Redis client, or None while Redis is unreachable"""
+        return self.redis.get()
     
     async def get(self, key: str) -> Optional[Any]:
         """Get value from cache"""
@@ -29,7 +68,7 @@ class CacheService:
         try:
             value = await self.redis_client.get(key)
             if value:
-                return json.loads(value)
+                return self._decode(value)[0]
             return None
         except Exception as e:
             print(f"Cache get error: {e}")
@@ -41,16 +80,174 @@ class CacheService:
             return False
         
         try:
-            await self.redis_client.setex(
-                key, 
-                expire, 
-                json.dumps(value)
+            await self.budgets.store(self.redis_client, key, value_codec.encode(value), expire)
+            return True
+        except Exception as e:
+            print(f"Cache set error: {e}")
+            return False
+    
+    @staticmethod
+    def _decode(raw: bytes) -> Tuple[Any, Optional[float], float]:
+        """Value, soft expiry time (None for plain entries) and computation seconds of a stored entry"""
+        if raw.startswith(ENTRY_PREFIX):
+            value, soft_expires_at, compute_seconds = value_codec.decode(raw[len(ENTRY_PREFIX):])
+            return value, soft_expires_at, compute_seconds
+        return value_codec.decode(raw), None, 0.0
+    
+    async def set_entry(self, key: str, value: Any, operation: str = "default", compute_seconds: float = 0.0) -> bool:
+        """Store a value with the soft and hard expirations of the operation's policy"""
+        if not self.redis_client:
+            return False
+        
+        policy = CachePolicy.named(operation)
+        soft_ttl = policy.jittered(policy.soft_ttl)
+        hard_ttl = max(policy.jittered(policy.hard_ttl), soft_ttl)
+        try:
+            await self.budgets.store(
+                self.redis_client,
+                key,
+                ENTRY_PREFIX + value_codec.encode([value, time.time() + soft_ttl, compute_seconds]),
+                max(int(hard_ttl), 1)
             )
             return True
         except Exception as e:
             print(f"Cache set error: {e}")
             return False
     
+    async def get_or_refresh(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        operation: str = "default"
+    ) -> Tuple[Any, bool]:
+        """
+        Cached value of key, computing it on a miss; returns (value, served_from_cache).
+        
+        Stale entries are returned immediately and refreshed in the background.
+        """
+        entry = None
+        if self.redis_client:
+            try:
+                raw = await self.redis_client.get(key)
+                if raw:
+                    entry = self._decode(raw)
+            except Exception as e:
+                # Unreadable entries (e.g. written by a newer version) count as misses
+                print(f"Cache get error: {e}")
+        
+        if entry is not None:
+            value, soft_expires_at, compute_seconds = entry
+            if soft_expires_at is not None and self._expired(soft_expires_at, compute_seconds, operation):
+                await self._refresh_in_background(key, compute, operation)
+            return value, True
+        
+        # Concurrent misses in this process share one computation
+        pending = self._inflight.get(key)
+        while pending is not None:
+            value = await asyncio.shield(pending)
+            if value is not _RETRY:
+                return value, False
+            pending = self._inflight.get(key)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value, cached = await self._fill(key, compute, operation)
+            future.set_result(value)
+            return value, cached
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters see the error; nobody may be awaiting this future
+            future.exception()
+            raise
+        except BaseException:
+            # The owner's cancellation is not the waiters': never pass it on
+            future.set_result(_RETRY)
+            raise
+        finally:
+            del self._inflight[key]
+    
+    @staticmethod
+    def _expired(soft_expires_at: float, compute_seconds: float, operation: str) -> bool:
+        """XFetch: expire early with a probability growing towards the soft expiry"""
+        beta = CachePolicy.named(operation).beta
+        early = -compute_seconds * beta * math.log(1.0 - random.random())
+        return time.time() + early >= soft_expires_at
+    
+    async def _fill(self, key: str, compute: Callable[[], Awaitable[Any]], operation: str) -> Tuple[Any, bool]:
+        """Compute a missing entry, or wait for the process already computing it"""
+        lock_key = f"{key}:refresh"
+        locked = contended = False
+        if self.redis_client:
+            try:
+                locked = bool(await self.redis_client.set(lock_key, 1, nx=True, ex=settings.cache_refresh_lock_seconds))
+                contended = not locked
+            except Exception as e:
+                print(f"Cache refresh lock error: {e}")
+        if contended:
+            deadline = time.monotonic() + settings.cache_miss_wait_seconds
+            interval = 0.05
+            while time.monotonic() < deadline:
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, 1.0)
+                value = await self.get(key)
+                if value is not None:
+                    return value, True
+        try:
+            return await self._compute(key, compute, operation), False
+        finally:
+            if locked:
+                await self._unlock(lock_key)
+    
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[Any]], operation: str) -> Any:
+        started = time.monotonic()
+        value = await compute()
+        await self.set_entry(key, value, operation, time.monotonic() - started)
+        return value
+    
+    async def _refresh_in_background(self, key: str, compute: Callable[[], Awaitable[Any]], operation: str):
+        """Start one refresh of a stale entry across all processes"""
+        if key in self._inflight or not self.redis_client:
+            return
+        lock_key = f"{key}:refresh"
+        try:
+            if not await self.redis_client.set(lock_key, 1, nx=True, ex=settings.cache_refresh_lock_seconds):
+                return
+        except Exception as e:
+            print(f"Cache refresh lock error: {e}")
+            return
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        context = request_context.get()
+        
+        async def refresh():
+            # Background work of the tenant: batch priority, not bound to the request's deadline
+            if context is not None:
+                request_context.set(RequestContext(context.tenant, context.plan, "batch"))
+            try:
+                future.set_result(await self._compute(key, compute, operation))
+            except Exception as e:
+                print(f"Cache refresh error for {key}: {e}")
+                future.set_exception(e)
+                future.exception()
+            except BaseException:
+                future.set_result(_RETRY)
+                raise
+            finally:
+                del self._inflight[key]
+                await self._unlock(lock_key)
+        
+        task = asyncio.create_task(refresh())
+        self._refreshes.add(task)
+        task.add_done_callback(self._refreshes.discard)
+    
+    async def _unlock(self, lock_key: str):
+        if self.redis_client:
+            try:
+                await self.redis_client.delete(lock_key)
+            except Exception as e:
+                print(f"Cache unlock error: {e}")
+    
     async def delete(self, key: str) -> bool:
         """Delete value from cache"""
         if not self.redis_client:
@@ -75,15 +272,31 @@ class CacheService:
             return False
     
     async def clear_pattern(self, pattern: str) -> int:
-        """Clear all keys matching pattern"""
+        """Clear all keys matching pattern (incrementally with SCAN, never blocking Redis like KEYS)"""
         if not self.redis_client:
             return 0
         
         try:
-            keys = await self.redis_client.keys(pattern)
-            if keys:
-                return await self.redis_client.delete(*keys)
-            return 0
+            deleted = 0
+            batch = []
+            async for key in self.redis_client.scan_iter(match=pattern, count=500):
+                batch.append(key)
+                if len(batch) >= 500:
+                    deleted += await self.redis_client.unlink(*batch)
+                    batch = []
+            if batch:
+                deleted += await self.redis_client.unlink(*batch)
+            return deleted
         except Exception as e:
             print(f"Cache clear pattern error: {e}")
             return 0
+    
+    async def metrics(self) -> Dict[str, Any]:
+        """Value encoding counters of this process and memory use of the budgeted namespaces"""
+        metrics: Dict[str, Any] = {"codec": value_codec.stats()}
+        if self.redis_client:
+            try:
+                metrics.update(await self.budgets.usage(self.redis_client))
+            except Exception as e:
+                print(f"Cache metrics error: {e}")
+        return metrics
@@ -0,0 +1,120 @@
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from platform_common.codec import dumps
+
+from .ai_service import AIService
+from .embedding_service import EmbeddingService
+from ..config import settings
+
+
+class ClassificationService:
+    """
+    Tiered text classification.
+
+    The text is embedded with the local sentence-transformers model and scored
+    against every category by cosine similarity to the category label and to
+    the labeled examples given for it (the best match counts). When the best
+    category is similar enough in absolute terms (classifier_min_similarity),
+    leads the runner-up by classifier_min_margin and its softmax confidence
+    clears classifier_confidence_threshold, the answer is returned in
+    milliseconds without a provider call; ambiguous texts, and every text of a
+    single-category request (which nothing can be compared against), are
+    escalated to the LLM. Label and example embeddings are cached per category
+    set.
+    """
+
+    def __init__(self, ai_service: AIService, embedding_service: EmbeddingService):
+        self.ai_service = ai_service
+        self.embedding_service = embedding_service
+        self._labels: "OrderedDict[bytes, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        self._metrics = {"embedding": 0, "llm": 0}
+
+    async def classify(
+        self,
+        text: str,
+        categories: List[str],
+        model: str = "gpt-3.5-turbo",
+        examples: Optional[Dict[str, List[str]]] = None
+    ) -> Dict[str, Any]:
+        """Best category with its confidence and the tier that decided it ("embedding" or "llm")"""
+        if not categories:
+            raise ValueError("At least one category is required")
+        scores: Optional[np.ndarray] = None
+        if settings.classifier_fast_path and len(categories) > 1:
+            try:
+                scores = await self._scores(text, categories, examples or {})
+            except Exception as e:
+                # The LLM can still answer if the embedding model is unavailable
+                print(f"Embedding classification error: {e}")
+
+        if scores is not None:
+            probabilities = np.exp((scores - scores.max()) / settings.classifier_temperature)
+            probabilities /= probabilities.sum()
+            runner_up, best = (int(index) for index in np.argsort(scores)[-2:])
+            if (
+                scores[best] >= settings.classifier_min_similarity
+                and scores[best] - scores[runner_up] >= settings.classifier_min_margin
+                and probabilities[best] >= settings.classifier_confidence_threshold
+            ):
+                self._metrics["embedding"] += 1
+                return {
+                    "classification": categories[best],
+                    "confidence": float(probabilities[best]),
+                    "method": "embedding"
+                }
+
+        self._metrics["llm"] += 1
+        answer = await self.ai_service.classify_text(text, categories, model)
+        return {"classification": self.match(answer, categories), "confidence": None, "method": "llm"}
+
+    async def _scores(self, text: str, categories: List[str], examples: Dict[str, List[str]]) -> np.ndarray:
+        """Cosine similarity of the text to each category (best of label and examples)"""
+        matrix, starts = await self._label_matrix(categories, examples)
+        query = (await self.embedding_service.embed([text]))[0]
+        # Rows are L2-normalized, so the dot product is the cosine similarity
+        return np.maximum.reduceat(matrix @ query, starts)
+
+    async def _label_matrix(self, categories: List[str], examples: Dict[str, List[str]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Embeddings of each category's label followed by its examples, with the first row of each category"""
+        key = hashlib.sha256(dumps([categories, {name: examples.get(name, []) for name in categories}])).digest()
+        cached = self._labels.get(key)
+        if cached is not None:
+            self._labels.move_to_end(key)
+            return cached
+
+        texts: List[str] = []
+        starts: List[int] = []
+        for name in categories:
+            starts.append(len(texts))
+            texts.append(name)
+            texts.extend(example for example in examples.get(name, []) if example)
+        # Category sets are few and hot; keep them out of the query-sized text cache
+        matrix = await self.embedding_service.embed(texts, use_cache=False)
+        cached = self._labels[key] = (matrix, np.asarray(starts, dtype=np.intp))
+        while len(self._labels) > settings.classifier_label_cache_size:
+            self._labels.popitem(last=False)
+        return cached
+
+    @staticmethod
+    def match(answer: str, categories: List[str]) -> str:
+        """Map a free-text LLM answer onto the category it names"""
+        normalized = answer.strip().strip(".\"'").lower()
+        for name in categories:
+            if name.lower() == normalized:
+                return name
+        for name in categories:
+            if name.lower() in normalized:
+                return name
+        return answer.strip()
+
+    def metrics(self) -> Dict[str, Any]:
+        """How many classifications each tier decided in this process"""
+        total = self._metrics["embedding"] + self._metrics["llm"]
+        return {
+            **self._metrics,
+            "fast_path_rate": self._metrics["embedding"] / total if total else 0.0,
+            "cached_category_sets": len(self._labels)
+        }
@@ -0,0 +1,199 @@
+import asyncio
+import hashlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from .ai_service import AIService
+from .cache_service import CacheService
+from .tokenizer import count_message_tokens, get_context_window
+from ..config import settings
+
+SLIDING_WINDOW = "sliding_window"
+PIN_SYSTEM = "pin_system"
+SUMMARIZE = "summarize"
+CONTEXT_POLICIES = (SLIDING_WINDOW, PIN_SYSTEM, SUMMARIZE)
+
+SUMMARY_PROMPT = (
+    "Summarize the following conversation so that it can replace the original "
+    "messages as context for continuing it. Keep names, facts, decisions and open "
+    "questions.\n\n{text}"
+)
+MERGE_PROMPT = (
+    "Combine the following summaries of consecutive parts of a conversation, oldest "
+    "first, into one summary that can replace the original messages as context for "
+    "continuing it. Keep names, facts, decisions and open questions.\n\n{text}"
+)
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+# Room reserved for the rolling summary message when fitting recent turns
+SUMMARY_RESERVE_TOKENS = 50
+
+
+class ContextBudgetService:
+    """
+    Fits a conversation into a prompt token budget before it is sent to a provider.
+
+    Policies:
+    - sliding_window: keep the most recent messages that fit
+    - pin_system: always keep system messages, then the most recent turns that fit
+    - summarize: like pin_system, but older turns are replaced by a rolling summary
+
+    The newest user message and what follows it are always sent, and a trimmed
+    window never opens with an assistant turn.
+
+    Rolling summaries are built over fixed-size blocks of older turns and cached by
+    the digest of the summarized prefix, so each block is summarized once and then
+    reused on every later turn of the conversation. Several new blocks (a long
+    conversation seen for the first time) are summarized concurrently and merged.
+    """
+
+    def __init__(self, ai_service: AIService, cache_service: CacheService):
+        self.ai_service = ai_service
+        self.cache_service = cache_service
+
+    def resolve_budget(self, model: str, max_tokens: int, budget: Optional[int] = None) -> int:
+        """Prompt token budget: explicit, configured, or what the context window leaves"""
+        available = get_context_window(model) - max_tokens
+        budget = budget or settings.chat_context_budget or available
+        return max(0, min(budget, available))
+
+    async def fit(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        max_tokens: int,
+        budget: Optional[int] = None,
+        policy: Optional[str] = None
+    ) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+        """Trim messages to the budget, returning them with a token accounting"""
+        policy = policy or settings.chat_context_policy
+        if policy not in CONTEXT_POLICIES:
+            raise ValueError(f"Unsupported context policy: {policy}")
+        budget = self.resolve_budget(model, max_tokens, budget)
+
+        counts = [count_message_tokens(m, model) for m in messages]
+        original_tokens = sum(counts)
+        summarized = 0
+
+        if original_tokens <= budget:
+            fitted = list(messages)
+        elif policy == SLIDING_WINDOW:
+            indices = list(range(len(messages)))
+            kept = self._keep_last_user_turn(messages, indices, self._newest_fitting(indices, counts, budget))
+            kept = self._start_on_user_turn(messages, kept)
+            fitted = [messages[i] for i in kept]
+        else:
+            system = [i for i, m in enumerate(messages) if m["role"] == "system"]
+            turns = [i for i, m in enumerate(messages) if m["role"] != "system"]
+            remaining = budget - sum(counts[i] for i in system)
+            if policy == SUMMARIZE:
+                remaining -= settings.chat_summary_max_tokens + SUMMARY_RESERVE_TOKENS
+            kept = self._keep_last_user_turn(messages, turns, self._newest_fitting(turns, counts, remaining))
+            kept = self._start_on_user_turn(messages, kept)
+
+            summary_messages: List[Dict[str, str]] = []
+            if policy == SUMMARIZE and len(kept) < len(turns):
+                # Exactly the turns that do not fit; summaries of their whole blocks are cached and reused
+                summarized = len(turns) - len(kept)
+                summary = await self._rolling_summary([messages[i] for i in turns[:summarized]], model)
+                summary_messages = [{"role": "system", "content": SUMMARY_PREFIX + summary}]
+                kept = turns[summarized:]
+
+            fitted = [messages[i] for i in system] + summary_messages + [messages[i] for i in kept]
+
+        accounting = {
+            "policy": policy,
+            "budget": budget,
+            "original_messages": len(messages),
+            "original_prompt_tokens": original_tokens,
+            "sent_messages": len(fitted),
+            "sent_prompt_tokens": sum(count_message_tokens(m, model) for m in fitted),
+            "summarized_messages": summarized,
+        }
+        return fitted, accounting
+
+    @staticmethod
+    def _newest_fitting(indices, counts: List[int], budget: int) -> List[int]:
+        """Select the newest contiguous run of message indices that fits the budget"""
+        kept: List[int] = []
+        total = 0
+        for i in reversed(list(indices)):
+            if total + counts[i] > budget:
+                break
+            kept.insert(0, i)
+            total += counts[i]
+        return kept
+
+    @staticmethod
+    def _keep_last_user_turn(messages: List[Dict[str, str]], indices: List[int], kept: List[int]) -> List[int]:
+        """Extend the kept suffix back to the newest user message, which is sent even if it alone exceeds the budget"""
+        for position in range(len(indices) - 1, -1, -1):
+            if messages[indices[position]]["role"] == "user":
+                return kept if len(kept) >= len(indices) - position else indices[position:]
+        return kept
+
+    @staticmethod
+    def _start_on_user_turn(messages: List[Dict[str, str]], kept: List[int]) -> List[int]:
+        """Drop assistant messages at the start of the kept window (Anthropic requires a user turn first)"""
+        for position, i in enumerate(kept):
+            if messages[i]["role"] != "assistant":
+                return kept[position:]
+        return kept
+
+    async def _rolling_summary(self, dropped: List[Dict[str, str]], model: str) -> str:
+        """Summarize dropped turns block by block, each block extending the previous summary"""
+        block = settings.chat_summary_block
+
+        # Digest of every block-aligned prefix, computed incrementally
+        keys: List[str] = []
+        digest = hashlib.sha256(model.encode("utf-8"))
+        for start in range(0, len(dropped), block):
+            for message in dropped[start:start + block]:
+                digest.update(f"\0{message['role']}\0{message['content']}".encode("utf-8"))
+            keys.append(f"chat_summary:{digest.hexdigest()}")
+
+        # Find the longest already-summarized prefix, then roll forward from it
+        summary: Optional[str] = None
+        level = len(keys)
+        while level > 0:
+            summary = await self.cache_service.get(keys[level - 1])
+            if summary is not None:
+                break
+            level -= 1
+
+        def transcript(index: int) -> str:
+            return "\n".join(f"{m['role']}: {m['content']}" for m in dropped[index * block:(index + 1) * block])
+
+        # Several new whole blocks are summarized concurrently and merged into the
+        # summary of the whole-block prefix, which the next turn starts from
+        whole_blocks = len(dropped) // block
+        if whole_blocks - level > 1:
+            semaphore = asyncio.Semaphore(settings.summarize_max_concurrency)
+
+            async def summarize_block(index: int) -> str:
+                async with semaphore:
+                    return await self.ai_service.complete(
+                        SUMMARY_PROMPT.format(text=transcript(index)), model, settings.chat_summary_max_tokens
+                    )
+
+            parts = list(await asyncio.gather(*(summarize_block(i) for i in range(level, whole_blocks))))
+            if summary:
+                parts.insert(0, summary)
+            summary = await self.ai_service.complete(
+                MERGE_PROMPT.format(text="\n\n".join(parts)), model, settings.chat_summary_max_tokens
+            )
+            await self.cache_service.set_entry(keys[whole_blocks - 1], summary, "chat_summary")
+            level = whole_blocks
+
+        # At most one whole block and the trailing partial one remain; each extends the summary
+        for index in range(level, len(keys)):
+            text = transcript(index)
+            if summary:
+                text = f"{SUMMARY_PREFIX}{summary}\n\n{text}"
+            summary = await self.ai_service.complete(
+                SUMMARY_PROMPT.format(text=text),
+                model,
+                settings.chat_summary_max_tokens
+            )
+            await self.cache_service.set_entry(keys[index], summary, "chat_summary")
+
+        return summary
@@ -0,0 +1,226 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ..config import settings
+
+
+class EmbeddingService:
+    """
+    Sentence embeddings from one lazily loaded sentence-transformers model per process.
+
+    Concurrent requests are micro-batched: a collector task waits up to
+    embedding_batch_wait_ms for more texts and encodes them as one batch on a
+    dedicated inference thread, so the event loop never blocks and the CPU runs
+    full batches instead of one string at a time. Query-sized requests go
+    through an LRU cache keyed by text digest; bulk callers (ingestion) bypass it
+    so they do not evict hot queries. Bulk work is also queued separately, in
+    slices of embedding_bulk_slice_size texts that only run while no
+    interactive request waits, so a query waits for at most one slice.
+    """
+
+    def __init__(self):
+        self._model = None
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._interactive: deque = deque()
+        self._bulk: deque = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._metrics = {
+            "requests": 0,
+            "texts": 0,
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "batches": 0,
+            "batched_texts": 0,
+            "max_batch_size": 0,
+            "inference_seconds": 0.0
+        }
+
+    def _get_model(self):
+        """Load the model on first use (import is deferred; torch start-up is slow)"""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    import torch
+                    if settings.embedding_threads:
+                        # Several workers share the cores; do not let each spawn one thread per core
+                        torch.set_num_threads(settings.embedding_threads)
+                    self._model = SentenceTransformer(settings.embedding_model, device="cpu")
+        return self._model
+
+    def preload(self):
+        """Load the model now (in the server's master process when preloading)"""
+        self._get_model()
+
+    @property
+    def dimension(self) -> int:
+        return self._get_model().get_sentence_embedding_dimension()
+
+    def _encode(self, texts: List[str], batch_size: Optional[int] = None) -> np.ndarray:
+        return self._get_model().encode(
+            texts,
+            batch_size=batch_size or settings.embedding_batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        ).astype(np.float32, copy=False)
+
+    async def embed(self, texts: List[str], use_cache: bool = True, bulk: bool = False) -> np.ndarray:
+        """
+        Embed texts as L2-normalized float32 rows, off the event loop. Bulk
+        requests (ingestion) yield the inference thread to interactive ones.
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        self._metrics["requests"] += 1
+        self._metrics["texts"] += len(texts)
+        if not use_cache:
+            return await self._submit(texts, bulk)
+
+        keys = [hashlib.sha256(text.encode("utf-8")).digest() for text in texts]
+        rows: List[Optional[np.ndarray]] = [None] * len(texts)
+        missing: Dict[bytes, Tuple[str, List[int]]] = {}
+        for index, key in enumerate(keys):
+            row = self._cache.get(key)
+            if row is not None:
+                self._cache.move_to_end(key)
+                rows[index] = row
+            else:
+                missing.setdefault(key, (texts[index], []))[1].append(index)
+        # Both counted in texts (a text repeated within the request is one lookup each)
+        misses = sum(len(indexes) for _, indexes in missing.values())
+        self._metrics["cache_hits"] += len(texts) - misses
+        self._metrics["cache_misses"] += misses
+
+        if missing:
+            embeddings = await self._submit([text for text, _ in missing.values()], bulk)
+            for (key, (_, indexes)), row in zip(missing.items(), embeddings):
+                for index in indexes:
+                    rows[index] = row
+                self._cache[key] = row
+            while len(self._cache) > settings.embedding_cache_size:
+                self._cache.popitem(last=False)
+        return np.stack(rows)
+
+    async def _submit(self, texts: List[str], bulk: bool = False) -> np.ndarray:
+        """Queue texts for the next micro-batch (or bulk slices) and wait for their embeddings"""
+        loop = asyncio.get_running_loop()
+        if self._collector is None or self._collector.done():
+            self._interactive.clear()
+            self._bulk.clear()
+            self._wakeup = asyncio.Event()
+            self._collector = loop.create_task(self._collect())
+        if not bulk:
+            future = loop.create_future()
+            self._interactive.append((texts, future))
+            self._wakeup.set()
+            return await future
+        futures = []
+        for start in range(0, len(texts), settings.embedding_bulk_slice_size):
+            future = loop.create_future()
+            self._bulk.append((texts[start:start + settings.embedding_bulk_slice_size], future))
+            futures.append(future)
+        self._wakeup.set()
+        return np.concatenate(await asyncio.gather(*futures))
+
+    async def _next_batch(self) -> List[Tuple[List[str], asyncio.Future]]:
+        """
+        Interactive requests arriving within embedding_batch_wait_ms of each
+        other, or else one bulk slice
+        """
+        loop = asyncio.get_running_loop()
+        while not self._interactive and not self._bulk:
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        if not self._interactive:
+            return [self._bulk.popleft()]
+
+        batch = [self._interactive.popleft()]
+        size = len(batch[0][0])
+        deadline = loop.time() + settings.embedding_batch_wait_ms / 1000
+        while size < settings.embedding_max_batch_size:
+            if self._interactive:
+                batch.append(self._interactive.popleft())
+                size += len(batch[-1][0])
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _collect(self):
+        """Gather queued requests into batches and run them on the inference thread"""
+        loop = asyncio.get_running_loop()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding")
+        while True:
+            # Requests whose callers went away are not encoded
+            batch = [item for item in await self._next_batch() if not item[1].done()]
+            if not batch:
+                continue
+
+            texts = [text for item_texts, _ in batch for text in item_texts]
+            started = time.perf_counter()
+            try:
+                embeddings = await loop.run_in_executor(self._executor, self._encode, texts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self._record_batch(len(texts), time.perf_counter() - started)
+
+            offset = 0
+            for item_texts, future in batch:
+                if not future.done():
+                    future.set_result(embeddings[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+
+    def _record_batch(self, size: int, seconds: float):
+        self._metrics["batches"] += 1
+        self._metrics["batched_texts"] += size
+        self._metrics["max_batch_size"] = max(self._metrics["max_batch_size"], size)
+        self._metrics["inference_seconds"] += seconds
+
+    def metrics(self) -> Dict[str, Any]:
+        """Throughput, batch-size and cache counters of this process"""
+        metrics = dict(self._metrics)
+        metrics["average_batch_size"] = metrics["batched_texts"] / metrics["batches"] if metrics["batches"] else 0.0
+        metrics["texts_per_second"] = (
+            metrics["batched_texts"] / metrics["inference_seconds"] if metrics["inference_seconds"] else 0.0
+        )
+        lookups = metrics["cache_hits"] + metrics["cache_misses"]
+        metrics["cache_hit_rate"] = metrics["cache_hits"] / lookups if lookups else 0.0
+        metrics["cache_entries"] = len(self._cache)
+        metrics["queued_requests"] = len(self._interactive)
+        metrics["queued_bulk_slices"] = len(self._bulk)
+        metrics["model"] = settings.embedding_model
+        return metrics
+
+    async def close(self):
+        """Stop the batch collector and the inference thread"""
+        if self._collector is not None:
+            self._collector.cancel()
+            try:
+                await self._collector
+            except asyncio.CancelledError:
+                pass
+            self._collector = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
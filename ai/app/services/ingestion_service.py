@@ -0,0 +1,290 @@
+import asyncio
+import hashlib
+import html
+import os
+import re
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+import redis.asyncio as redis
+
+from .embedding_service import EmbeddingService
+from .knowledge_store import KnowledgeStore
+from .redis_service import RedisService
+from .tokenizer import chunk_text
+from .url_policy import BlockedURL, check_url
+from .vector_index import compact_store
+from ..config import settings
+
+_TAG_PATTERN = re.compile(r"<(script|style)[^>]*>.*?</\1>|<[^>]+>", re.S | re.I)
+_SPACE_PATTERN = re.compile(r"[ \t]+")
+TEXT_EXTENSIONS = (".txt", ".md", ".markdown", ".rst", ".csv", ".json", ".html", ".htm")
+
+
+class IngestionService:
+    """
+    Incremental knowledge-base ingestion.
+
+    Documents are read one at a time from the knowledge base's source, chunked, and
+    identified by a digest of their content. Only chunks missing from the store's
+    manifest are embedded (in batches) and written; chunks that disappeared are
+    tombstoned. Jobs run in the background and report progress through Redis, and
+    compact the store's segments once enough of them piled up.
+    """
+
+    def __init__(self, embedding_service: EmbeddingService, redis_service: RedisService):
+        self.embedding_service = embedding_service
+        self.redis = redis_service
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    @property
+    def redis_client(self) -> Optional[redis.Redis]:
+        """Shared Redis client (decoded strings), or None while Redis is unreachable"""
+        return self.redis.get(decode_responses=True)
+
+    async def disconnect(self):
+        """Give running jobs a grace period and cancel the rest"""
+        tasks = list(self._tasks.values())
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=settings.shutdown_grace_seconds)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def start(
+        self,
+        company_id: str,
+        knowledge_base_id: str,
+        source_type: str,
+        source_config: Dict[str, Any],
+        prune_missing: bool = True
+    ) -> str:
+        """
+        Start a background ingestion job, returning its id. Raises ValueError for
+        invalid ids and PermissionError for sources outside the allowed roots/hosts.
+        """
+        if not self.redis_client:
+            raise RuntimeError("Ingestion job store unavailable")
+        store = KnowledgeStore(company_id, knowledge_base_id)
+        await self._check_source(source_type, source_config or {})
+
+        job_id = str(uuid.uuid4())
+        lock_key = f"kb_ingest_lock:{company_id}:{knowledge_base_id}"
+        if not await self.redis_client.set(lock_key, job_id, nx=True, ex=settings.kb_ingest_job_ttl):
+            raise ValueError("An ingestion job is already running for this knowledge base")
+
+        await self._update(job_id, {
+            "job_id": job_id,
+            "company_id": company_id,
+            "knowledge_base_id": knowledge_base_id,
+            "status": "running",
+            "documents": 0,
+            "chunks": 0,
+            "embedded": 0,
+            "skipped": 0,
+            "deleted": 0,
+            "started_at": time.time()
+        })
+
+        task = asyncio.create_task(self._run(job_id, lock_key, store, source_type, source_config, prune_missing))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+        return job_id
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get the progress of an ingestion job"""
+        if not self.redis_client:
+            return None
+        job = await self.redis_client.hgetall(f"kb_ingest:{job_id}")
+        return job or None
+
+    async def _update(self, job_id: str, fields: Dict[str, Any]):
+        key = f"kb_ingest:{job_id}"
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.hset(key, mapping={k: str(v) for k, v in fields.items()})
+            pipe.expire(key, settings.kb_ingest_job_ttl)
+            await pipe.execute()
+
+    async def _run(
+        self,
+        job_id: str,
+        lock_key: str,
+        store: KnowledgeStore,
+        source_type: str,
+        source_config: Dict[str, Any],
+        prune_missing: bool
+    ):
+        progress = {"documents": 0, "chunks": 0, "embedded": 0, "skipped": 0, "deleted": 0}
+        try:
+            manifest = await asyncio.to_thread(store.load_manifest)
+            seen = set()
+            pending_chunks: List[Dict[str, str]] = []
+            pending_docs: Dict[str, Optional[List[str]]] = {}
+            removed: List[str] = []
+
+            async def flush():
+                if not pending_chunks and not removed and not pending_docs:
+                    return
+                texts = [chunk["text"] for chunk in pending_chunks]
+                embeddings = await self.embedding_service.embed(texts, use_cache=False, bulk=True) if texts else None
+                await asyncio.to_thread(self._commit, store, manifest, pending_docs, pending_chunks, embeddings, removed)
+                progress["embedded"] += len(pending_chunks)
+                progress["deleted"] += len(removed)
+                pending_chunks.clear()
+                pending_docs.clear()
+                removed.clear()
+                await self._update(job_id, progress)
+
+            async for document_id, text in self._read_documents(source_type, source_config):
+                seen.add(document_id)
+                old_ids = set(manifest.get(document_id, []))
+                chunk_ids: List[str] = []
+                for chunk in chunk_text(text, settings.embedding_model, settings.kb_chunk_tokens, settings.kb_chunk_overlap_tokens):
+                    chunk_id = hashlib.sha256(f"{document_id}\0{chunk}".encode("utf-8")).hexdigest()[:32]
+                    if chunk_id in chunk_ids:
+                        continue
+                    chunk_ids.append(chunk_id)
+                    if chunk_id not in old_ids:
+                        pending_chunks.append({"id": chunk_id, "document_id": document_id, "text": chunk})
+                    else:
+                        progress["skipped"] += 1
+
+                removed.extend(old_ids.difference(chunk_ids))
+                pending_docs[document_id] = chunk_ids
+                progress["documents"] += 1
+                progress["chunks"] += len(chunk_ids)
+
+                # Flush at document boundaries so the manifest never lists unwritten chunks
+                if len(pending_chunks) >= settings.kb_flush_chunks:
+                    await flush()
+                elif progress["documents"] % 100 == 0:
+                    await self._update(job_id, progress)
+
+            if prune_missing:
+                for document_id in set(manifest).difference(seen):
+                    removed.extend(manifest[document_id])
+                    pending_docs[document_id] = None
+            await flush()
+
+            if await asyncio.to_thread(store.needs_compaction):
+                await self._update(job_id, {"status": "compacting"})
+                await asyncio.to_thread(compact_store, store)
+
+            await self._update(job_id, {"status": "completed", "finished_at": time.time()})
+        except asyncio.CancelledError:
+            await self._update(job_id, {"status": "cancelled", "finished_at": time.time()})
+            raise
+        except Exception as e:
+            print(f"Knowledge base ingestion failed: {e}")
+            await self._update(job_id, {"status": "failed", "error": str(e), "finished_at": time.time()})
+        finally:
+            await self.redis_client.delete(lock_key)
+
+    @staticmethod
+    def _commit(store, manifest, pending_docs, pending_chunks, embeddings, removed):
+        """Persist a flush: tombstones, then the new segment, then the manifest"""
+        store.add_tombstones(removed)
+        if pending_chunks:
+            store.write_segment(pending_chunks, embeddings)
+        for document_id, chunk_ids in pending_docs.items():
+            if chunk_ids is None:
+                manifest.pop(document_id, None)
+            else:
+                manifest[document_id] = chunk_ids
+        store.save_manifest(manifest)
+        store.bump_generation()
+
+    async def _read_documents(self, source_type: str, source_config: Dict[str, Any]) -> AsyncIterator[Tuple[str, str]]:
+        """Stream (document id, text) pairs from a knowledge base source"""
+        source_config = source_config or {}
+        if "documents" in source_config:
+            for index, document in enumerate(source_config["documents"]):
+                yield str(document.get("id", index)), document.get("text", "")
+        elif source_type in ("document", "file"):
+            async for document in self._read_files(source_config):
+                yield document
+        elif source_type in ("website", "api"):
+            async for document in self._read_urls(source_config):
+                yield document
+        else:
+            raise ValueError(f"Unsupported source type for ingestion: {source_type}")
+
+    @staticmethod
+    def _source_urls(source_config: Dict[str, Any]) -> List[str]:
+        return source_config.get("urls") or ([source_config["url"]] if source_config.get("url") else [])
+
+    async def _check_source(self, source_type: str, source_config: Dict[str, Any]):
+        """Reject file paths outside the ingestion root and disallowed URLs up front"""
+        if "documents" in source_config:
+            return
+        if source_type in ("document", "file") and source_config.get("path"):
+            self._resolve_path(source_config["path"])
+        elif source_type in ("website", "api"):
+            for url in self._source_urls(source_config):
+                await check_url(url)
+
+    @staticmethod
+    def _resolve_path(path: str) -> str:
+        """
+        Real path of a file source, which must lie inside kb_ingest_root (relative
+        paths are taken from it); symlinks are resolved before the check.
+        """
+        root = os.path.realpath(settings.kb_ingest_root)
+        resolved = os.path.realpath(os.path.join(root, path))
+        if os.path.commonpath([root, resolved]) != root:
+            raise PermissionError("File sources must be inside the ingestion root")
+        return resolved
+
+    async def _read_files(self, source_config: Dict[str, Any]) -> AsyncIterator[Tuple[str, str]]:
+        if not source_config.get("path"):
+            raise ValueError("source_config.path is required for file sources")
+        root = self._resolve_path(source_config["path"])
+        if os.path.isfile(root):
+            paths = [root]
+        else:
+            paths = (
+                os.path.join(directory, name)
+                for directory, _, names in os.walk(root)
+                for name in sorted(names)
+                if name.lower().endswith(TEXT_EXTENSIONS)
+            )
+        for path in paths:
+            # A symlink inside the tree may point anywhere
+            real = self._resolve_path(path)
+            text = await asyncio.to_thread(self._read_file, real)
+            if path.lower().endswith((".html", ".htm")):
+                text = self._strip_html(text)
+            yield os.path.relpath(path, root) if root != path else os.path.basename(path), text
+
+    @staticmethod
+    def _read_file(path: str) -> str:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return f.read(settings.kb_max_document_bytes)
+
+    async def _read_urls(self, source_config: Dict[str, Any]) -> AsyncIterator[Tuple[str, str]]:
+        urls = self._source_urls(source_config)
+        if not urls:
+            raise ValueError("source_config.urls is required for website and API sources")
+        # Redirects are not followed: their targets would skip the URL checks
+        async with httpx.AsyncClient(timeout=30.0, headers=source_config.get("headers"), follow_redirects=False) as client:
+            for url in urls:
+                await check_url(url)
+                async with client.stream("GET", url) as response:
+                    if response.is_redirect:
+                        raise BlockedURL(f"Redirects are not followed: {url}")
+                    response.raise_for_status()
+                    body = bytearray()
+                    async for data in response.aiter_bytes():
+                        body.extend(data[:settings.kb_max_document_bytes - len(body)])
+                        if len(body) >= settings.kb_max_document_bytes:
+                            break
+                    text = body.decode(response.encoding or "utf-8", errors="replace")
+                    if "html" in response.headers.get("content-type", ""):
+                        text = self._strip_html(text)
+                yield url, text
+
+    @staticmethod
+    def _strip_html(text: str) -> str:
+        return _SPACE_PATTERN.sub(" ", html.unescape(_TAG_PATTERN.sub(" ", text)))
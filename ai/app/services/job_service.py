@@ -0,0 +1,291 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+import redis.asyncio as redis
+from redis.exceptions import ConnectionError, ResponseError, TimeoutError
+
+from platform_common.codec import dumps, loads
+from platform_common.token_quota import settle_reservation
+
+from .redis_service import RedisService
+from .scheduler import RequestContext, request_context
+from .url_policy import BlockedURL, check_url
+from ..config import settings
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+FINAL_STATUSES = ("completed", "failed")
+
+class JobService:
+    """
+    Asynchronous AI jobs on a Redis Stream.
+
+    Submitting stores the job (operation, payload, webhook) in a hash and appends
+    its id to the job stream. Worker processes read the stream through a consumer
+    group, so each job goes to one worker and stays pending until acknowledged;
+    jobs of a worker that died are claimed by another one once they have been
+    idle for job_claim_idle_ms. Workers keep claiming their running jobs to reset
+    that idle time. Results are kept on the job hash for job_result_ttl and can be
+    polled, long-polled or pushed to a webhook.
+    """
+
+    def __init__(self, redis_service: RedisService):
+        self.redis = redis_service
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self._stopping = False
+
+    @property
+    def redis_client(self) -> Optional[redis.Redis]:
+        """Shared Redis client (decoded strings), or None while Redis is unreachable"""
+        return self.redis.get(decode_responses=True)
+
+    async def submit(
+        self,
+        operation: str,
+        payload: Dict[str, Any],
+        company_id: Optional[str] = None,
+        webhook_url: Optional[str] = None,
+        plan: Optional[str] = None,
+        token_reservation_id: Optional[str] = None
+    ) -> str:
+        """Queue a job, returning its id (BlockedURL if the webhook may not be called)"""
+        if not self.redis_client:
+            raise RuntimeError("Job queue unavailable")
+        if webhook_url:
+            await check_url(webhook_url)
+
+        job_id = str(uuid.uuid4())
+        key = f"ai_job:{job_id}"
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={
+                "job_id": job_id,
+                "operation": operation,
+                "payload": dumps(payload),
+                "company_id": company_id or "",
+                "webhook_url": webhook_url or "",
+                "plan": plan or settings.scheduler_default_plan,
+                "token_reservation_id": token_reservation_id or "",
+                "status": "queued",
+                "attempts": 0,
+                "created_at": time.time()
+            })
+            pipe.expire(key, settings.job_result_ttl)
+            pipe.xadd(settings.job_stream, {"job_id": job_id})
+            await pipe.execute()
+        return job_id
+
+    async def get(self, job_id: str, wait: float = 0) -> Optional[Dict[str, Any]]:
+        """
+        Get a job, waiting up to `wait` seconds for it to finish (long-poll).
+
+        The job hash is re-read with a growing interval, which keeps long-polls
+        cheap without a subscription per waiting request.
+        """
+        if not self.redis_client:
+            return None
+        deadline = time.monotonic() + min(wait, settings.job_max_wait_seconds)
+        interval = 0.05
+        while True:
+            job = await self.redis_client.hgetall(f"ai_job:{job_id}")
+            if not job:
+                return None
+            remaining = deadline - time.monotonic()
+            if job.get("status") in FINAL_STATUSES or remaining <= 0:
+                return self._decode(job)
+            await asyncio.sleep(min(interval, remaining))
+            interval = min(interval * 2, 1.0)
+
+    @staticmethod
+    def _decode(job: Dict[str, str]) -> Dict[str, Any]:
+        job.pop("payload", None)
+        if "result" in job:
+            job["result"] = loads(job["result"])
+        job["attempts"] = int(job.get("attempts", 0))
+        return job
+
+    # Worker side
+
+    async def run_worker(self, handlers: Dict[str, JobHandler]):
+        """Consume jobs until stop() is called, running up to job_worker_concurrency at once"""
+        await self._ensure_group()
+        slots = asyncio.Semaphore(settings.job_worker_concurrency)
+        running: set = set()
+        reclaim_at = 0.0
+
+        while not self._stopping:
+            if not self.redis_client:
+                # Redis is down; the shared layer reconnects in the background
+                await asyncio.sleep(1)
+                continue
+            entries: List[Tuple[str, Dict[str, str]]] = []
+            free = settings.job_worker_concurrency - len(running)
+            try:
+                if time.monotonic() >= reclaim_at:
+                    entries = await self._reclaim()
+                    reclaim_at = time.monotonic() + settings.job_claim_idle_ms / 2000
+                if not entries and free > 0:
+                    response = await self.redis_client.xreadgroup(
+                        settings.job_group,
+                        self.consumer,
+                        {settings.job_stream: ">"},
+                        count=free,
+                        block=1000
+                    )
+                    entries = response[0][1] if response else []
+            except (ConnectionError, TimeoutError) as e:
+                print(f"Job stream read failed: {e}")
+                await asyncio.sleep(1)
+                continue
+            except ResponseError as e:
+                if "NOGROUP" not in str(e):
+                    raise
+                # Redis restarted without its data; recreate the consumer group
+                await self._ensure_group()
+                continue
+
+            for entry_id, fields in entries:
+                await slots.acquire()
+                task = asyncio.create_task(self._process(entry_id, fields.get("job_id"), handlers))
+                running.add(task)
+                task.add_done_callback(running.discard)
+                task.add_done_callback(lambda _: slots.release())
+            if free <= 0:
+                # Wait for a slot instead of spinning on a full worker
+                await slots.acquire()
+                slots.release()
+
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+    def stop(self):
+        """Stop reading new jobs; running ones are finished"""
+        self._stopping = True
+
+    async def _ensure_group(self):
+        try:
+            await self.redis_client.xgroup_create(settings.job_stream, settings.job_group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _reclaim(self) -> List[Tuple[str, Dict[str, str]]]:
+        """Claim jobs left pending by workers that stopped responding"""
+        response = await self.redis_client.xautoclaim(
+            settings.job_stream,
+            settings.job_group,
+            self.consumer,
+            min_idle_time=settings.job_claim_idle_ms,
+            start_id="0-0",
+            count=settings.job_worker_concurrency
+        )
+        return [entry for entry in response[1] if entry and entry[1]]
+
+    async def _process(self, entry_id: str, job_id: Optional[str], handlers: Dict[str, JobHandler]):
+        key = f"ai_job:{job_id}"
+        job = await self.redis_client.hgetall(key) if job_id else {}
+        if not job or job.get("status") in FINAL_STATUSES:
+            await self._ack(entry_id)
+            return
+
+        attempts = await self.redis_client.hincrby(key, "attempts", 1)
+        if attempts > settings.job_max_attempts:
+            # Redelivered after every attempt died with its worker (OOM, crash, kill):
+            # running it again would take down the next worker too
+            error = f"Job did not finish in {attempts - 1} attempts"
+            print(f"Job {job_id} abandoned: {error}")
+            await self._finish(entry_id, job_id, job, {"status": "failed", "error": error})
+            return
+        await self.redis_client.hset(key, mapping={"status": "running", "worker": self.consumer, "started_at": time.time()})
+        heartbeat = asyncio.create_task(self._heartbeat(entry_id))
+        # Jobs compete for provider capacity as their tenant's batch work
+        request_context.set(RequestContext(
+            job.get("company_id") or "anonymous",
+            job.get("plan") or settings.scheduler_default_plan,
+            "batch"
+        ))
+        try:
+            handler = handlers.get(job["operation"])
+            if handler is None:
+                raise ValueError(f"Unsupported job operation: {job['operation']}")
+            result = await handler(loads(job["payload"]))
+            fields = {"status": "completed", "result": dumps(result)}
+        except Exception as e:
+            print(f"Job {job_id} attempt {attempts} failed: {e}")
+            if attempts < settings.job_max_attempts and not isinstance(e, ValueError):
+                # Leave the entry pending; it is reclaimed after job_claim_idle_ms
+                await self.redis_client.hset(key, mapping={"status": "retrying", "error": str(e)})
+                return
+            fields = {"status": "failed", "error": str(e)}
+        finally:
+            heartbeat.cancel()
+
+        await self._finish(entry_id, job_id, job, fields)
+
+    async def _finish(self, entry_id: str, job_id: str, job: Dict[str, str], fields: Dict[str, Any]):
+        """Store a job's final status, acknowledge it and settle its tokens and webhook"""
+        key = f"ai_job:{job_id}"
+        fields["finished_at"] = time.time()
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping=fields)
+            pipe.expire(key, settings.job_result_ttl)
+            await pipe.execute()
+        await self._ack(entry_id)
+        await self._reconcile_tokens(job, fields)
+
+        if job.get("webhook_url"):
+            await self._notify(job["webhook_url"], job_id, fields)
+
+    async def _heartbeat(self, entry_id: str):
+        """Keep re-claiming a running job so other workers do not take it over"""
+        while True:
+            await asyncio.sleep(settings.job_claim_idle_ms / 3000)
+            await self.redis_client.xclaim(
+                settings.job_stream, settings.job_group, self.consumer, 0, [entry_id], justid=True
+            )
+
+    async def _ack(self, entry_id: str):
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.xack(settings.job_stream, settings.job_group, entry_id)
+            pipe.xdel(settings.job_stream, entry_id)
+            await pipe.execute()
+
+    async def _reconcile_tokens(self, job: Dict[str, str], fields: Dict[str, Any]):
+        """Settle the gateway's token reservation of a finished job against the tokens it used"""
+        if not job.get("token_reservation_id"):
+            return
+        try:
+            used = int(loads(fields["result"]).get("tokens_used") or 0) if "result" in fields else 0
+            await settle_reservation(self.redis_client, job["token_reservation_id"], job.get("company_id", ""), used)
+        except Exception as e:
+            print(f"Job {job.get('job_id')} token reconciliation failed: {e}")
+
+    async def _notify(self, webhook_url: str, job_id: str, fields: Dict[str, Any]):
+        """POST the finished job to its webhook, retrying with backoff"""
+        body = {"job_id": job_id, "status": fields["status"]}
+        if "result" in fields:
+            body["result"] = loads(fields["result"])
+        else:
+            body["error"] = fields.get("error")
+        # Checked again at delivery: the host may resolve elsewhere by now; redirects are not followed
+        try:
+            await check_url(webhook_url)
+        except BlockedURL as e:
+            print(f"Job {job_id} webhook blocked: {e}")
+            await self.redis_client.hset(f"ai_job:{job_id}", "webhook_status", "blocked")
+            return
+        async with httpx.AsyncClient(timeout=settings.job_webhook_timeout, follow_redirects=False) as client:
+            for attempt in range(3):
+                try:
+                    response = await client.post(webhook_url, json=body)
+                    if response.status_code < 500:
+                        await self.redis_client.hset(f"ai_job:{job_id}", "webhook_status", response.status_code)
+                        return
+                except httpx.HTTPError as e:
+                    print(f"Job {job_id} webhook failed: {e}")
+                await asyncio.sleep(2 ** attempt)
+        await self.redis_client.hset(f"ai_job:{job_id}", "webhook_status", "failed")
@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+import re
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from . import lexical_index
+from .lexical_index import LexicalData, build_lexical
+from ..config import settings
+
+# Scale of int8-quantized embeddings (rows are L2-normalized, so components lie in [-1, 1])
+INT8_SCALE = 127.0
+
+# Segment files: "seg-<id>.<kind>"
+MATRIX = "npy"          # quantized embedding matrix
+CHUNKS = "jsonl"        # chunk metadata, one JSON object per row
+IDS = "ids.npy"         # chunk ids (S32), row-aligned
+DOCS = "docs.npy"       # uint64 digest of each row's document id, for filtering
+OFFSETS = "offsets.npy" # byte offset of each row in the JSONL file
+CENTROIDS = "ivf-centroids.npy"
+LISTS = "ivf-lists.npy"
+LEXICAL = (lexical_index.TERMS, lexical_index.META, lexical_index.POSTINGS, lexical_index.LENGTHS)
+
+# Company and knowledge base ids become directory names
+ID_PATTERN = re.compile(r"[A-Za-z0-9_-]+")
+
+
+def quantize(embeddings: np.ndarray) -> np.ndarray:
+    """Quantize float32 embeddings to the configured storage type"""
+    if settings.vector_index_dtype == "int8":
+        return np.clip(np.rint(embeddings * INT8_SCALE), -127, 127).astype(np.int8)
+    return embeddings.astype(np.float16)
+
+
+def dequantize(block: np.ndarray) -> np.ndarray:
+    """Convert a block of stored embeddings back to float32"""
+    if block.dtype == np.int8:
+        return block.astype(np.float32) / INT8_SCALE
+    return block.astype(np.float32)
+
+
+def check_id(value: str, name: str) -> str:
+    """Reject ids that are not safe as a single path component"""
+    if not isinstance(value, str) or len(value) > 128 or not ID_PATTERN.fullmatch(value):
+        raise ValueError(f"Invalid {name}: only letters, digits, '_' and '-' are allowed")
+    return value
+
+
+def document_digest(document_id: str) -> np.uint64:
+    """64-bit digest of a document id"""
+    return np.frombuffer(hashlib.sha256(document_id.encode("utf-8")).digest()[:8], dtype=np.uint64)[0]
+
+
+class KnowledgeStore:
+    """
+    On-disk chunk and embedding storage of one knowledge base.
+
+    Every ingestion flush writes an immutable segment: a quantized embedding
+    matrix, a JSONL file of chunk metadata in the same row order, row-aligned
+    sidecar arrays (chunk ids, document digests, JSONL offsets) that searches
+    memory-map instead of parsing the metadata, and a BM25 inverted index of the
+    chunk texts. Removed chunks are recorded as
+    tombstones. The manifest maps each document to the ids of its chunks, which
+    are digests of their content, so a re-sync can tell unchanged chunks apart
+    without re-embedding them. The generation file changes on every commit so
+    readers in other workers know when to reload.
+    """
+
+    def __init__(self, company_id: str, knowledge_base_id: str):
+        self.company_id = check_id(company_id, "company_id")
+        self.knowledge_base_id = check_id(knowledge_base_id, "knowledge_base_id")
+        self.path = os.path.join(settings.knowledge_base_dir, company_id, knowledge_base_id)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def segment_file(self, segment_id: int, kind: str) -> str:
+        return self._file(f"seg-{segment_id}.{kind}")
+
+    def load_manifest(self) -> Dict[str, List[str]]:
+        """Load the document -> chunk ids manifest"""
+        try:
+            with open(self._file("manifest.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save_manifest(self, manifest: Dict[str, List[str]]):
+        """Atomically replace the manifest"""
+        os.makedirs(self.path, exist_ok=True)
+        tmp = self._file("manifest.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, self._file("manifest.json"))
+
+    def generation(self) -> Optional[int]:
+        """Change marker of the store, or None if nothing was written yet"""
+        try:
+            return os.stat(self._file("generation")).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def bump_generation(self):
+        """Signal readers that segments or tombstones changed"""
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._file("generation"), "w", encoding="utf-8") as f:
+            f.write(str(max(self.segment_ids(), default=0)))
+
+    def segment_ids(self) -> List[int]:
+        """Ids of the complete segments on disk, oldest first"""
+        if not os.path.isdir(self.path):
+            return []
+        ids = []
+        for name in os.listdir(self.path):
+            stem, _, kind = name.partition(".")
+            if kind == MATRIX and stem.startswith("seg-") and stem[4:].isdigit():
+                ids.append(int(stem[4:]))
+        return sorted(ids)
+
+    def write_segment(self, chunks: List[Dict[str, str]], embeddings: np.ndarray) -> int:
+        """Write a new segment of chunks and their float32 embeddings, returning its id"""
+        lines = [(json.dumps(chunk) + "\n").encode("utf-8") for chunk in chunks]
+        return self.write_segment_rows(
+            lines,
+            np.array([chunk["id"] for chunk in chunks], dtype="S32"),
+            np.array([document_digest(chunk["document_id"]) for chunk in chunks], dtype=np.uint64),
+            quantize(embeddings),
+            lexical=build_lexical([chunk["text"] for chunk in chunks])
+        )
+
+    def write_segment_rows(
+        self,
+        lines: Iterable[bytes],
+        ids: np.ndarray,
+        docs: np.ndarray,
+        matrix: np.ndarray,
+        ivf: Optional[tuple] = None,
+        segment_id: Optional[int] = None,
+        lexical: Optional[LexicalData] = None
+    ) -> int:
+        """Write a segment from encoded JSONL rows and row-aligned arrays"""
+        os.makedirs(self.path, exist_ok=True)
+        if segment_id is None:
+            segment_id = max(self.segment_ids(), default=0) + 1
+
+        offsets = np.zeros(len(ids), dtype=np.int64)
+        with open(self.segment_file(segment_id, CHUNKS), "wb") as f:
+            position = 0
+            for row, line in enumerate(lines):
+                offsets[row] = position
+                f.write(line)
+                position += len(line)
+
+        np.save(self.segment_file(segment_id, IDS), ids)
+        np.save(self.segment_file(segment_id, DOCS), docs)
+        np.save(self.segment_file(segment_id, OFFSETS), offsets)
+        if ivf is not None:
+            np.save(self.segment_file(segment_id, CENTROIDS), ivf[0])
+            np.save(self.segment_file(segment_id, LISTS), ivf[1])
+        if lexical is not None:
+            lexical.write(lambda kind: self.segment_file(segment_id, kind))
+        # The matrix goes last: a segment counts as present once it exists
+        tmp = self._file(f"seg-{segment_id}.tmp.npy")
+        if isinstance(matrix, np.memmap):
+            matrix.flush()
+            os.replace(matrix.filename, tmp)
+        else:
+            np.save(tmp, matrix)
+        os.replace(tmp, self.segment_file(segment_id, MATRIX))
+        return segment_id
+
+    def delete_segment(self, segment_id: int):
+        """Remove the files of a segment (open memory maps stay valid)"""
+        for kind in (MATRIX, CHUNKS, IDS, DOCS, OFFSETS, CENTROIDS, LISTS) + LEXICAL:
+            try:
+                os.remove(self.segment_file(segment_id, kind))
+            except FileNotFoundError:
+                pass
+
+    def add_tombstones(self, chunk_ids: Iterable[str]):
+        """
+        Mark chunks as deleted.
+
+        A tombstone only covers copies in segments that exist now, so a chunk whose
+        content comes back later is alive again in the newer segment.
+        """
+        chunk_ids = list(chunk_ids)
+        if not chunk_ids:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        segment_id = max(self.segment_ids(), default=0)
+        with open(self._file("tombstones.txt"), "a", encoding="utf-8") as f:
+            f.write("".join(f"{chunk_id}\t{segment_id}\n" for chunk_id in chunk_ids))
+
+    def load_tombstones(self) -> Dict[str, int]:
+        """Map of deleted chunk id -> newest segment id the deletion applies to"""
+        tombstones: Dict[str, int] = {}
+        try:
+            with open(self._file("tombstones.txt"), "r", encoding="utf-8") as f:
+                for line in f:
+                    chunk_id, _, segment_id = line.rstrip("\n").partition("\t")
+                    tombstones[chunk_id] = max(tombstones.get(chunk_id, 0), int(segment_id or 0))
+        except FileNotFoundError:
+            pass
+        return tombstones
+
+    def clear_tombstones(self):
+        """Drop all tombstones (after compaction applied them)"""
+        try:
+            os.remove(self._file("tombstones.txt"))
+        except FileNotFoundError:
+            pass
+
+    def needs_compaction(self) -> bool:
+        """Whether enough segments or deletions piled up to be worth compacting"""
+        try:
+            tombstone_bytes = os.path.getsize(self._file("tombstones.txt"))
+        except FileNotFoundError:
+            tombstone_bytes = 0
+        return len(self.segment_ids()) > settings.vector_compact_segments or tombstone_bytes > 1_000_000
@@ -0,0 +1,170 @@
+import heapq
+import math
+import re
+from bisect import bisect_left
+from collections import Counter
+from itertools import groupby
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+# Segment files: "seg-<id>.<kind>"
+TERMS = "lex-terms.txt"        # sorted term dictionary, one term per line
+META = "lex-meta.npy"          # int64 (terms, 3): postings byte offset, posting count, delta width
+POSTINGS = "lex-postings.bin"  # per term: delta-encoded rows, then uint8 term frequencies
+LENGTHS = "lex-lengths.npy"    # uint32 token count of each row
+
+# Identifiers such as "SKU-1234", "ERR_CONN_42" or "v2.3.1" stay whole terms
+_TOKEN_PATTERN = re.compile(r"[0-9a-z]+(?:[-_./:#][0-9a-z]+)*")
+_PART_PATTERN = re.compile(r"[-_./:#]")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms of a text; compound identifiers also yield their parts"""
+    terms: List[str] = []
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        terms.append(token)
+        if _PART_PATTERN.search(token):
+            terms.extend(part for part in _PART_PATTERN.split(token) if part)
+    return terms
+
+
+class LexicalData:
+    """Encoded inverted index of one segment, ready to be written"""
+
+    def __init__(self, terms: List[str], meta: np.ndarray, postings: bytes, lengths: np.ndarray):
+        self.terms = terms
+        self.meta = meta
+        self.postings = postings
+        self.lengths = lengths
+
+    def write(self, path_for: Callable[[str], str]):
+        with open(path_for(TERMS), "w", encoding="utf-8") as f:
+            f.write("\n".join(self.terms))
+        np.save(path_for(META), self.meta)
+        with open(path_for(POSTINGS), "wb") as f:
+            f.write(self.postings)
+        np.save(path_for(LENGTHS), self.lengths)
+
+
+def _encode(items: Iterable[Tuple[str, np.ndarray, np.ndarray]], lengths: np.ndarray) -> LexicalData:
+    """Encode (term, ascending rows, term frequencies) items in term order"""
+    terms: List[str] = []
+    meta: List[Tuple[int, int, int]] = []
+    blob = bytearray()
+    for term, rows, tfs in items:
+        deltas = np.diff(rows, prepend=0)
+        largest = int(deltas.max()) if len(deltas) else 0
+        dtype = np.uint8 if largest < 1 << 8 else np.uint16 if largest < 1 << 16 else np.uint32
+        terms.append(term)
+        meta.append((len(blob), len(rows), np.dtype(dtype).itemsize))
+        blob.extend(deltas.astype(dtype).tobytes())
+        blob.extend(np.minimum(tfs, 255).astype(np.uint8).tobytes())
+    return LexicalData(terms, np.array(meta, dtype=np.int64).reshape(-1, 3), bytes(blob), lengths)
+
+
+def build_lexical(texts: Sequence[str]) -> LexicalData:
+    """Build the inverted index of a segment's chunk texts"""
+    postings: Dict[str, Tuple[List[int], List[int]]] = {}
+    lengths = np.zeros(len(texts), dtype=np.uint32)
+    for row, text in enumerate(texts):
+        counts = Counter(tokenize(text))
+        lengths[row] = sum(counts.values())
+        for term, tf in counts.items():
+            rows, tfs = postings.setdefault(term, ([], []))
+            rows.append(row)
+            tfs.append(tf)
+    return _encode(
+        ((term, np.array(postings[term][0], dtype=np.int64), np.array(postings[term][1])) for term in sorted(postings)),
+        lengths
+    )
+
+
+def merge_lexical(segments: List["LexicalSegment"], mappings: List[np.ndarray], rows: int) -> LexicalData:
+    """
+    Merge segment indexes for compaction without re-tokenizing.
+
+    mappings[i] maps each row of segment i to its row in the merged segment, or -1
+    if the row was dropped.
+    """
+    lengths = np.zeros(rows, dtype=np.uint32)
+    for segment, mapping in zip(segments, mappings):
+        kept = mapping >= 0
+        lengths[mapping[kept]] = segment.lengths[kept]
+
+    def items():
+        merged = heapq.merge(*(_term_stream(i, segment.terms) for i, segment in enumerate(segments)))
+        for term, group in groupby(merged, key=lambda item: item[0]):
+            new_rows, new_tfs = [], []
+            for _, segment_index, term_index in group:
+                old_rows, tfs = segments[segment_index].postings(term_index)
+                mapped = mappings[segment_index][old_rows]
+                kept = mapped >= 0
+                new_rows.append(mapped[kept])
+                new_tfs.append(tfs[kept])
+            term_rows = np.concatenate(new_rows)
+            if not len(term_rows):
+                continue
+            term_tfs = np.concatenate(new_tfs)
+            order = np.argsort(term_rows, kind="stable")
+            yield term, term_rows[order], term_tfs[order]
+
+    return _encode(items(), lengths)
+
+
+def _term_stream(segment_index: int, terms: List[str]) -> Iterable[Tuple[str, int, int]]:
+    for term_index, term in enumerate(terms):
+        yield term, segment_index, term_index
+
+
+class LexicalSegment:
+    """Memory-mapped inverted index of one segment"""
+
+    def __init__(self, path_for: Callable[[str], str]):
+        with open(path_for(TERMS), "r", encoding="utf-8") as f:
+            content = f.read()
+        self.terms: List[str] = content.split("\n") if content else []
+        self.meta = np.load(path_for(META), mmap_mode="r")
+        self.blob = np.memmap(path_for(POSTINGS), dtype=np.uint8, mode="r") if self.terms else np.zeros(0, np.uint8)
+        self.lengths = np.load(path_for(LENGTHS), mmap_mode="r")
+
+    def find(self, term: str) -> int:
+        """Index of a term in the dictionary, or -1"""
+        index = bisect_left(self.terms, term)
+        return index if index < len(self.terms) and self.terms[index] == term else -1
+
+    def document_frequency(self, term_index: int) -> int:
+        return int(self.meta[term_index, 1])
+
+    def postings(self, term_index: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Decode the (rows, term frequencies) of a term"""
+        offset, count, width = (int(v) for v in self.meta[term_index])
+        dtype = {1: np.uint8, 2: np.uint16, 4: np.uint32}[width]
+        deltas = self.blob[offset:offset + count * width].view(dtype)
+        rows = np.cumsum(deltas, dtype=np.int64)
+        tfs = self.blob[offset + count * width:offset + count * width + count]
+        return rows, tfs
+
+
+def bm25_scores(
+    segment: LexicalSegment,
+    plan: List[Tuple[float, int]],
+    average_length: float
+) -> np.ndarray:
+    """BM25 score of every row of a segment for a (idf, term index) plan"""
+    scores = np.zeros(len(segment.lengths), dtype=np.float32)
+    average_length = max(average_length, 1.0)
+    for idf, term_index in plan:
+        rows, tfs = segment.postings(term_index)
+        tfs = tfs.astype(np.float32)
+        norms = BM25_K1 * (1 - BM25_B + BM25_B * segment.lengths[rows].astype(np.float32) / average_length)
+        scores[rows] += idf * tfs * (BM25_K1 + 1) / (tfs + norms)
+    return scores
+
+
+def idf(document_frequency: int, documents: int) -> float:
+    """BM25 inverse document frequency"""
+    return math.log(1 + (documents - document_frequency + 0.5) / (document_frequency + 0.5))
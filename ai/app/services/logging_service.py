@@ -1,26 +1,21 @@
-import json
 import time
 from typing import Dict, Any, Optional
-from ..config import settings
+
+from platform_common.codec import dumps_str
+
+from . import value_codec
+from .memory_budget import MemoryBudgets
+from .redis_service import RedisService
 
 class LoggingService:
-    def __init__(self):
-        self.redis_client = None
-    
-    async def connect(self):
-        """Connect to Redis for logging"""
-        try:
-            import redis.asyncio as redis
-            self.redis_client = redis.from_url(settings.redis_url)
-            await self.redis_client.ping()
-        except Exception as e:
-            print(f"Failed to connect to Redis for logging: {e}")
-            self.redis_client = None
+    def __init__(self, redis_service: RedisService):
+        self.redis = redis_service
+        self.budgets = MemoryBudgets()
     
-    async def disconnect(self):
-        """Disconnect from Redis"""
-        if self.redis_client:
-            await self.redis_client.close()
+    @property
+    def redis_client(self):
+        """Shared Redis client, or None while Redis is unreachable"""
+        return self.redis.get()
     
     async def log_request(
         self,
@@ -30,6 +25,7 @@ class LoggingService:
         response_data: Optional[Dict[str, Any]] = None,
         model_used: Optional[str] = None,
         tokens_used: int = 0,
+        cached_tokens: int = 0,
         cost: float = 0.0,
         execution_time_ms: int = 0,
         status: str = "success",
@@ -44,6 +40,7 @@ class LoggingService:
             "response_data": response_data,
             "model_used": model_used,
             "tokens_used": tokens_used,
+            "cached_tokens": cached_tokens,
             "cost": cost,
             "execution_time_ms": execution_time_ms,
             "status": status,
@@ -52,21 +49,24 @@ class LoggingService:
         }
         
         # Log to console
-        print(f"AI Service Log: {json.dumps(log_entry, indent=2)}")
+        print(f"AI Service Log: {dumps_str(log_entry)}")
         
         # Store in Redis if available
         if self.redis_client:
             try:
                 log_key = f"ai_logs:{log_entry['id']}"
-                await self.redis_client.setex(
+                await self.budgets.store(
+                    self.redis_client,
                     log_key,
-                    86400,  # 24 hours
-                    json.dumps(log_entry)
+                    value_codec.encode(log_entry),
+                    86400  # 24 hours
                 )
                 
                 # Add to recent logs list
-                await self.redis_client.lpush("ai_logs:recent", log_key)
-                await self.redis_client.ltrim("ai_logs:recent", 0, 999)  # Keep last 1000 logs
+                async with self.redis_client.pipeline(transaction=False) as pipe:
+                    pipe.lpush("ai_logs:recent", log_key)
+                    pipe.ltrim("ai_logs:recent", 0, 999)  # Keep last 1000 logs
+                    await pipe.execute()
             except Exception as e:
                 print(f"Failed to store log in Redis: {e}")
     
@@ -77,14 +77,10 @@ class LoggingService:
         
         try:
             log_keys = await self.redis_client.lrange("ai_logs:recent", 0, limit - 1)
-            logs = []
-            
-            for key in log_keys:
-                log_data = await self.redis_client.get(key)
-                if log_data:
-                    logs.append(json.loads(log_data))
+            if not log_keys:
+                return []
             
-            return logs
+            return [value_codec.decode(log_data) for log_data in await self.redis_client.mget(log_keys) if log_data]
         except Exception as e:
             print(f"Failed to get recent logs: {e}")
             return []
@@ -95,16 +91,19 @@ class LoggingService:
             return []
         
         try:
-            pattern = f"ai_logs:*"
-            keys = await self.redis_client.keys(pattern)
+            keys = []
+            async for key in self.redis_client.scan_iter(match="ai_logs:log_*", count=500):
+                keys.append(key)
+                if len(keys) >= limit:
+                    break
             logs = []
             
-            for key in keys[:limit]:
-                log_data = await self.redis_client.get(key)
-                if log_data:
-                    log_entry = json.loads(log_data)
-                    if log_entry.get("service_name") == service_name:
-                        logs.append(log_entry)
+            if keys:
+                for log_data in await self.redis_client.mget(keys):
+                    if log_data:
+                        log_entry = value_codec.decode(log_data)
+                        if log_entry.get("service_name") == service_name:
+                            logs.append(log_entry)
             
             return sorted(logs, key=lambda x: x["created_at"], reverse=True)
         except Exception as e:
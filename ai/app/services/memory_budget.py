@@ -0,0 +1,108 @@
+import time
+from typing import Any, Dict, List, Optional
+
+import redis.asyncio as redis
+
+from ..config import settings
+
+# Account a value written to a budgeted namespace and evict until the namespace fits.
+# KEYS: index (member = key, score = expiry time), sizes hash, byte counter
+# ARGV: key, size in bytes, expiry time, now, budget in bytes
+# Returns the number of evicted keys. Evicted keys are not declared in KEYS, so
+# budgets need a non-cluster Redis (as the rest of the cache does).
+ACCOUNT_SCRIPT = """
+local function forget(member)
+    local size = tonumber(redis.call('HGET', KEYS[2], member) or '0')
+    redis.call('HDEL', KEYS[2], member)
+    redis.call('ZREM', KEYS[1], member)
+    return redis.call('DECRBY', KEYS[3], size)
+end
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[4], 'LIMIT', 0, 100)
+for _, member in ipairs(expired) do
+    forget(member)
+end
+local previous = tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or '0')
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+local total = redis.call('INCRBY', KEYS[3], tonumber(ARGV[2]) - previous)
+local evicted = 0
+while total > tonumber(ARGV[5]) do
+    local first = redis.call('ZRANGE', KEYS[1], 0, 0)
+    if #first == 0 or first[1] == ARGV[1] then
+        break
+    end
+    redis.call('UNLINK', first[1])
+    total = forget(first[1])
+    evicted = evicted + 1
+end
+return evicted
+"""
+
+
+def namespace(key: str) -> str:
+    """Namespace of a key: everything before its last segment (summarize:chunk:<digest> -> summarize:chunk)"""
+    return key.rsplit(":", 1)[0]
+
+
+class MemoryBudgets:
+    """
+    Per-namespace Redis memory budgets (settings.cache_namespace_budgets, bytes).
+
+    Each write to a budgeted namespace is measured with MEMORY USAGE and added to
+    the namespace's total; when the total exceeds the budget the entries nearest
+    to expiry are evicted first. Namespaces without a budget are not tracked.
+    """
+
+    def __init__(self):
+        self._script = None
+        self.evicted = 0
+
+    @staticmethod
+    def _keys(name: str) -> List[str]:
+        return [f"cache_budget:{name}:index", f"cache_budget:{name}:sizes", f"cache_budget:{name}:bytes"]
+
+    async def store(self, client: redis.Redis, key: str, value: bytes, ttl: int):
+        """SET key with a TTL, accounting it against its namespace's budget"""
+        budget = settings.cache_namespace_budgets.get(namespace(key))
+        if not budget:
+            await client.set(key, value, ex=ttl)
+            return
+
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.set(key, value, ex=ttl)
+            pipe.memory_usage(key, samples=0)
+            _, size = await pipe.execute()
+        if self._script is None or self._script.registered_client is not client:
+            self._script = client.register_script(ACCOUNT_SCRIPT)
+        now = time.time()
+        self.evicted += await self._script(
+            keys=self._keys(namespace(key)),
+            args=[key, size or len(value), now + ttl, now, budget]
+        )
+
+    async def usage(self, client: redis.Redis) -> Dict[str, Any]:
+        """Tracked bytes and entries of every budgeted namespace, with the server's memory figures"""
+        names = list(settings.cache_namespace_budgets)
+        async with client.pipeline(transaction=False) as pipe:
+            for name in names:
+                index, _, total = self._keys(name)
+                pipe.get(total)
+                pipe.zcard(index)
+            pipe.info("memory")
+            results = await pipe.execute()
+        memory: Optional[Dict[str, Any]] = results[-1]
+        namespaces = {}
+        for position, name in enumerate(names):
+            used = int(results[2 * position] or 0)
+            namespaces[name] = {
+                "bytes": used,
+                "entries": results[2 * position + 1],
+                "budget": settings.cache_namespace_budgets[name],
+                "usage": used / settings.cache_namespace_budgets[name]
+            }
+        return {
+            "namespaces": namespaces,
+            "evicted": self.evicted,
+            "used_memory": memory.get("used_memory"),
+            "maxmemory": memory.get("maxmemory")
+        }
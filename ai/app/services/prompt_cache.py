@@ -0,0 +1,97 @@
+import hashlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from .tokenizer import count_message_tokens
+from ..config import settings
+
+# Anthropic accepts at most four cache breakpoints per request
+MAX_CACHE_BREAKPOINTS = 4
+EPHEMERAL = {"type": "ephemeral"}
+
+
+class PromptCachePlan:
+    """Stable-prefix layout of a conversation for provider-side prompt caching"""
+
+    def __init__(self, messages: List[Dict[str, str]], system_count: int, breakpoints: List[int], prefix_tokens: int):
+        # Messages with leading system prompts hoisted to the front
+        self.messages = messages
+        # Number of leading system messages
+        self.system_count = system_count
+        # Indices of messages that end a cacheable prefix
+        self.breakpoints = breakpoints
+        self.prefix_tokens = prefix_tokens
+
+    @property
+    def cacheable(self) -> bool:
+        return bool(self.breakpoints)
+
+    @property
+    def prefix_key(self) -> Optional[str]:
+        """Digest of the system prefix, used to route requests sharing it to the same cache"""
+        if not self.system_count:
+            return None
+        digest = hashlib.sha256()
+        for message in self.messages[:self.system_count]:
+            digest.update(message["content"].encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()[:32]
+
+
+def plan_prompt_cache(messages: List[Dict[str, str]], model: str) -> PromptCachePlan:
+    """
+    Find the stable prefixes of a conversation.
+
+    System messages sent before the first assistant reply are instructions and
+    reference context that repeat verbatim on every call, so they are hoisted to
+    the front; anything after the first reply keeps its position. Breakpoints are
+    placed after the leading system block (first and last system message, so an
+    appended rolling summary does not invalidate the pinned prompt) and after the
+    last assistant reply, which makes the history itself a cached prefix for the
+    next turn. Prefixes shorter than the provider minimum are not marked.
+    """
+    first_reply = next((i for i, m in enumerate(messages) if m["role"] == "assistant"), len(messages))
+    leading_system = [m for m in messages[:first_reply] if m["role"] == "system"]
+    ordered = leading_system + [
+        m for i, m in enumerate(messages) if i >= first_reply or m["role"] != "system"
+    ]
+
+    system_count = len(leading_system)
+    candidates: List[int] = []
+    if system_count:
+        candidates.extend(sorted({0, system_count - 1}))
+    last_reply = max((i for i, m in enumerate(ordered) if m["role"] == "assistant"), default=None)
+    if last_reply is not None and last_reply >= system_count:
+        candidates.append(last_reply)
+
+    breakpoints: List[int] = []
+    prefix_tokens = 0
+    running = 0
+    position = 0
+    for index in candidates:
+        while position <= index:
+            running += count_message_tokens(ordered[position], model)
+            position += 1
+        if running >= settings.prompt_cache_min_tokens:
+            breakpoints.append(index)
+            prefix_tokens = running
+
+    return PromptCachePlan(ordered, system_count, breakpoints[-MAX_CACHE_BREAKPOINTS:], prefix_tokens)
+
+
+def to_anthropic(plan: PromptCachePlan) -> Tuple[Optional[List[Dict[str, Any]]], List[Dict[str, Any]]]:
+    """Build Anthropic system blocks and messages with cache_control breakpoints"""
+    marked = set(plan.breakpoints)
+    system: List[Dict[str, Any]] = []
+    messages: List[Dict[str, Any]] = []
+    for index, message in enumerate(plan.messages):
+        block: Dict[str, Any] = {"type": "text", "text": message["content"]}
+        if index in marked:
+            block["cache_control"] = EPHEMERAL
+        if message["role"] == "system":
+            # Anthropic takes system prompts as a separate parameter
+            system.append(block)
+        elif index in marked:
+            messages.append({"role": message["role"], "content": [block]})
+        else:
+            messages.append({"role": message["role"], "content": message["content"]})
+    return system or None, messages
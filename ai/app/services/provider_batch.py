@@ -0,0 +1,67 @@
+import asyncio
+from typing import Any, AsyncIterator, Dict, List
+
+import openai
+
+from platform_common.codec import loads
+
+from ..config import settings
+
+FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class OpenAIBatch:
+    """
+    OpenAI Batch API client for offline work.
+
+    Requests are uploaded as a JSONL file and completed asynchronously within
+    24 hours, at half the price of online calls. Inputs are written and results
+    read line by line, so a batch never has to fit in memory.
+    """
+
+    ENDPOINT = "/v1/chat/completions"
+
+    def __init__(self, client: openai.AsyncOpenAI):
+        self.client = client
+
+    @classmethod
+    def request(cls, custom_id: str, model: str, messages: List[Dict[str, str]], max_tokens: int) -> Dict[str, Any]:
+        """Input line of one chat completion (same parameters as the online completion call)"""
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": cls.ENDPOINT,
+            "body": {"model": model, "messages": messages, "max_tokens": max_tokens, "temperature": 0.7}
+        }
+
+    async def submit(self, path: str) -> str:
+        """Upload a JSONL file of requests and start its batch, returning the batch id"""
+        with open(path, "rb") as f:
+            uploaded = await self.client.files.create(file=f, purpose="batch")
+        batch = await self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=self.ENDPOINT,
+            completion_window="24h"
+        )
+        return batch.id
+
+    async def wait(self, batch_id: str) -> Any:
+        """Poll a batch until it has finished, one way or another"""
+        while True:
+            batch = await self.client.batches.retrieve(batch_id)
+            if batch.status in FINAL_STATUSES:
+                return batch
+            await asyncio.sleep(settings.bulk_provider_batch_poll_seconds)
+
+    async def results(self, batch: Any) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Output lines of a finished batch: {"custom_id", "response": {"body"}, "error"}.
+        Requests an expired or cancelled batch did not reach have no line.
+        """
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            async with self.client.files.with_streaming_response.content(file_id) as response:
+                async for line in response.iter_lines():
+                    if line:
+                        yield loads(line)
@@ -0,0 +1,184 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis.asyncio as redis
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError, TimeoutError
+from redis.retry import Retry
+
+from ..config import settings
+
+# Commands that block a connection or change its state cannot share a pipeline
+UNPIPELINED = frozenset((
+    "BLPOP", "BRPOP", "BRPOPLPUSH", "BLMOVE", "BZPOPMIN", "BZPOPMAX", "XREAD", "XREADGROUP",
+    "WAIT", "SUBSCRIBE", "PSUBSCRIBE", "MONITOR", "MULTI", "EXEC", "WATCH", "UNWATCH"
+))
+
+
+class AutoPipelineRedis(redis.Redis):
+    """
+    Redis client that sends the commands issued in one event-loop tick as a single
+    pipeline.
+
+    A command is queued and the queue is flushed by a callback scheduled for the
+    end of the current tick, so concurrent requests (and asyncio.gather inside one
+    request) share a round trip without any change to the calling code. Each
+    caller still gets its own result or exception.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pending: Optional[List[Tuple[Tuple, Dict[str, Any], asyncio.Future]]] = None
+        self._flushes: set = set()
+        self.stats = {"commands": 0, "round_trips": 0, "pipelined_commands": 0, "max_batch_size": 0}
+
+    async def execute_command(self, *args, **options):
+        self.stats["commands"] += 1
+        if not settings.redis_auto_pipeline or str(args[0]).upper() in UNPIPELINED:
+            self.stats["round_trips"] += 1
+            return await super().execute_command(*args, **options)
+
+        loop = asyncio.get_running_loop()
+        if self._pending is None:
+            self._pending = []
+            loop.call_soon(self._flush)
+        future = loop.create_future()
+        self._pending.append((args, options, future))
+        return await future
+
+    def _flush(self):
+        batch, self._pending = self._pending, None
+        task = asyncio.ensure_future(self._send(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _send(self, batch: List[Tuple[Tuple, Dict[str, Any], asyncio.Future]]):
+        self.stats["round_trips"] += 1
+        self.stats["max_batch_size"] = max(self.stats["max_batch_size"], len(batch))
+        if len(batch) == 1:
+            args, options, future = batch[0]
+            try:
+                results: List[Any] = [await super().execute_command(*args, **options)]
+            except Exception as e:
+                results = [e]
+        else:
+            self.stats["pipelined_commands"] += len(batch)
+            pipe = self.pipeline(transaction=False)
+            for args, options, _ in batch:
+                pipe.execute_command(*args, **options)
+            try:
+                results = await pipe.execute(raise_on_error=False)
+            except Exception as e:
+                results = [e] * len(batch)
+
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+class RedisService:
+    """
+    The process's Redis connections, shared by every component.
+
+    There is one pool for binary values and one for decoded strings (the
+    decoding is a connection setting). A monitor task pings Redis every
+    redis_health_check_interval; while Redis is unreachable get() returns None
+    so callers degrade as they do without Redis, and the monitor keeps retrying
+    with exponential backoff until it is back.
+    """
+
+    def __init__(self):
+        self.client: Optional[AutoPipelineRedis] = None
+        self.text_client: Optional[AutoPipelineRedis] = None
+        self.healthy = False
+        self._monitor: Optional[asyncio.Task] = None
+        self._metrics = {"failed_checks": 0, "reconnects": 0}
+
+    def _client(self, decode_responses: bool) -> AutoPipelineRedis:
+        return AutoPipelineRedis.from_url(
+            settings.redis_url,
+            decode_responses=decode_responses,
+            max_connections=settings.redis_max_connections,
+            socket_timeout=settings.redis_socket_timeout,
+            socket_connect_timeout=settings.redis_socket_timeout,
+            socket_keepalive=True,
+            health_check_interval=30,
+            retry=Retry(ExponentialBackoff(cap=1.0, base=0.05), 3),
+            retry_on_error=[ConnectionError, TimeoutError]
+        )
+
+    async def connect(self):
+        """Create the pools and start the health monitor (per worker process, after fork)"""
+        self.client = self._client(decode_responses=False)
+        self.text_client = self._client(decode_responses=True)
+        if not await self._check():
+            print("Redis unavailable; retrying in the background")
+        self._monitor = asyncio.create_task(self._watch())
+
+    async def disconnect(self):
+        """Stop the monitor and close both pools"""
+        if self._monitor is not None:
+            self._monitor.cancel()
+            try:
+                await self._monitor
+            except asyncio.CancelledError:
+                pass
+            self._monitor = None
+        for client in (self.client, self.text_client):
+            if client is not None:
+                await client.close()
+        self.healthy = False
+
+    def get(self, decode_responses: bool = False) -> Optional[AutoPipelineRedis]:
+        """Shared client, or None while Redis is unreachable"""
+        if not self.healthy:
+            return None
+        return self.text_client if decode_responses else self.client
+
+    async def _check(self) -> bool:
+        try:
+            await asyncio.wait_for(self.client.ping(), settings.redis_socket_timeout)
+        except Exception as e:
+            self._metrics["failed_checks"] += 1
+            if self.healthy:
+                print(f"Redis health check failed: {e}")
+            self.healthy = False
+            return False
+        if not self.healthy and self._monitor is not None:
+            self._metrics["reconnects"] += 1
+            print("Redis connection restored")
+        self.healthy = True
+        return True
+
+    async def _watch(self):
+        delay = settings.redis_health_check_interval
+        while True:
+            await asyncio.sleep(delay)
+            if await self._check():
+                delay = settings.redis_health_check_interval
+                continue
+            # Drop connections to the old server so the next ones are fresh
+            for client in (self.client, self.text_client):
+                await client.connection_pool.disconnect(inuse_connections=False)
+            delay = min(delay * 2, settings.redis_max_backoff_seconds)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Health, pipelining and pool counters of this process"""
+        metrics: Dict[str, Any] = {"healthy": self.healthy, **self._metrics}
+        for name, client in (("binary", self.client), ("text", self.text_client)):
+            if client is None:
+                continue
+            pool = client.connection_pool
+            stats = client.stats
+            metrics[name] = {
+                **stats,
+                "commands_per_round_trip": stats["commands"] / stats["round_trips"] if stats["round_trips"] else 0.0,
+                "max_connections": pool.max_connections,
+                "in_use_connections": len(pool._in_use_connections),
+                "idle_connections": len(pool._available_connections)
+            }
+        return metrics
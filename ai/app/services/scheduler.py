@@ -0,0 +1,321 @@
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Tuple
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from platform_common.codec import FastJSONResponse
+
+from ..config import settings
+
+PRIORITIES = ("interactive", "batch")
+
+
+class RequestContext:
+    """Tenant, plan and priority class of the request being served"""
+
+    def __init__(self, tenant: str, plan: str, priority: str = "interactive", deadline: Optional[float] = None):
+        self.tenant = tenant
+        self.plan = plan if plan in settings.scheduler_plan_weights else settings.scheduler_default_plan
+        self.priority = priority if priority in PRIORITIES else "interactive"
+        # Absolute time.time() by which the request must have been served
+        self.deadline = deadline
+
+
+request_context: ContextVar[Optional[RequestContext]] = ContextVar("ai_request_context", default=None)
+
+
+def remaining_seconds(default: float) -> float:
+    """Time left until the current request's deadline, capped at `default`"""
+    context = request_context.get()
+    if context is None or context.deadline is None:
+        return default
+    return min(max(context.deadline - time.time(), 0.0), default)
+
+
+class Overloaded(Exception):
+    """The request was shed; the caller should retry after `retry_after` seconds"""
+
+    def __init__(self, message: str, status_code: int = 503, retry_after: float = 1.0):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(max(int(math.ceil(self.retry_after)), 1))}
+
+
+class SchedulerTimeout(Overloaded):
+    """A provider call reached its deadline before it could start"""
+
+
+class _Waiter:
+    __slots__ = ("tenant", "priority", "tag", "deadline", "enqueued_at", "future")
+
+    def __init__(self, tenant: "_Tenant", priority: str, tag: float, deadline: float, future: asyncio.Future):
+        self.tenant = tenant
+        self.priority = priority
+        self.tag = tag
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+        self.future = future
+
+
+class _Tenant:
+    def __init__(self, name: str, plan: str):
+        self.name = name
+        self.plan = plan
+        self.running = 0
+        self.queues: Dict[str, Deque[_Waiter]] = {priority: deque() for priority in PRIORITIES}
+        self.finish_tags: Dict[str, float] = {priority: 0.0 for priority in PRIORITIES}
+        self.metrics = {"dispatched": 0, "expired": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+
+    @property
+    def weight(self) -> float:
+        return settings.scheduler_plan_weights[self.plan]
+
+    @property
+    def limit(self) -> int:
+        return settings.scheduler_plan_concurrency[self.plan]
+
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+
+class TenantScheduler:
+    """
+    Weighted fair scheduling of provider calls across tenants.
+
+    Each worker process allows scheduler_max_concurrency provider calls at once.
+    Calls beyond that wait in per-tenant, per-priority FIFO queues and are
+    dispatched by start-time fair queuing: every call gets a virtual start tag
+    advanced by 1 / (plan weight x priority weight), so tenants share capacity
+    in proportion to their plan and interactive calls overtake batch work without
+    starving it. A tenant never runs more than its plan's concurrency cap.
+    Calls whose deadline is close are dispatched earliest-deadline-first;
+    calls whose deadline passed fail with SchedulerTimeout instead of running late.
+    """
+
+    def __init__(self):
+        self.running = 0
+        self.virtual_time = 0.0
+        self.shed = 0
+        self._tenants: Dict[str, _Tenant] = {}
+
+    def _tenant(self, context: RequestContext) -> _Tenant:
+        tenant = self._tenants.get(context.tenant)
+        if tenant is None:
+            tenant = self._tenants[context.tenant] = _Tenant(context.tenant, context.plan)
+        tenant.plan = context.plan
+        return tenant
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold one provider-call slot for the current request"""
+        context = request_context.get() or RequestContext("anonymous", settings.scheduler_default_plan)
+        tenant = self._tenant(context)
+        if context.deadline is not None and context.deadline <= time.time():
+            # The caller has given up; do not spend a provider call on it
+            tenant.metrics["expired"] += 1
+            raise SchedulerTimeout("Request deadline passed before the provider call")
+
+        if self.running < settings.scheduler_max_concurrency and tenant.running < tenant.limit and not self._waiting():
+            self._start(tenant, None)
+        else:
+            await self._wait(tenant, context)
+        try:
+            yield
+        finally:
+            self.running -= 1
+            tenant.running -= 1
+            self._dispatch()
+
+    def _waiting(self) -> bool:
+        return any(tenant.queued() for tenant in self._tenants.values())
+
+    def _oldest_wait(self) -> float:
+        """Seconds the longest-waiting queued call has been waiting"""
+        now = time.monotonic()
+        return max(
+            (now - queue[0].enqueued_at for tenant in self._tenants.values() for queue in tenant.queues.values() if queue),
+            default=0.0
+        )
+
+    def _admit(self, tenant: _Tenant):
+        """Shed a call that would only queue behind an overloaded tenant or process"""
+        oldest_wait = self._oldest_wait()
+        if tenant.queued() >= settings.scheduler_max_tenant_queue:
+            self.shed += 1
+            raise Overloaded(
+                f"Too many queued provider calls for tenant {tenant.name}",
+                status_code=429,
+                retry_after=oldest_wait
+            )
+        queued = sum(other.queued() for other in self._tenants.values())
+        if queued >= settings.scheduler_max_queue or oldest_wait >= settings.scheduler_shed_wait_seconds:
+            self.shed += 1
+            raise Overloaded("AI service is overloaded", status_code=503, retry_after=oldest_wait)
+
+    async def _wait(self, tenant: _Tenant, context: RequestContext):
+        self._admit(tenant)
+        now = time.time()
+        deadline = context.deadline or now + settings.scheduler_max_wait_seconds[context.priority]
+        start_tag = max(self.virtual_time, tenant.finish_tags[context.priority])
+        tenant.finish_tags[context.priority] = start_tag + 1.0 / (
+            tenant.weight * settings.scheduler_priority_weights[context.priority]
+        )
+        future = asyncio.get_running_loop().create_future()
+        waiter = _Waiter(tenant, context.priority, start_tag, deadline, future)
+        tenant.queues[context.priority].append(waiter)
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=max(deadline - now, 0))
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                tenant.metrics["expired"] += 1
+                raise SchedulerTimeout(
+                    f"No provider capacity for tenant {tenant.name} before the request deadline",
+                    retry_after=self._oldest_wait()
+                ) from None
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just as the caller went away; hand it back
+                self.running -= 1
+                tenant.running -= 1
+                self._dispatch()
+            else:
+                future.cancel()
+            raise
+
+    def _start(self, tenant: _Tenant, waiter: Optional[_Waiter]):
+        self.running += 1
+        tenant.running += 1
+        tenant.metrics["dispatched"] += 1
+        if waiter is not None:
+            self.virtual_time = max(self.virtual_time, waiter.tag)
+            waited = time.monotonic() - waiter.enqueued_at
+            tenant.metrics["wait_seconds"] += waited
+            tenant.metrics["max_wait_seconds"] = max(tenant.metrics["max_wait_seconds"], waited)
+            waiter.future.set_result(None)
+
+    def _dispatch(self):
+        """Start queued calls while there is capacity"""
+        while self.running < settings.scheduler_max_concurrency:
+            waiter = self._next()
+            if waiter is None:
+                return
+            waiter.tenant.queues[waiter.priority].popleft()
+            self._start(waiter.tenant, waiter)
+
+    def _next(self) -> Optional[_Waiter]:
+        """Queue head to run next: urgent deadlines first, then the smallest start tag"""
+        now = time.time()
+        best: Optional[Tuple[Tuple[int, float], _Waiter]] = None
+        for tenant in self._tenants.values():
+            if tenant.running >= tenant.limit:
+                continue
+            for queue in tenant.queues.values():
+                # Drop waiters that timed out or went away
+                while queue and queue[0].future.done():
+                    queue.popleft()
+                if not queue:
+                    continue
+                head = queue[0]
+                if head.deadline - now <= settings.scheduler_urgent_seconds:
+                    key = (0, head.deadline)
+                else:
+                    key = (1, head.tag)
+                if best is None or key < best[0]:
+                    best = (key, head)
+        return best[1] if best else None
+
+    def metrics(self) -> Dict[str, Any]:
+        """Global and per-tenant queue metrics of this worker process"""
+        tenants = {}
+        for name, tenant in self._tenants.items():
+            dispatched = tenant.metrics["dispatched"]
+            tenants[name] = {
+                "plan": tenant.plan,
+                "running": tenant.running,
+                "queued": {priority: len(queue) for priority, queue in tenant.queues.items()},
+                "dispatched": dispatched,
+                "expired": tenant.metrics["expired"],
+                "average_wait_ms": tenant.metrics["wait_seconds"] / dispatched * 1000 if dispatched else 0.0,
+                "max_wait_ms": tenant.metrics["max_wait_seconds"] * 1000
+            }
+        return {
+            "running": self.running,
+            "capacity": settings.scheduler_max_concurrency,
+            "queued": sum(tenant.queued() for tenant in self._tenants.values()),
+            "oldest_wait_ms": self._oldest_wait() * 1000,
+            "shed": self.shed,
+            "tenants": tenants
+        }
+
+
+def _parse_deadline(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+class RequestContextMiddleware:
+    """
+    Bind the tenant and deadline headers set by the gateway to the request's
+    RequestContext, and shed requests before any work is done on them: requests
+    whose X-Request-Deadline (epoch seconds) already passed get 504, and requests
+    beyond max_inflight_requests get 503 with Retry-After.
+    """
+
+    # Cheap endpoints that must keep answering under overload
+    EXEMPT_PATHS = ("/health", "/scheduler/metrics", "/embed/metrics", "/classify/metrics", "/redis/metrics",
+                    "/cache/metrics")
+    # Diagnostics are needed most when the service is overloaded
+    EXEMPT_PREFIXES = ("/debug/",)
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.inflight = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if scope["path"] in self.EXEMPT_PATHS or scope["path"].startswith(self.EXEMPT_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        deadline = _parse_deadline(headers.get("x-request-deadline"))
+        if deadline is not None and deadline <= time.time():
+            response = FastJSONResponse({"detail": "Request deadline exceeded"}, status_code=504)
+            await response(scope, receive, send)
+            return
+        if settings.max_inflight_requests and self.inflight >= settings.max_inflight_requests:
+            response = FastJSONResponse(
+                {"detail": "AI service is overloaded"}, status_code=503, headers={"Retry-After": "1"}
+            )
+            await response(scope, receive, send)
+            return
+
+        token = request_context.set(RequestContext(
+            headers.get("x-tenant-id", "anonymous"),
+            headers.get("x-tenant-plan", settings.scheduler_default_plan),
+            headers.get("x-request-priority", "interactive"),
+            deadline
+        ))
+        self.inflight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.inflight -= 1
+            request_context.reset(token)
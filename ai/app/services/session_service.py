@@ -0,0 +1,110 @@
+import redis.asyncio as redis
+from typing import Dict, List, Optional
+from .redis_service import RedisService
+from ..config import settings
+
+# One-byte role tags of the compact message encoding
+ROLE_CODES = {"user": b"u", "assistant": b"a", "system": b"s"}
+CODE_ROLES = {code: role for role, code in ROLE_CODES.items()}
+
+# Append messages, then drop the oldest ones until the count and byte caps hold.
+# KEYS: turn list, byte counter, system prompt.
+# ARGV: ttl, max messages, max bytes, encoded system prompt (or empty), encoded turns...
+APPEND_SCRIPT = """
+if ARGV[4] ~= '' then
+    redis.call('SET', KEYS[3], ARGV[4])
+end
+local size = tonumber(redis.call('GET', KEYS[2]) or '0')
+for i = 5, #ARGV do
+    redis.call('RPUSH', KEYS[1], ARGV[i])
+    size = size + string.len(ARGV[i])
+end
+local length = redis.call('LLEN', KEYS[1])
+while length > 0 and (length > tonumber(ARGV[2]) or size > tonumber(ARGV[3])) do
+    size = size - string.len(redis.call('LPOP', KEYS[1]))
+    length = length - 1
+end
+redis.call('SET', KEYS[2], size, 'EX', ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[3], ARGV[1])
+return length
+"""
+
+
+class SessionService:
+    """
+    Server-side chat history, so clients only send the newest message of a turn.
+
+    Each session is an append-only Redis list of compactly encoded messages (a role
+    tag byte followed by the UTF-8 content), scoped by company so tenants can never
+    read each other's sessions. The system prompt is kept apart from the turns so
+    trimming old turns to the size caps never drops it.
+    """
+
+    def __init__(self, redis_service: RedisService):
+        self.redis = redis_service
+        self._append = None
+
+    async def connect(self):
+        """Register the append script on the shared client"""
+        self._append = self.redis.client.register_script(APPEND_SCRIPT)
+
+    @property
+    def redis_client(self) -> Optional[redis.Redis]:
+        """Shared Redis client, or None while Redis is unreachable"""
+        return self.redis.get()
+
+    @staticmethod
+    def _key(company_id: str, session_id: str) -> str:
+        # Hash tag keeps a session's keys in one cluster slot for the append script
+        return f"chat_session:{{{company_id}:{session_id}}}"
+
+    @staticmethod
+    def _encode(message: Dict[str, str]) -> bytes:
+        return ROLE_CODES.get(message["role"], b"u") + message["content"].encode("utf-8")
+
+    @staticmethod
+    def _decode(value: bytes) -> Dict[str, str]:
+        return {"role": CODE_ROLES.get(value[:1], "user"), "content": value[1:].decode("utf-8")}
+
+    async def get_history(self, company_id: str, session_id: str) -> List[Dict[str, str]]:
+        """Load the system prompt and turns of a session"""
+        if not self.redis_client:
+            raise RuntimeError("Session store unavailable")
+
+        key = self._key(company_id, session_id)
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.get(f"{key}:system")
+            pipe.lrange(key, 0, -1)
+            system, turns = await pipe.execute()
+
+        history = [self._decode(system)] if system else []
+        history.extend(self._decode(value) for value in turns)
+        return history
+
+    async def append(self, company_id: str, session_id: str, messages: List[Dict[str, str]]) -> int:
+        """Append the messages of a turn to a session, returning the stored turn count"""
+        if not self.redis_client:
+            raise RuntimeError("Session store unavailable")
+
+        key = self._key(company_id, session_id)
+        system = [m for m in messages if m["role"] == "system"]
+        turns = [self._encode(m) for m in messages if m["role"] != "system"]
+        return await self._append(
+            keys=[key, f"{key}:bytes", f"{key}:system"],
+            args=[
+                settings.chat_session_ttl,
+                settings.chat_session_max_messages,
+                settings.chat_session_max_bytes,
+                self._encode(system[-1]) if system else b"",
+                *turns
+            ]
+        )
+
+    async def delete(self, company_id: str, session_id: str) -> bool:
+        """Delete a session"""
+        if not self.redis_client:
+            return False
+
+        key = self._key(company_id, session_id)
+        return await self.redis_client.delete(key, f"{key}:bytes", f"{key}:system") > 0
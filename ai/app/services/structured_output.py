@@ -0,0 +1,382 @@
+import hashlib
+import re
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from platform_common.codec import dumps, dumps_str, loads
+
+from ..config import settings
+
+# Name of the function the model is forced to call with the extracted object (OpenAI)
+EXTRACTION_TOOL = "record_extraction"
+
+JSON_TYPES = ("string", "number", "integer", "boolean", "object", "array", "null")
+
+# Keywords that may sit next to "type" in a JSON Schema (short-form field names outside this set win)
+SCHEMA_KEYWORDS = frozenset((
+    "$schema", "$id", "$ref", "$defs", "definitions", "title", "description", "default", "examples",
+    "enum", "const", "format", "pattern", "minLength", "maxLength", "minimum", "maximum",
+    "exclusiveMinimum", "exclusiveMaximum", "multipleOf", "items", "prefixItems", "minItems", "maxItems",
+    "uniqueItems", "contains", "properties", "required", "additionalProperties", "patternProperties",
+    "propertyNames", "minProperties", "maxProperties", "anyOf", "oneOf", "allOf", "not", "nullable"
+))
+
+# Type names accepted in the short field -> type schema form, e.g. {"name": "string", "age": "int"}
+TYPE_ALIASES = {
+    "string": "string", "str": "string", "text": "string",
+    "number": "number", "float": "number", "decimal": "number",
+    "integer": "integer", "int": "integer",
+    "boolean": "boolean", "bool": "boolean",
+    "array": "array", "list": "array",
+    "object": "object", "dict": "object"
+}
+
+Validator = Callable[[Any, str], Tuple[Any, List[str]]]
+
+
+class StructuredOutputError(ValueError):
+    """The model output could not be parsed or validated, even after repair"""
+
+    def __init__(self, message: str, errors: List[str]):
+        super().__init__(f"{message}: {'; '.join(errors[:5])}")
+        self.errors = errors
+
+
+def _is_json_schema(schema: Dict[str, Any]) -> bool:
+    """
+    Whether a schema is JSON Schema rather than the short form, whose field
+    names may well be "type" or "properties": it has an object of properties,
+    or a JSON type (or list of them) and nothing but JSON Schema keywords.
+    """
+    if isinstance(schema.get("properties"), dict):
+        return True
+    types = schema.get("type")
+    types = types if isinstance(types, list) else [types]
+    if not types or not all(isinstance(t, str) and t in JSON_TYPES for t in types):
+        return False
+    return all(key == "type" or key in SCHEMA_KEYWORDS for key in schema)
+
+
+def _field_schema(value: Any) -> Dict[str, Any]:
+    """JSON Schema of one field of the short schema form"""
+    if isinstance(value, str):
+        json_type = TYPE_ALIASES.get(value.strip().lower())
+        if json_type:
+            return {"type": [json_type, "null"]}
+        # Free text is taken as the field's description
+        return {"type": ["string", "null"], "description": value}
+    if isinstance(value, dict):
+        return value if _is_json_schema(value) else normalize_schema(value)
+    if isinstance(value, list):
+        return {"type": ["array", "null"], "items": _field_schema(value[0]) if value else {}}
+    return {}
+
+
+def normalize_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    JSON Schema for a request schema.
+
+    JSON Schemas are used as given. The short form maps field names to type
+    names, descriptions, nested objects or one-item lists; every field is
+    required but may be null when the text does not mention it.
+    """
+    if _is_json_schema(schema):
+        return schema
+    return {
+        "type": "object",
+        "properties": {name: _field_schema(value) for name, value in schema.items()},
+        "required": list(schema)
+    }
+
+
+def _coerce(value: Any, json_type: str) -> Any:
+    """Convert scalar values models commonly emit in the wrong type; returns the value unchanged otherwise"""
+    if json_type == "array" and not isinstance(value, list) and value is not None:
+        return [value]
+    if isinstance(value, str):
+        text = value.strip()
+        if json_type == "integer" and re.fullmatch(r"-?\d+", text):
+            return int(text)
+        if json_type == "number" and re.fullmatch(r"-?\d+(\.\d+)?([eE][-+]?\d+)?", text):
+            return float(text)
+        if json_type == "boolean" and text.lower() in ("true", "false"):
+            return text.lower() == "true"
+        if json_type == "null" and text.lower() in ("", "null", "none", "n/a"):
+            return None
+    elif json_type == "string" and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return value
+
+
+def _matches(value: Any, json_type: str) -> bool:
+    if json_type == "string":
+        return isinstance(value, str)
+    if json_type == "integer":
+        return isinstance(value, int) and not isinstance(value, bool) or isinstance(value, float) and value.is_integer()
+    if json_type == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if json_type == "boolean":
+        return isinstance(value, bool)
+    if json_type == "object":
+        return isinstance(value, dict)
+    if json_type == "array":
+        return isinstance(value, list)
+    return value is None
+
+
+def _compile(schema: Dict[str, Any]) -> Validator:
+    """Compile a JSON Schema (type, enum, properties, required, additionalProperties, items) into a validator"""
+    types = schema.get("type")
+    types = [types] if isinstance(types, str) else list(types or [])
+    enum = schema.get("enum")
+    properties = {name: _compile(sub) for name, sub in (schema.get("properties") or {}).items()}
+    required = schema.get("required") or []
+    closed = schema.get("additionalProperties") is False
+    items = _compile(schema["items"]) if isinstance(schema.get("items"), dict) else None
+
+    def validate(value: Any, path: str) -> Tuple[Any, List[str]]:
+        if types and not any(_matches(value, json_type) for json_type in types):
+            for json_type in types:
+                coerced = _coerce(value, json_type)
+                if _matches(coerced, json_type):
+                    value = coerced
+                    break
+            else:
+                return value, [f"{path}: expected {' or '.join(types)}"]
+        if enum is not None and value not in enum and not (value is None and "null" in types):
+            return value, [f"{path}: must be one of {dumps_str(enum)}"]
+
+        errors: List[str] = []
+        if isinstance(value, dict):
+            value = dict(value)
+            for name in required:
+                if name not in value:
+                    errors.append(f"{path}.{name}: missing")
+            for name, field in list(value.items()):
+                if name in properties:
+                    value[name], field_errors = properties[name](field, f"{path}.{name}")
+                    errors.extend(field_errors)
+                elif closed:
+                    del value[name]
+        elif isinstance(value, list) and items is not None:
+            value = list(value)
+            for index, item in enumerate(value):
+                value[index], item_errors = items(item, f"{path}[{index}]")
+                errors.extend(item_errors)
+        return value, errors
+
+    return validate
+
+
+class CompiledSchema:
+    """A request schema in JSON Schema form with its compiled validator"""
+
+    def __init__(self, schema: Dict[str, Any]):
+        self.schema = normalize_schema(schema)
+        self.is_object = self.schema.get("type") == "object"
+        self._validate = _compile(self.schema)
+
+    def validate(self, value: Any) -> Tuple[Any, List[str]]:
+        """Validated value (with scalar types coerced) and the remaining errors"""
+        return self._validate(value, "$")
+
+    def parse(self, text: str) -> Tuple[Any, List[str]]:
+        """Parse model output, repairing malformed JSON locally, and validate it"""
+        value = repair_json(text)
+        if value is None:
+            return None, ["$: not valid JSON"]
+        return self.validate(value)
+
+    def missing_fields(self, errors: List[str]) -> Optional[List[str]]:
+        """Top-level fields named by errors if all errors are missing top-level fields, else None"""
+        names = []
+        for error in errors:
+            match = re.fullmatch(r"\$\.([^.\[]+): missing", error)
+            if match is None:
+                return None
+            names.append(match.group(1))
+        return names
+
+    def subset(self, names: List[str]) -> Dict[str, Any]:
+        """Object schema with only the given top-level fields"""
+        properties = self.schema.get("properties") or {}
+        return {
+            "type": "object",
+            "properties": {name: properties.get(name, {}) for name in names},
+            "required": names
+        }
+
+
+_compiled: "OrderedDict[bytes, CompiledSchema]" = OrderedDict()
+
+
+def compile_schema(schema: Dict[str, Any]) -> CompiledSchema:
+    """Compiled schema, cached by content so repeated extraction schemas are compiled once"""
+    key = hashlib.sha256(dumps(schema)).digest()
+    compiled = _compiled.get(key)
+    if compiled is not None:
+        _compiled.move_to_end(key)
+        return compiled
+    compiled = _compiled[key] = CompiledSchema(schema)
+    while len(_compiled) > settings.extraction_schema_cache_size:
+        _compiled.popitem(last=False)
+    return compiled
+
+
+def repair_json(text: str) -> Any:
+    """
+    Parse JSON from model output, repairing the usual defects: code fences and
+    surrounding prose, Python literals, trailing commas and output cut off
+    mid-object (closed where it stops). Returns None if it cannot be parsed.
+    """
+    start = min((index for index in (text.find("{"), text.find("[")) if index >= 0), default=-1)
+    if start < 0:
+        return None
+    text = text[start:]
+    try:
+        return loads(text)
+    except ValueError:
+        pass
+
+    out: List[str] = []
+    stack: List[str] = []
+    in_string = escape = False
+    index = 0
+    while index < len(text):
+        char = text[index]
+        if in_string:
+            out.append(char)
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+            out.append(char)
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+            out.append(char)
+        elif char in "}]":
+            while out and out[-1] in " \t\r\n,":
+                out.pop()
+            if stack:
+                out.append(stack.pop())
+            if not stack:
+                break
+        elif char.isalpha():
+            word = re.match(r"[A-Za-z]+", text[index:]).group(0)
+            out.append({"True": "true", "False": "false", "None": "null"}.get(word, word))
+            index += len(word)
+            continue
+        else:
+            out.append(char)
+        index += 1
+
+    repaired = "".join(out)
+    if in_string:
+        repaired += '"'
+    if stack:
+        # Truncated: drop a dangling key and separator, then close what is open
+        repaired = repaired.rstrip()
+        if stack[-1] == "}":
+            repaired = re.sub(r'(?<=[{,])\s*"(?:[^"\\]|\\.)*"\s*:?$', "", repaired).rstrip()
+        repaired = repaired.rstrip(",:").rstrip() + "".join(reversed(stack))
+    try:
+        return loads(repaired)
+    except ValueError:
+        return None
+
+
+class IncrementalObjectParser:
+    """
+    Parse a streamed JSON object as it arrives.
+
+    feed() returns the top-level members completed by the new text, so callers
+    can use each field as soon as the model has finished writing it.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start: Optional[int] = None
+        self._done = False
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        members: List[Tuple[str, Any]] = []
+        self._buffer += text
+        while self._position < len(self._buffer) and not self._done:
+            char = self._buffer[self._position]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = self._depth > 0
+            elif char in "{[":
+                self._depth += 1
+                if self._depth == 1:
+                    self._member_start = self._position + 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    members.extend(self._member(self._position))
+                    self._done = True
+            elif char == "," and self._depth == 1:
+                members.extend(self._member(self._position))
+                self._member_start = self._position + 1
+            self._position += 1
+        return members
+
+    def _member(self, end: int) -> List[Tuple[str, Any]]:
+        if self._member_start is None:
+            return []
+        member = self._buffer[self._member_start:end].strip()
+        if not member:
+            return []
+        try:
+            return list(loads("{" + member + "}").items())
+        except ValueError:
+            # Left to the repair of the complete output
+            return []
+
+
+def extraction_prompt(text: str, compiled: CompiledSchema) -> str:
+    return (
+        "Extract data from the text below as one JSON object matching this JSON Schema. "
+        "Use null for values the text does not contain.\n\n"
+        f"Schema: {dumps_str(compiled.schema)}\n\n"
+        f"Text: {text}\n\n"
+        "Return only the JSON object."
+    )
+
+
+def reask_prompt(text: str, compiled: CompiledSchema, output: str, errors: List[str]) -> Tuple[str, Optional[List[str]]]:
+    """
+    Prompt for one targeted re-ask and the fields it asks for: only the missing
+    fields when those are the sole problem (None when the whole object is re-asked).
+    """
+    missing = compiled.missing_fields(errors)
+    if missing:
+        return (
+            "Extract only these fields from the text below as one JSON object matching this JSON Schema. "
+            "Use null for values the text does not contain.\n\n"
+            f"Schema: {dumps_str(compiled.subset(missing))}\n\n"
+            f"Text: {text}\n\n"
+            "Return only the JSON object."
+        ), missing
+    return (
+        "This JSON was extracted from the text below but does not match the schema.\n\n"
+        f"Schema: {dumps_str(compiled.schema)}\n\n"
+        f"JSON: {output}\n\n"
+        f"Problems: {'; '.join(errors[:20])}\n\n"
+        f"Text: {text}\n\n"
+        "Return only the corrected JSON object."
+    ), None
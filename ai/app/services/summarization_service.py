@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from .ai_service import AIService
+from .cache_service import CacheService
+from .tokenizer import chunk_text, count_tokens
+from ..config import settings
+
+ProgressCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
+MAP_PROMPT = (
+    "The following is one section of a longer document. "
+    "Summarize the key facts, figures, names and obligations it contains:\n\n{text}"
+)
+REDUCE_PROMPT = (
+    "The following are summaries of consecutive sections of a document. "
+    "Combine them into a single coherent summary, keeping the key facts:\n\n{text}"
+)
+
+
+class SummarizationService:
+    """
+    Map-reduce summarization for documents that do not fit in a single prompt.
+
+    The text is split into overlapping token-bounded chunks which are summarized
+    in parallel (map), then the partial summaries are merged level by level
+    (reduce) until they fit into one final prompt. Every node's summary is cached
+    by the digest of its input, so re-summarizing an edited document only calls
+    the provider for the chunks that changed.
+    """
+
+    def __init__(self, ai_service: AIService, cache_service: CacheService):
+        self.ai_service = ai_service
+        self.cache_service = cache_service
+
+    async def summarize(
+        self,
+        text: str,
+        model: str = "gpt-3.5-turbo",
+        max_length: Optional[int] = None,
+        on_progress: Optional[ProgressCallback] = None
+    ) -> str:
+        """Summarize text of any length"""
+        chunk_tokens = settings.summarize_chunk_tokens
+        if count_tokens(text, model) <= chunk_tokens:
+            return await self.ai_service.summarize_text(text, model, max_length)
+
+        semaphore = asyncio.Semaphore(settings.summarize_max_concurrency)
+        chunks = chunk_text(text, model, chunk_tokens, settings.summarize_chunk_overlap_tokens)
+        await self._report(on_progress, {"event": "chunked", "chunks": len(chunks)})
+
+        summaries = await self._map(chunks, MAP_PROMPT, model, semaphore, on_progress, level=0)
+
+        # Reduce partial summaries until they fit in a single prompt
+        level = 1
+        while count_tokens("\n\n".join(summaries), model) > chunk_tokens and len(summaries) > 1:
+            groups = self._group(summaries, model, chunk_tokens)
+            await self._report(on_progress, {"event": "reduce", "level": level, "groups": len(groups)})
+            summaries = await self._map(groups, REDUCE_PROMPT, model, semaphore, on_progress, level=level)
+            level += 1
+
+        await self._report(on_progress, {"event": "finalize", "level": level})
+        return await self.ai_service.summarize_text("\n\n".join(summaries), model, max_length)
+
+    async def stream(
+        self,
+        text: str,
+        model: str = "gpt-3.5-turbo",
+        max_length: Optional[int] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Summarize text, yielding progress events followed by the final summary"""
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def run():
+            with self.ai_service.track_usage() as usage:
+                try:
+                    summary = await self.summarize(text, model, max_length, on_progress=queue.put)
+                    await queue.put({"event": "done", "summary": summary, "tokens_used": usage.total_tokens})
+                except Exception as e:
+                    await queue.put({"event": "error", "message": str(e)})
+
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                event = await queue.get()
+                yield event
+                if event["event"] in ("done", "error"):
+                    break
+        finally:
+            if not task.done():
+                task.cancel()
+
+    async def _map(
+        self,
+        texts: List[str],
+        prompt_template: str,
+        model: str,
+        semaphore: asyncio.Semaphore,
+        on_progress: Optional[ProgressCallback],
+        level: int
+    ) -> List[str]:
+        """Summarize texts in parallel, bounded by the concurrency cap"""
+        completed = 0
+
+        async def summarize_one(index: int, text: str) -> str:
+            nonlocal completed
+            async def compute() -> str:
+                async with semaphore:
+                    return await self.ai_service.complete(prompt_template.format(text=text), model)
+
+            summary, cached = await self.cache_service.get_or_refresh(
+                self._cache_key(model, prompt_template, text), compute, "summarize_chunk"
+            )
+            completed += 1
+            await self._report(on_progress, {
+                "event": "chunk_done",
+                "level": level,
+                "index": index,
+                "cached": cached,
+                "completed": completed,
+                "total": len(texts)
+            })
+            return summary
+
+        return list(await asyncio.gather(*(summarize_one(i, t) for i, t in enumerate(texts))))
+
+    def _group(self, summaries: List[str], model: str, max_tokens: int) -> List[str]:
+        """Pack consecutive summaries into groups that fit in one prompt"""
+        groups: List[str] = []
+        current: List[str] = []
+        current_tokens = 0
+        for summary in summaries:
+            n = count_tokens(summary, model)
+            if current and current_tokens + n > max_tokens:
+                groups.append("\n\n".join(current))
+                current, current_tokens = [], 0
+            current.append(summary)
+            current_tokens += n
+        if current:
+            groups.append("\n\n".join(current))
+        # Always make progress, even if every summary fills a prompt on its own
+        if len(groups) == len(summaries) and len(groups) > 1:
+            groups = ["\n\n".join(summaries[i:i + 2]) for i in range(0, len(summaries), 2)]
+        return groups
+
+    @staticmethod
+    def _cache_key(model: str, prompt_template: str, text: str) -> str:
+        digest = hashlib.sha256(f"{model}\0{prompt_template}\0{text}".encode("utf-8")).hexdigest()
+        return f"summarize:chunk:{digest}"
+
+    @staticmethod
+    async def _report(on_progress: Optional[ProgressCallback], event: Dict[str, Any]):
+        if on_progress is not None:
+            await on_progress(event)
@@ -0,0 +1,149 @@
+import re
+import zlib
+from functools import lru_cache
+from typing import Dict, List
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - tiktoken ships with langchain-openai
+    tiktoken = None
+
+# Rough characters-per-token ratio used for providers without a local tokenizer
+CHARS_PER_TOKEN = 4
+
+# Average sentence size the anchor rate of chunk_text is tuned for
+ANCHOR_UNIT_TOKENS = 24
+
+# Sentence-ish units: text up to a sentence terminator or newline, plus trailing whitespace
+_UNIT_PATTERN = re.compile(r".*?(?:[.!?]+(?=\s)|\n|$)\s*", re.S)
+
+
+@lru_cache(maxsize=16)
+def get_encoding(model: str):
+    """Get the (cached) tiktoken encoding for a model, or None if unavailable"""
+    if tiktoken is None or not model.startswith('gpt-'):
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: str) -> int:
+    """Count the tokens of a text for the given model"""
+    if not text:
+        return 0
+    encoding = get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _split_oversized(unit: str, model: str, max_tokens: int) -> List[str]:
+    """Hard-split a single unit that does not fit in one chunk"""
+    encoding = get_encoding(model)
+    if encoding is not None:
+        tokens = encoding.encode(unit, disallowed_special=())
+        return [encoding.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+    size = max_tokens * CHARS_PER_TOKEN
+    return [unit[i:i + size] for i in range(0, len(unit), size)]
+
+
+def _is_anchor(unit: str, rate: int) -> bool:
+    """Content-defined cut point: a paragraph end, or a unit whose digest falls on the anchor rate"""
+    trailing = unit[len(unit.rstrip()):]
+    return trailing.count("\n") >= 2 or zlib.crc32(unit.encode("utf-8")) % rate == 0
+
+
+def chunk_text(text: str, model: str, max_tokens: int, overlap_tokens: int = 0) -> List[str]:
+    """
+    Split text into chunks of at most max_tokens tokens.
+
+    Chunks break on sentence and line boundaries, and each chunk repeats up to
+    overlap_tokens tokens from the end of the previous one so that context
+    spanning a boundary is not lost. Boundaries are content-defined: a chunk
+    ends at the first anchor unit (see _is_anchor) once it holds a quarter of
+    max_tokens of new text, or where the next unit would not fit. An edit
+    therefore only changes the chunks around it; the chunking falls back into
+    step at the next anchor, so unchanged regions keep their cache keys.
+    """
+    units: List[str] = []
+    counts: List[int] = []
+    for unit in _UNIT_PATTERN.findall(text):
+        if not unit:
+            continue
+        n = count_tokens(unit, model)
+        if n > max_tokens:
+            for piece in _split_oversized(unit, model, max_tokens):
+                units.append(piece)
+                counts.append(count_tokens(piece, model))
+        else:
+            units.append(unit)
+            counts.append(n)
+
+    min_tokens = max_tokens // 4
+    # About one anchor per half chunk of average sentences
+    rate = max(2, max_tokens // (2 * ANCHOR_UNIT_TOKENS))
+    chunks: List[str] = []
+    current: List[int] = []
+    current_tokens = 0
+    fresh_tokens = 0
+
+    def cut(next_tokens: int):
+        nonlocal current, current_tokens, fresh_tokens
+        chunks.append("".join(units[j] for j in current))
+        # Carry trailing units of the previous chunk as overlap
+        carried: List[int] = []
+        carried_tokens = 0
+        for j in reversed(current):
+            if carried_tokens + counts[j] > overlap_tokens or carried_tokens + counts[j] + next_tokens > max_tokens:
+                break
+            carried.insert(0, j)
+            carried_tokens += counts[j]
+        current, current_tokens, fresh_tokens = carried, carried_tokens, 0
+
+    for i, n in enumerate(counts):
+        if fresh_tokens and current_tokens + n > max_tokens:
+            cut(n)
+        current.append(i)
+        current_tokens += n
+        fresh_tokens += n
+        if fresh_tokens >= min_tokens and i + 1 < len(counts) and _is_anchor(units[i], rate):
+            cut(counts[i + 1])
+
+    if fresh_tokens:
+        chunks.append("".join(units[j] for j in current))
+    return chunks
+
+
+# Context window sizes by model prefix, longest prefix first
+MODEL_CONTEXT_WINDOWS = [
+    ("gpt-4o", 128000),
+    ("gpt-4-turbo", 128000),
+    ("gpt-4", 8192),
+    ("gpt-3.5-turbo", 16385),
+    ("gemini-", 30720),
+    ("claude-", 200000),
+]
+DEFAULT_CONTEXT_WINDOW = 4096
+
+# Per-message framing overhead (role markers, separators) in chat formats
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def get_context_window(model: str) -> int:
+    """Get the context window size of a model"""
+    for prefix, window in MODEL_CONTEXT_WINDOWS:
+        if model.startswith(prefix):
+            return window
+    return DEFAULT_CONTEXT_WINDOW
+
+
+@lru_cache(maxsize=8192)
+def _count_message_tokens(content: str, model: str) -> int:
+    return count_tokens(content, model) + MESSAGE_OVERHEAD_TOKENS
+
+
+def count_message_tokens(message: Dict[str, str], model: str) -> int:
+    """Count the tokens of a chat message, memoized across turns of a conversation"""
+    return _count_message_tokens(message["content"], model)
@@ -0,0 +1,61 @@
+import asyncio
+import ipaddress
+import socket
+from typing import List
+from urllib.parse import urlsplit
+
+from ..config import settings
+
+
+class BlockedURL(PermissionError):
+    """A caller-supplied URL the service must not request"""
+
+
+def _host_allowed(host: str, allowed: List[str]) -> bool:
+    """Exact host names, or ".example.com" for a domain and its subdomains"""
+    for entry in allowed:
+        entry = entry.lower()
+        if entry.startswith("."):
+            if host == entry[1:] or host.endswith(entry):
+                return True
+        elif host == entry:
+            return True
+    return False
+
+
+def _public(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return not (
+        ip.is_private or ip.is_loopback or ip.is_link_local or ip.is_reserved
+        or ip.is_multicast or ip.is_unspecified
+    )
+
+
+async def check_url(url: str) -> None:
+    """
+    Reject a caller-supplied URL (ingestion source, job webhook) unless its
+    scheme and host are allowed and every address its host resolves to is
+    public, so callers cannot make the service reach internal endpoints
+    (metadata services, Redis, the other services). Raises BlockedURL.
+    """
+    parts = urlsplit(url)
+    if parts.scheme.lower() not in settings.outbound_url_schemes:
+        raise BlockedURL(f"URL scheme not allowed: {parts.scheme or '(none)'}")
+    host = (parts.hostname or "").lower()
+    if not host:
+        raise BlockedURL("URL has no host")
+    if settings.outbound_allowed_hosts and not _host_allowed(host, settings.outbound_allowed_hosts):
+        raise BlockedURL(f"URL host not allowed: {host}")
+    if settings.outbound_allow_private:
+        return
+
+    try:
+        port = parts.port or (443 if parts.scheme.lower() == "https" else 80)
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, ValueError) as e:
+        raise BlockedURL(f"URL host does not resolve: {host}") from e
+    for info in infos:
+        if not _public(info[4][0]):
+            raise BlockedURL(f"URL host resolves to a non-public address: {host}")
@@ -0,0 +1,114 @@
+import zlib
+from typing import Any, Dict
+
+from platform_common.codec import dumps, loads
+
+from ..config import settings
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional, JSON is used instead
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional, zlib is used instead
+    zstandard = None
+
+# Stored values start with MAGIC and a format byte: encoding in the low nibble,
+# compression in the high nibble. 0xC1 is never produced by msgpack and cannot
+# start JSON, so untagged values written before the codec existed still decode as
+# JSON, and readers that meet a format they do not know treat the value as missing.
+MAGIC = 0xC1
+MSGPACK, JSON = 1, 2
+UNCOMPRESSED, ZSTD, ZLIB = 0, 1, 2
+
+_stats = {"values": 0, "compressed": 0, "raw_bytes": 0, "stored_bytes": 0}
+
+
+class UnknownFormat(ValueError):
+    """A stored value was written in a format this version cannot read"""
+
+
+def _compressor() -> int:
+    name = settings.cache_compression
+    if name == "zstd" and zstandard is not None:
+        return ZSTD
+    if name in ("zstd", "zlib"):
+        return ZLIB
+    return UNCOMPRESSED
+
+
+def encode(value: Any) -> bytes:
+    """Tagged binary form of a value: msgpack (JSON without msgpack), compressed above the size threshold"""
+    if msgpack is not None:
+        encoding = MSGPACK
+        payload = msgpack.packb(value, use_bin_type=True, default=_packable)
+    else:
+        encoding = JSON
+        payload = dumps(value)
+
+    compression = UNCOMPRESSED
+    if len(payload) >= settings.cache_compression_min_size:
+        compression = _compressor()
+        if compression == ZSTD:
+            compressed = zstandard.ZstdCompressor(level=settings.cache_compression_level).compress(payload)
+        elif compression == ZLIB:
+            compressed = zlib.compress(payload, settings.cache_compression_level)
+        if compression != UNCOMPRESSED and len(compressed) < len(payload):
+            _stats["compressed"] += 1
+        else:
+            compression, compressed = UNCOMPRESSED, payload
+        payload_size, payload = len(payload), compressed
+    else:
+        payload_size = len(payload)
+
+    stored = bytes((MAGIC, encoding | compression << 4)) + payload
+    _stats["values"] += 1
+    _stats["raw_bytes"] += payload_size
+    _stats["stored_bytes"] += len(stored)
+    return stored
+
+
+def decode(raw: bytes) -> Any:
+    """Value of encode() output, or of untagged JSON"""
+    if not raw or raw[0] != MAGIC:
+        return loads(raw)
+    encoding, compression = raw[1] & 0x0F, raw[1] >> 4
+    payload = raw[2:]
+    if compression == ZSTD:
+        if zstandard is None:
+            raise UnknownFormat("zstd-compressed value but zstandard is not installed")
+        payload = zstandard.ZstdDecompressor().decompress(payload)
+    elif compression == ZLIB:
+        payload = zlib.decompress(payload)
+    elif compression != UNCOMPRESSED:
+        raise UnknownFormat(f"Unknown compression {compression}")
+
+    if encoding == MSGPACK:
+        if msgpack is None:
+            raise UnknownFormat("msgpack value but msgpack is not installed")
+        return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+    if encoding == JSON:
+        return loads(payload)
+    raise UnknownFormat(f"Unknown encoding {encoding}")
+
+
+def _packable(value: Any) -> Any:
+    """msgpack fallback for the non-native types the services cache (numpy, datetimes, models)"""
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    raise TypeError(f"Object of type {type(value).__name__} cannot be cached")
+
+
+def stats() -> Dict[str, Any]:
+    """Encoding counters of this process"""
+    metrics: Dict[str, Any] = dict(_stats)
+    metrics["compression_ratio"] = _stats["raw_bytes"] / _stats["stored_bytes"] if _stats["stored_bytes"] else 0.0
+    metrics["encoding"] = "msgpack" if msgpack is not None else "json"
+    metrics["compression"] = ("zstd", "zlib", "none")[(ZSTD, ZLIB, UNCOMPRESSED).index(_compressor())]
+    return metrics
@@ -0,0 +1,502 @@
+import asyncio
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from . import lexical_index
+from .embedding_service import EmbeddingService
+from .lexical_index import LexicalSegment, bm25_scores, idf, merge_lexical, tokenize
+from .knowledge_store import (
+    CENTROIDS, CHUNKS, DOCS, IDS, LISTS, MATRIX, OFFSETS,
+    KnowledgeStore, dequantize, document_digest, quantize
+)
+from ..config import settings
+
+# Rows scored per matrix product; bounds the float32 scratch space of a scan
+SCAN_BLOCK_ROWS = 65536
+
+# Reciprocal-rank fusion constant
+RRF_K = 60
+
+
+class _Segment:
+    """Memory-mapped view of one immutable segment"""
+
+    def __init__(self, store: KnowledgeStore, segment_id: int, tombstones: Dict[str, int]):
+        self.id = segment_id
+        self.matrix = np.load(store.segment_file(segment_id, MATRIX), mmap_mode="r")
+        self.ids = np.load(store.segment_file(segment_id, IDS), mmap_mode="r")
+        self.docs = np.load(store.segment_file(segment_id, DOCS), mmap_mode="r")
+        self.offsets = np.load(store.segment_file(segment_id, OFFSETS), mmap_mode="r")
+        self.centroids = None
+        self.lists = None
+        if os.path.exists(store.segment_file(segment_id, CENTROIDS)):
+            self.centroids = np.load(store.segment_file(segment_id, CENTROIDS))
+            self.lists = np.load(store.segment_file(segment_id, LISTS))
+
+        self.lexical = None
+        if os.path.exists(store.segment_file(segment_id, lexical_index.TERMS)):
+            self.lexical = LexicalSegment(lambda kind: store.segment_file(segment_id, kind))
+
+        # Hold the metadata file open so rows stay readable after compaction unlinks it
+        self._fd = os.open(store.segment_file(segment_id, CHUNKS), os.O_RDONLY)
+        self._size = os.fstat(self._fd).st_size
+
+        dead = [chunk_id for chunk_id, upto in tombstones.items() if upto >= segment_id]
+        self.dead = np.isin(self.ids, np.array(dead, dtype="S32")) if dead else None
+
+    def __del__(self):
+        fd = getattr(self, "_fd", None)
+        if fd is not None:
+            os.close(fd)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def read_line(self, row: int) -> bytes:
+        """Raw JSONL metadata line of a row"""
+        start = int(self.offsets[row])
+        end = int(self.offsets[row + 1]) if row + 1 < len(self.offsets) else self._size
+        return os.pread(self._fd, end - start, start)
+
+    def candidate_ranges(self, query: np.ndarray, exhaustive: bool = False) -> List[Tuple[int, int]]:
+        """Row ranges to scan: probed IVF lists, or the whole segment"""
+        if self.centroids is None or exhaustive:
+            return [(0, len(self))]
+        nprobe = min(settings.vector_ivf_nprobe, len(self.centroids))
+        probed = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return [(int(self.lists[c]), int(self.lists[c + 1])) for c in sorted(probed)]
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int,
+        doc_filter: Optional[np.ndarray],
+        exhaustive: bool = False
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k (scores, rows) of this segment"""
+        best_scores = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        for start, end in self.candidate_ranges(query, exhaustive):
+            for block_start in range(start, end, SCAN_BLOCK_ROWS):
+                block_end = min(end, block_start + SCAN_BLOCK_ROWS)
+                scores = dequantize(self.matrix[block_start:block_end]) @ query
+                if self.dead is not None:
+                    scores[self.dead[block_start:block_end]] = -np.inf
+                if doc_filter is not None:
+                    scores[~np.isin(self.docs[block_start:block_end], doc_filter)] = -np.inf
+                rows = np.arange(block_start, block_end)
+                if len(scores) > k:
+                    top = np.argpartition(-scores, k - 1)[:k]
+                    scores, rows = scores[top], rows[top]
+                best_scores = np.concatenate([best_scores, scores])
+                best_rows = np.concatenate([best_rows, rows])
+                if len(best_scores) > k:
+                    top = np.argpartition(-best_scores, k - 1)[:k]
+                    best_scores, best_rows = best_scores[top], best_rows[top]
+        alive = np.isfinite(best_scores)
+        if doc_filter is not None and not exhaustive and self.centroids is not None and alive.sum() < k:
+            # A selective filter can empty the probed lists; fall back to a full scan
+            return self.search(query, k, doc_filter, exhaustive=True)
+        return best_scores[alive], best_rows[alive]
+
+    def search_lexical(
+        self,
+        plan: List[Tuple[float, int]],
+        average_length: float,
+        k: int,
+        doc_filter: Optional[np.ndarray]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k BM25 (scores, rows) of this segment"""
+        scores = bm25_scores(self.lexical, plan, average_length)
+        if self.dead is not None:
+            scores[self.dead] = 0
+        if doc_filter is not None:
+            scores[~np.isin(self.docs, doc_filter)] = 0
+        rows = np.flatnonzero(scores)
+        if len(rows) > k:
+            rows = rows[np.argpartition(-scores[rows], k - 1)[:k]]
+        return scores[rows], rows
+
+
+class _Generation:
+    """
+    Segments of one loaded store generation with their BM25 collection
+    statistics and cached query plans. Replaced as a whole on reload, so a
+    search works on one consistent snapshot and plans computed against an old
+    generation can never be cached for a newer one.
+    """
+
+    __slots__ = ("generation", "segments", "rows", "average_length", "plans", "plans_lock")
+
+    def __init__(self, generation: Any, segments: List[_Segment]):
+        self.generation = generation
+        self.segments = segments
+        lexical = [segment.lexical for segment in segments if segment.lexical is not None]
+        self.rows = sum(len(segment.lengths) for segment in lexical)
+        self.average_length = (
+            sum(float(segment.lengths.sum()) for segment in lexical) / self.rows if self.rows else 0.0
+        )
+        self.plans: "OrderedDict[str, List[List[Tuple[float, int]]]]" = OrderedDict()
+        self.plans_lock = threading.Lock()
+
+
+class VectorShard:
+    """All segments of one knowledge base, reloaded when the store changes"""
+
+    def __init__(self, store: KnowledgeStore):
+        self.store = store
+        self.loaded = _Generation(None, [])
+        self._lock = threading.Lock()
+
+    def refresh(self) -> _Generation:
+        """Reload segments if another writer committed since the last load; returns the loaded generation"""
+        generation = self.store.generation()
+        loaded = self.loaded
+        if generation == loaded.generation:
+            return loaded
+        with self._lock:
+            if generation == self.loaded.generation:
+                return self.loaded
+            tombstones = self.store.load_tombstones()
+            segments = []
+            for segment_id in self.store.segment_ids():
+                try:
+                    segments.append(_Segment(self.store, segment_id, tombstones))
+                except FileNotFoundError:
+                    # Compacted away between listing and loading; the next refresh sees the result
+                    continue
+            self.loaded = _Generation(generation, segments)
+            return self.loaded
+
+    @staticmethod
+    def _query_plan(loaded: _Generation, query: str) -> List[List[Tuple[float, int]]]:
+        """
+        Per-segment (idf, term index) lists of a query.
+
+        Plans are cached with their generation, so repeated queries skip
+        tokenization, dictionary lookups and document-frequency aggregation.
+        """
+        with loaded.plans_lock:
+            plan = loaded.plans.get(query)
+            if plan is not None:
+                loaded.plans.move_to_end(query)
+                return plan
+
+        terms = list(dict.fromkeys(tokenize(query)))
+        lookups = [
+            [segment.lexical.find(term) if segment.lexical is not None else -1 for term in terms]
+            for segment in loaded.segments
+        ]
+        plan = [[] for _ in loaded.segments]
+        for term_position in range(len(terms)):
+            frequency = sum(
+                segment.lexical.document_frequency(indexes[term_position])
+                for segment, indexes in zip(loaded.segments, lookups)
+                if indexes[term_position] >= 0
+            )
+            if not frequency:
+                continue
+            weight = idf(frequency, loaded.rows)
+            for segment_plan, indexes in zip(plan, lookups):
+                if indexes[term_position] >= 0:
+                    segment_plan.append((weight, indexes[term_position]))
+
+        with loaded.plans_lock:
+            loaded.plans[query] = plan
+            while len(loaded.plans) > settings.lexical_plan_cache_size:
+                loaded.plans.popitem(last=False)
+        return plan
+
+    def search_lexical(self, query: str, k: int, document_ids: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+        """Top-k chunks of the shard by BM25"""
+        loaded = self.refresh()
+        plan = self._query_plan(loaded, query)
+        doc_filter = self._doc_filter(document_ids)
+
+        candidates: List[Tuple[float, _Segment, int]] = []
+        for segment, segment_plan in zip(loaded.segments, plan):
+            if segment.lexical is None or not segment_plan:
+                continue
+            scores, rows = segment.search_lexical(segment_plan, loaded.average_length, k, doc_filter)
+            candidates.extend(zip(scores.tolist(), [segment] * len(rows), rows.tolist()))
+        return self._hits(candidates, k)
+
+    @staticmethod
+    def _doc_filter(document_ids: Optional[Sequence[str]]) -> Optional[np.ndarray]:
+        if not document_ids:
+            return None
+        return np.array([document_digest(d) for d in document_ids], dtype=np.uint64)
+
+    def _hits(self, candidates: List[Tuple[float, "_Segment", int]], k: int) -> List[Dict[str, Any]]:
+        """Resolve the best candidates to chunks, dropping duplicate copies"""
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        results: List[Dict[str, Any]] = []
+        seen = set()
+        for score, segment, row in candidates:
+            chunk_id = segment.ids[row]
+            if chunk_id in seen:
+                continue
+            seen.add(chunk_id)
+            chunk = json.loads(segment.read_line(row))
+            chunk["score"] = score
+            chunk["knowledge_base_id"] = self.store.knowledge_base_id
+            results.append(chunk)
+            if len(results) >= k:
+                break
+        return results
+
+    def search(self, query: np.ndarray, k: int, document_ids: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+        """Top-k chunks of the shard for a normalized query vector"""
+        loaded = self.refresh()
+        doc_filter = self._doc_filter(document_ids)
+
+        candidates: List[Tuple[float, _Segment, int]] = []
+        for segment in loaded.segments:
+            scores, rows = segment.search(query, k, doc_filter)
+            candidates.extend(zip(scores.tolist(), [segment] * len(rows), rows.tolist()))
+        return self._hits(candidates, k)
+
+
+class VectorIndex:
+    """
+    Per-tenant hybrid retrieval over knowledge-base stores.
+
+    Each (company, knowledge base) shard memory-maps its quantized segment
+    matrices and inverted indexes, so worker processes share the page cache
+    instead of each holding a copy. Segments are scanned with blocked NumPy matrix
+    products; compacted segments of large shards carry an IVF structure so only
+    the closest lists are scanned. Lexical BM25 results, which catch exact
+    identifiers embeddings miss, are fused with vector results by reciprocal rank.
+    """
+
+    def __init__(self, embedding_service: EmbeddingService):
+        self.embedding_service = embedding_service
+        self._shards: "OrderedDict[Tuple[str, str], VectorShard]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_shard(self, company_id: str, knowledge_base_id: str) -> VectorShard:
+        """Get an open shard, evicting the least recently used beyond the cap"""
+        key = (company_id, knowledge_base_id)
+        with self._lock:
+            shard = self._shards.get(key)
+            if shard is None:
+                shard = VectorShard(KnowledgeStore(company_id, knowledge_base_id))
+                self._shards[key] = shard
+                while len(self._shards) > settings.vector_max_open_shards:
+                    self._shards.popitem(last=False)
+            else:
+                self._shards.move_to_end(key)
+            return shard
+
+    def search_vector(
+        self,
+        company_id: str,
+        knowledge_base_ids: List[str],
+        query: np.ndarray,
+        top_k: int = 5,
+        document_ids: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """Top-k chunks across knowledge bases of one company (blocking)"""
+        results: List[Dict[str, Any]] = []
+        for knowledge_base_id in knowledge_base_ids:
+            results.extend(self.get_shard(company_id, knowledge_base_id).search(query, top_k, document_ids))
+        results.sort(key=lambda r: r["score"], reverse=True)
+        return results[:top_k]
+
+    def search_lexical(
+        self,
+        company_id: str,
+        knowledge_base_ids: List[str],
+        query: str,
+        top_k: int = 5,
+        document_ids: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """Top-k BM25 chunks across knowledge bases of one company (blocking)"""
+        results: List[Dict[str, Any]] = []
+        for knowledge_base_id in knowledge_base_ids:
+            results.extend(self.get_shard(company_id, knowledge_base_id).search_lexical(query, top_k, document_ids))
+        results.sort(key=lambda r: r["score"], reverse=True)
+        return results[:top_k]
+
+    async def search(
+        self,
+        company_id: str,
+        knowledge_base_ids: List[str],
+        query: str,
+        top_k: int = 5,
+        document_ids: Optional[List[str]] = None,
+        mode: str = "hybrid"
+    ) -> List[Dict[str, Any]]:
+        """Return the top-k chunks for a query by vector, lexical or fused hybrid search"""
+        if mode not in ("vector", "lexical", "hybrid"):
+            raise ValueError(f"Unsupported retrieval mode: {mode}")
+        # Fuse deeper candidate lists than requested so rank fusion has overlap to work with
+        depth = top_k if mode != "hybrid" else top_k * settings.retrieval_candidate_factor
+
+        lexical_task = None
+        if mode != "vector":
+            lexical_task = asyncio.create_task(asyncio.to_thread(
+                self.search_lexical, company_id, knowledge_base_ids, query, depth, document_ids
+            ))
+        vector_results: List[Dict[str, Any]] = []
+        try:
+            if mode != "lexical":
+                query_vector = (await self.embedding_service.embed([query]))[0]
+                vector_results = await asyncio.to_thread(
+                    self.search_vector, company_id, knowledge_base_ids, query_vector, depth, document_ids
+                )
+            lexical_results = await lexical_task if lexical_task is not None else []
+        finally:
+            # The vector half failed or the request was cancelled: do not leave the lexical half behind
+            if lexical_task is not None:
+                lexical_task.cancel()
+                await asyncio.gather(lexical_task, return_exceptions=True)
+
+        if mode == "vector":
+            return vector_results
+        if mode == "lexical":
+            return lexical_results
+        return reciprocal_rank_fusion(vector_results, lexical_results, top_k)
+
+
+def reciprocal_rank_fusion(
+    vector_results: List[Dict[str, Any]],
+    lexical_results: List[Dict[str, Any]],
+    top_k: int
+) -> List[Dict[str, Any]]:
+    """Fuse ranked result lists: score = sum of 1 / (RRF_K + rank) over the lists"""
+    fused: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for source, results in (("vector_score", vector_results), ("bm25_score", lexical_results)):
+        for rank, result in enumerate(results):
+            key = (result["knowledge_base_id"], result["id"])
+            entry = fused.get(key)
+            if entry is None:
+                entry = fused[key] = {k: v for k, v in result.items() if k != "score"}
+                entry["score"] = 0.0
+            entry[source] = result["score"]
+            entry["score"] += 1.0 / (RRF_K + rank + 1)
+    return sorted(fused.values(), key=lambda r: r["score"], reverse=True)[:top_k]
+
+
+def _kmeans(sample: np.ndarray, clusters: int, iterations: int = 10) -> np.ndarray:
+    """Spherical k-means over normalized rows, returning normalized centroids"""
+    rng = np.random.default_rng(0)
+    centroids = sample[rng.choice(len(sample), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        empty = norms[:, 0] == 0
+        sums[empty] = centroids[empty]
+        norms[empty] = 1.0
+        centroids = sums / norms
+    return centroids.astype(np.float32)
+
+
+def compact_store(store: KnowledgeStore) -> Dict[str, int]:
+    """
+    Merge all segments of a store into one, dropping deleted and superseded rows.
+
+    Shards with at least vector_ivf_min_rows rows get an IVF layout: rows are
+    clustered around k-means centroids and written list by list, so a search
+    only scans the probed lists as contiguous slices. Must run under the
+    knowledge base's ingestion lock.
+    """
+    segment_ids = store.segment_ids()
+    tombstones = store.load_tombstones()
+    segments = [_Segment(store, segment_id, tombstones) for segment_id in segment_ids]
+
+    # Keep the newest copy of each live chunk
+    seen = set()
+    keep: List[np.ndarray] = [None] * len(segments)
+    for index in range(len(segments) - 1, -1, -1):
+        segment = segments[index]
+        rows = []
+        for row, chunk_id in enumerate(segment.ids.tolist()):
+            if (segment.dead is not None and segment.dead[row]) or chunk_id in seen:
+                continue
+            seen.add(chunk_id)
+            rows.append(row)
+        keep[index] = np.array(rows, dtype=np.int64)
+
+    total = sum(len(rows) for rows in keep)
+    if not segments:
+        return {"segments": 0, "rows": 0}
+    dim = segments[-1].matrix.shape[1] if segments[-1].matrix.ndim == 2 else 0
+    matrices = [segment.matrix for segment in segments]
+
+    # Global row order: by IVF list when the shard is large, else segment order
+    sources = np.concatenate([np.full(len(rows), i, dtype=np.int32) for i, rows in enumerate(keep)])
+    source_rows = np.concatenate(keep)
+    ivf = None
+    if total >= settings.vector_ivf_min_rows and dim:
+        clusters = max(1, min(settings.vector_ivf_max_lists, int(np.sqrt(total))))
+        rng = np.random.default_rng(0)
+        sample_index = rng.choice(total, min(total, clusters * 64), replace=False)
+        sample = dequantize(_gather(matrices, sources[sample_index], source_rows[sample_index]))
+        centroids = _kmeans(sample, clusters)
+        assignment = np.empty(total, dtype=np.int32)
+        for start in range(0, total, SCAN_BLOCK_ROWS):
+            block = _gather(matrices, sources[start:start + SCAN_BLOCK_ROWS], source_rows[start:start + SCAN_BLOCK_ROWS])
+            assignment[start:start + len(block)] = np.argmax(dequantize(block) @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        sources, source_rows = sources[order], source_rows[order]
+        lists = np.zeros(clusters + 1, dtype=np.int64)
+        lists[1:] = np.cumsum(np.bincount(assignment, minlength=clusters))
+        ivf = (centroids, lists)
+
+    # Re-quantize to the configured storage type while copying
+    new_id = segment_ids[-1] + 1
+    dtype = quantize(np.zeros((1, 1), dtype=np.float32)).dtype
+    matrix = np.lib.format.open_memmap(
+        store.segment_file(new_id, "tmp.npy"),
+        mode="w+",
+        dtype=dtype,
+        shape=(total, dim)
+    )
+    for start in range(0, total, SCAN_BLOCK_ROWS):
+        block = _gather(matrices, sources[start:start + SCAN_BLOCK_ROWS], source_rows[start:start + SCAN_BLOCK_ROWS])
+        matrix[start:start + len(block)] = block if block.dtype == dtype else quantize(dequantize(block))
+
+    # Remap the inverted indexes instead of re-tokenizing every chunk
+    lexical = None
+    if all(segment.lexical is not None for segment in segments):
+        mappings = [np.full(len(segment.ids), -1, dtype=np.int64) for segment in segments]
+        for position, (source, row) in enumerate(zip(sources.tolist(), source_rows.tolist())):
+            mappings[source][row] = position
+        lexical = merge_lexical([segment.lexical for segment in segments], mappings, total)
+
+    store.write_segment_rows(
+        (segments[s].read_line(r) for s, r in zip(sources.tolist(), source_rows.tolist())),
+        _gather([segment.ids for segment in segments], sources, source_rows),
+        _gather([segment.docs for segment in segments], sources, source_rows),
+        matrix,
+        ivf=ivf,
+        segment_id=new_id,
+        lexical=lexical
+    )
+    for segment_id in segment_ids:
+        store.delete_segment(segment_id)
+    store.clear_tombstones()
+    store.bump_generation()
+    return {"segments": len(segment_ids), "rows": total}
+
+
+def _gather(arrays: List[np.ndarray], sources: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """Gather rows from several row-aligned arrays in the given order, reading each in ascending order"""
+    first = arrays[int(sources[0])] if len(sources) else arrays[-1]
+    block = np.empty((len(rows),) + first.shape[1:], dtype=first.dtype)
+    for source in np.unique(sources):
+        mask = sources == source
+        wanted = rows[mask]
+        order = np.argsort(wanted, kind="stable")
+        gathered = np.empty((len(wanted),) + first.shape[1:], dtype=first.dtype)
+        gathered[order] = arrays[source][wanted[order]]
+        block[mask] = gathered
+    return block
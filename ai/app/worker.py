@@ -0,0 +1,115 @@
+"""
+AI job worker.
+
+Consumes asynchronous /jobs submissions from the Redis job stream. Run one or
+more next to the API:
+
+    python -m app.worker
+
+The operation handlers are shared with the bulk CLI (app.bulk).
+"""
+import asyncio
+import signal
+from typing import Any, Dict
+
+from .models import ClassifyRequest, ExtractRequest, GenerateRequest, SummarizeRequest
+from .services.ai_service import AIService
+from .services.cache_service import CacheService
+from .services.classification_service import ClassificationService
+from .services.embedding_service import EmbeddingService
+from .services.job_service import JobService
+from .services.logging_service import LoggingService
+from .services.redis_service import RedisService
+from .services.scheduler import TenantScheduler
+from .services.summarization_service import SummarizationService
+from .config import settings
+
+scheduler = TenantScheduler()
+redis_service = RedisService()
+ai_service = AIService(scheduler)
+cache_service = CacheService(redis_service)
+logging_service = LoggingService(redis_service)
+job_service = JobService(redis_service)
+summarization_service = SummarizationService(ai_service, cache_service)
+embedding_service = EmbeddingService()
+classification_service = ClassificationService(ai_service, embedding_service)
+
+
+async def run_summarize(payload: Dict[str, Any]) -> Dict[str, Any]:
+    request = SummarizeRequest(**payload)
+    with ai_service.track_usage() as usage:
+        summary = await summarization_service.summarize(request.text, request.model, request.max_length)
+    await _log("summarize", request.model, usage.total_tokens, {"text_length": len(request.text)})
+    return {"data": {"summary": summary}, "model_used": request.model, "tokens_used": usage.total_tokens}
+
+
+async def run_extract(payload: Dict[str, Any]) -> Dict[str, Any]:
+    request = ExtractRequest(**payload)
+    with ai_service.track_usage() as usage:
+        extracted_data = await ai_service.extract_data(request.text, request.schema, request.model)
+    await _log("extract", request.model, usage.total_tokens, {"text_length": len(request.text)})
+    return {"data": {"extracted_data": extracted_data}, "model_used": request.model, "tokens_used": usage.total_tokens}
+
+
+async def run_classify(payload: Dict[str, Any]) -> Dict[str, Any]:
+    request = ClassifyRequest(**payload)
+    with ai_service.track_usage() as usage:
+        result = await classification_service.classify(request.text, request.categories, request.model, request.examples)
+    model_used = request.model if result["method"] == "llm" else settings.embedding_model
+    await _log("classify", model_used, usage.total_tokens, {"text_length": len(request.text)})
+    return {"data": result, "model_used": model_used, "tokens_used": usage.total_tokens}
+
+
+async def run_generate(payload: Dict[str, Any]) -> Dict[str, Any]:
+    request = GenerateRequest(**payload)
+    with ai_service.track_usage() as usage:
+        generated_content = await ai_service.generate_content(request.prompt, request.max_tokens, request.model)
+    await _log("generate", request.model, usage.total_tokens, {"prompt_length": len(request.prompt)})
+    return {
+        "data": {"generated_content": generated_content},
+        "model_used": request.model,
+        "tokens_used": usage.total_tokens
+    }
+
+
+HANDLERS = {
+    "summarize": run_summarize,
+    "extract": run_extract,
+    "classify": run_classify,
+    "generate": run_generate
+}
+
+
+async def _log(request_type: str, model: str, tokens_used: int, request_data: Dict[str, Any]):
+    await logging_service.log_request(
+        service_name="ai-worker",
+        request_type=request_type,
+        request_data=request_data,
+        model_used=model,
+        tokens_used=tokens_used,
+        status="success"
+    )
+
+
+async def main():
+    await redis_service.connect()
+    await ai_service.connect()
+    if not job_service.redis_client:
+        await redis_service.disconnect()
+        raise SystemExit("Redis is required to run the job worker")
+
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, job_service.stop)
+
+    print(f"AI job worker {job_service.consumer} started")
+    try:
+        await job_service.run_worker(HANDLERS)
+    finally:
+        await embedding_service.close()
+        await ai_service.disconnect()
+        await redis_service.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,39 @@
+"""
+Multi-process serving of the AI service:
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+The app is imported once in the master and workers are forked from it, so
+read-only state loaded at import (the embedding model with
+EMBEDDING_PRELOAD=true) is shared copy-on-write. Connections and clients are
+created per worker in the app's lifespan.
+"""
+import os
+
+
+def available_cpus() -> int:
+    """CPUs this container may use: affinity mask, capped by the cgroup quota"""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max", "r", encoding="utf-8") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+cpus = available_cpus()
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY") or os.getenv("WORKERS") or cpus)
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# SIGTERM: stop accepting, let in-flight requests (and their lifespan shutdown) finish
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+keepalive = 5
+
+# Split the cores between the workers' embedding thread pools
+os.environ.setdefault("EMBEDDING_THREADS", str(max(1, cpus // workers)))
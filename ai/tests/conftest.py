@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Tests import the service as the `app` package, as the Dockerfile lays it out
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+# ...and the modules shared between services as the installed `platform_common` package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "shared"))
@@ -0,0 +1,175 @@
+import asyncio
+
+import pytest
+from platform_common.codec import dumps
+
+from app.bulk import load_output
+from app.services.bulk_service import BulkCheckpoint, BulkService, split_lines
+from app.services.scheduler import Overloaded, RequestContext, request_context
+
+
+class FakeRedis:
+    """The Redis commands the checkpoint uses, run through a pipeline"""
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction=True):
+        return Pipeline(self)
+
+
+class Pipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    async def execute(self):
+        data = self.redis.data
+        results = []
+        for name, args, kwargs in self.commands:
+            if name == "set":
+                key, value = args
+                if kwargs.get("nx") and key in data:
+                    results.append(None)
+                    continue
+                data[key] = value.encode() if isinstance(value, str) else value
+                results.append(True)
+            elif name == "get":
+                results.append(data.get(args[0]))
+            elif name == "setbit":
+                key, line, _ = args
+                bits = BulkCheckpoint(data.get(key, b""))
+                bits.add(line)
+                data[key] = bytes(bits.bits)
+                results.append(0)
+            elif name == "expire":
+                results.append(args[0] in data)
+        return results
+
+
+class RedisService:
+    def __init__(self):
+        self.client = FakeRedis()
+
+    def get(self, **kwargs):
+        return self.client
+
+
+async def chunks(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def test_checkpoint_bits():
+    checkpoint = BulkCheckpoint()
+    for line in (1, 8, 9, 1000):
+        checkpoint.add(line)
+    assert [line in checkpoint for line in (1, 2, 8, 9, 1000, 1001)] == [True, False, True, True, True, False]
+    assert len(checkpoint) == 4
+    assert BulkCheckpoint(bytes(checkpoint.bits)).bits == checkpoint.bits
+
+
+def test_split_lines_across_chunks():
+    async def main():
+        return [pair async for pair in split_lines(chunks(b"a\n\nbc\nd", 2))]
+    assert asyncio.run(main()) == [(1, b"a"), (2, b""), (3, b"bc"), (4, b"d")]
+
+
+def test_checkpoint_is_per_tenant_and_per_input():
+    service = BulkService(RedisService())
+
+    async def main():
+        checkpoint = await service.load_checkpoint("acme", "run-1", "digest-a")
+        assert len(checkpoint) == 0
+        await service.mark("acme", "run-1", 3)
+        await service.mark("acme", "run-1", 5)
+        resumed = await service.load_checkpoint("acme", "run-1", "digest-a")
+        assert 3 in resumed and 5 in resumed and 4 not in resumed
+        # Another tenant's run with the same id is separate
+        assert len(await service.load_checkpoint("globex", "run-1", "digest-b")) == 0
+        with pytest.raises(ValueError):
+            await service.load_checkpoint("acme", "run-1", "digest-b")
+
+    asyncio.run(main())
+    assert set(service.redis.client.data) == {
+        "bulk:acme:run-1", "bulk:acme:run-1:input", "bulk:globex:run-1:input"
+    }
+
+
+def test_run_resumes_retries_shed_items_and_reports_failures(monkeypatch):
+    monkeypatch.setattr("app.config.settings.bulk_max_attempts", 3)
+    shed = {"left": 2}
+    running = {"now": 0, "max": 0}
+
+    async def echo(payload):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        try:
+            await asyncio.sleep(0.001)
+            if payload.get("shed") and shed["left"]:
+                shed["left"] -= 1
+                raise Overloaded("busy", 503, 0.001)
+            if payload.get("fail"):
+                raise ValueError("bad item")
+            return {"echo": payload["x"], "tenant": request_context.get().tenant}
+        finally:
+            running["now"] -= 1
+
+    lines = [dumps({"x": number}) for number in range(1, 41)]
+    lines[4] = b"not json"
+    lines[9] = dumps({"x": 10, "shed": True})
+    lines[14] = dumps({"x": 15, "fail": True})
+    lines[19] = dumps({"id": "item-20", "operation": "echo", "payload": {"x": 20}})
+    lines[24] = dumps({"operation": "nope", "payload": {}})
+    data = b"\n".join(lines)
+    service = BulkService(None)
+    context = RequestContext("acme", "pro", "batch")
+
+    async def run(checkpoint, stop=None):
+        records = []
+        async for record in service.run(split_lines(chunks(data, 7)), {"echo": echo}, context, "echo", checkpoint, 4):
+            records.append(record)
+            checkpoint.add(record["line"])
+            if stop and len(records) == stop:
+                break
+        return records
+
+    checkpoint = BulkCheckpoint()
+    first = asyncio.run(run(checkpoint, stop=15))
+    second = asyncio.run(run(checkpoint))
+    records = {record["line"]: record for record in first + second}
+    assert len(first) + len(second) == 40 and len(records) == 40
+    assert running["max"] <= 4
+    assert records[5]["status"] == "failed"
+    assert records[10]["status"] == "completed"
+    assert records[15] == {"line": 15, "operation": "echo", "status": "failed", "error": "bad item"}
+    assert records[20]["id"] == "item-20" and records[20]["result"]["echo"] == 20
+    assert records[25]["error"] == "Unsupported bulk operation: nope"
+    assert records[40]["result"] == {"echo": 40, "tenant": "acme"}
+
+
+def test_load_output_drops_truncated_and_garbled_records(tmp_path):
+    path = tmp_path / "out.jsonl"
+    path.write_bytes(dumps({"line": 1}) + b"\n" + dumps({"line": 2}) + b"\n" + b'{"lin')
+    checkpoint = load_output(str(path))
+    assert 1 in checkpoint and 2 in checkpoint and len(checkpoint) == 2
+    assert path.read_bytes().endswith(b"\n") and path.read_bytes().count(b"\n") == 2
+
+    # A complete line that is not a record (torn write, disk garbage) is treated the same way
+    path.write_bytes(dumps({"line": 1}) + b"\n" + b'{"li\x00\n' + dumps({"line": 3}) + b"\n")
+    checkpoint = load_output(str(path))
+    assert len(checkpoint) == 1
+    assert path.read_bytes() == dumps({"line": 1}) + b"\n"
+
+    path.write_bytes(dumps({"status": "completed"}) + b"\n")
+    assert len(load_output(str(path))) == 0
+    assert path.read_bytes() == b""
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from app.services.cache_service import CacheService
+
+
+class NoRedis:
+    """Redis unreachable: get_or_refresh only coalesces within the process"""
+
+    def get(self, **kwargs):
+        return None
+
+
+def test_concurrent_misses_share_one_computation():
+    cache = CacheService(NoRedis())
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_refresh("key", compute) for _ in range(10)))
+
+    assert asyncio.run(main()) == [("value", False)] * 10
+    assert calls == 1
+    assert cache._inflight == {}
+
+
+def test_errors_are_shared_with_waiters():
+    cache = CacheService(NoRedis())
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("provider down")
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_refresh("key", compute) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_cancelling_the_owner_does_not_cancel_waiters():
+    cache = CacheService(NoRedis())
+    calls = 0
+    started = None
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        started.set()
+        await asyncio.sleep(0.05)
+        return f"value-{calls}"
+
+    async def main():
+        nonlocal started
+        started = asyncio.Event()
+        owner = asyncio.create_task(cache.get_or_refresh("key", compute))
+        await started.wait()
+        waiters = [asyncio.create_task(cache.get_or_refresh("key", compute)) for _ in range(3)]
+        await asyncio.sleep(0)
+        owner.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await owner
+        return await asyncio.gather(*waiters)
+
+    results = asyncio.run(main())
+    # One waiter took over the computation and the others shared it
+    assert results == [("value-2", False)] * 3
+    assert calls == 2
+    assert cache._inflight == {}
+
+
+def test_cancelling_a_waiter_leaves_the_computation_running():
+    cache = CacheService(NoRedis())
+
+    async def compute():
+        await asyncio.sleep(0.02)
+        return "value"
+
+    async def main():
+        owner = asyncio.create_task(cache.get_or_refresh("key", compute))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_refresh("key", compute))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        return await owner, waiter.cancelled()
+
+    assert asyncio.run(main()) == (("value", False), True)
@@ -0,0 +1,76 @@
+import asyncio
+import math
+
+import numpy as np
+
+from app.config import settings
+from app.services.classification_service import ClassificationService
+
+
+def unit(cosine: float, axis: int) -> np.ndarray:
+    """Unit vector with the given cosine similarity to the text vector e0, leaning towards axis"""
+    vector = np.zeros(4, dtype=np.float32)
+    vector[0] = cosine
+    vector[axis] = math.sqrt(1 - cosine * cosine)
+    return vector
+
+
+class StubEmbeddings:
+    """The text embeds to e0; each label to a vector with a chosen cosine similarity to it"""
+
+    def __init__(self, similarities):
+        self.similarities = similarities
+
+    async def embed(self, texts, use_cache=True):
+        rows = []
+        for text in texts:
+            if text in self.similarities:
+                rows.append(unit(self.similarities[text], 1 + len(rows) % 3))
+            else:
+                rows.append(np.eye(4, dtype=np.float32)[0])
+        return np.stack(rows)
+
+
+class StubAI:
+    def __init__(self):
+        self.calls = 0
+
+    async def classify_text(self, text, categories, model):
+        self.calls += 1
+        return categories[-1]
+
+
+def classify(similarities):
+    ai = StubAI()
+    service = ClassificationService(ai, StubEmbeddings(similarities))
+    result = asyncio.run(service.classify("the text", list(similarities)))
+    return result, ai.calls
+
+
+def test_clear_winner_takes_the_fast_path():
+    result, calls = classify({"billing": 0.62, "support": 0.41, "sales": 0.30})
+    assert result["method"] == "embedding" and result["classification"] == "billing"
+    assert result["confidence"] > 0.9
+    assert calls == 0
+
+
+def test_small_gap_goes_to_the_llm_although_softmax_is_confident():
+    # At temperature 0.05 a 0.05 gap gives p = 0.73, above the 0.6 confidence threshold
+    result, calls = classify({"billing": 0.60, "support": 0.55})
+    assert result["method"] == "llm" and calls == 1
+
+
+def test_low_absolute_similarity_goes_to_the_llm():
+    result, calls = classify({"billing": 0.25, "support": 0.05})
+    assert result["method"] == "llm" and calls == 1
+
+
+def test_single_category_never_takes_the_fast_path():
+    result, calls = classify({"billing": 0.9})
+    assert result["method"] == "llm" and calls == 1
+
+
+def test_calibration_margin_bounds_the_two_way_confidence():
+    """The default margin alone guarantees p >= 0.88 between two categories"""
+    p = 1 / (1 + math.exp(-settings.classifier_min_margin / settings.classifier_temperature))
+    assert p > 0.88 > settings.classifier_confidence_threshold
@@ -0,0 +1,134 @@
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from app.services.context_budget import SUMMARY_PREFIX, ContextBudgetService
+from app.config import settings
+
+MODEL = "claude-test"
+
+
+class StubAIService:
+    """Provider stub: every completion is a fixed summary"""
+
+    def __init__(self):
+        self.prompts: List[str] = []
+
+    async def complete(self, prompt: str, model: str, max_tokens: int = 1000) -> str:
+        self.prompts.append(prompt)
+        return "the earlier turns"
+
+
+class StubCache:
+    def __init__(self):
+        self.entries: Dict[str, Any] = {}
+
+    async def get(self, key: str) -> Optional[Any]:
+        return self.entries.get(key)
+
+    async def set_entry(self, key: str, value: Any, operation: str = "default", compute_seconds: float = 0.0) -> bool:
+        self.entries[key] = value
+        return True
+
+
+def _conversation(turns: int, size: int = 400) -> List[Dict[str, str]]:
+    messages = [{"role": "system", "content": "You are helpful."}]
+    for i in range(turns):
+        role = "user" if i % 2 == 0 else "assistant"
+        messages.append({"role": role, "content": f"{role} turn {i} " + "x" * size})
+    return messages
+
+
+def _fit(messages, budget, policy, service=None):
+    service = service or ContextBudgetService(StubAIService(), StubCache())
+    return asyncio.run(service.fit(messages, MODEL, 100, budget=budget, policy=policy))
+
+
+def test_under_budget_is_unchanged():
+    messages = _conversation(4, size=10)
+    fitted, accounting = _fit(messages, 10000, "summarize")
+    assert fitted == messages
+    assert accounting["summarized_messages"] == 0
+
+
+def test_pin_system_keeps_system_and_newest_turns():
+    messages = _conversation(10)
+    fitted, _ = _fit(messages, 350, "pin_system")
+    assert fitted[0] == messages[0]
+    assert fitted[-1] == messages[-1]
+    assert len(fitted) < len(messages)
+
+
+def test_summarize_shorter_than_a_block_keeps_the_question():
+    # 5 turns (fewer than chat_summary_block): the newest user turn must still be sent
+    messages = _conversation(5, size=1200)
+    assert settings.chat_summary_block > 5
+    budget = settings.chat_summary_max_tokens + 50 + 700
+    fitted, accounting = _fit(messages, budget, "summarize")
+    assert fitted[-1] == messages[-1] and fitted[-1]["role"] == "user"
+    assert fitted[1]["content"].startswith(SUMMARY_PREFIX)
+    # Only the turns that did not fit are summarized
+    assert accounting["summarized_messages"] == len(messages) - 1 - (len(fitted) - 2)
+
+
+def test_newest_user_turn_is_kept_even_over_budget():
+    messages = _conversation(3, size=4000)
+    for policy in ("sliding_window", "pin_system", "summarize"):
+        fitted, _ = _fit(messages, 100, policy)
+        assert messages[-1] in fitted, policy
+
+
+def test_rolling_summary_blocks_are_reused():
+    ai = StubAIService()
+    service = ContextBudgetService(ai, StubCache())
+    block = settings.chat_summary_block
+    messages = _conversation(3 * block)
+    budget = settings.chat_summary_max_tokens + 50 + 250
+    _fit(messages, budget, "summarize", service)
+    calls = len(ai.prompts)
+    # The next exchange re-summarizes at most the trailing partial block
+    _fit(messages + _conversation(2)[1:], budget, "summarize", service)
+    assert len(ai.prompts) - calls <= 2
+
+
+def test_trimmed_window_starts_on_a_user_turn():
+    # Odd number of turns: the newest is a user turn and the one before it an assistant reply
+    messages = _conversation(7)
+    per_message = _fit(messages, 10 ** 6, "pin_system")[1]["original_prompt_tokens"] // len(messages)
+    for policy in ("sliding_window", "pin_system", "summarize"):
+        budget = 3 * per_message + 5
+        if policy == "summarize":
+            budget += settings.chat_summary_max_tokens + 50
+        fitted, _ = _fit(messages, budget, policy)
+        turns = [m for m in fitted if m["role"] != "system"]
+        assert turns[0]["role"] == "user", policy
+        assert turns[-1] == messages[-1], policy
+
+
+class SlowAIService(StubAIService):
+    def __init__(self):
+        super().__init__()
+        self.running = 0
+        self.peak = 0
+
+    async def complete(self, prompt: str, model: str, max_tokens: int = 1000) -> str:
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        return await super().complete(prompt, model, max_tokens)
+
+
+def test_new_summary_blocks_are_summarized_concurrently(monkeypatch):
+    monkeypatch.setattr(settings, "summarize_max_concurrency", 3)
+    ai = SlowAIService()
+    service = ContextBudgetService(ai, StubCache())
+    block = settings.chat_summary_block
+    messages = _conversation(6 * block + 1)
+    _fit(messages, settings.chat_summary_max_tokens + 50 + 250, "summarize", service)
+    assert ai.peak == 3
+    assert sum(prompt.startswith("Combine") for prompt in ai.prompts) == 1
+
+    # The merged whole-block prefix is cached: the next exchange only extends it
+    calls = len(ai.prompts)
+    _fit(messages + _conversation(2)[1:], settings.chat_summary_max_tokens + 50 + 250, "summarize", service)
+    assert len(ai.prompts) - calls <= 2
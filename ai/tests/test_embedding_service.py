@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+import numpy as np
+
+from app.config import settings
+from app.services.embedding_service import EmbeddingService
+
+
+def stub_service(batches, seconds=0.0):
+    service = EmbeddingService()
+
+    def encode(texts, batch_size=None):
+        batches.append(list(texts))
+        time.sleep(seconds)
+        return np.array([[float(len(text)), 1.0] for text in texts], dtype=np.float32)
+
+    service._encode = encode
+    return service
+
+
+def test_queries_do_not_wait_behind_a_whole_ingestion_batch(monkeypatch):
+    monkeypatch.setattr(settings, "embedding_bulk_slice_size", 4)
+    batches = []
+    service = stub_service(batches, seconds=0.01)
+
+    async def main():
+        ingestion = asyncio.create_task(service.embed([f"chunk {i}" for i in range(40)], use_cache=False, bulk=True))
+        await asyncio.sleep(0.005)
+        query = await service.embed(["query"])
+        done_first = not ingestion.done()
+        chunks = await ingestion
+        await service.close()
+        return query, chunks, done_first
+
+    query, chunks, query_first = asyncio.run(main())
+    assert query_first
+    assert query.shape == (1, 2) and chunks.shape == (40, 2)
+    assert [len(batch) for batch in batches].count(4) == 10
+    # The query ran right after the slice that was already encoding
+    assert batches.index(["query"]) <= 2
+    assert chunks[:, 0].tolist() == [float(len(f"chunk {i}")) for i in range(40)]
+
+
+def test_cache_hits_and_misses_are_both_counted_in_texts():
+    service = stub_service([])
+
+    async def main():
+        await service.embed(["a", "a", "b"])
+        await service.embed(["a", "c"])
+        await service.close()
+
+    asyncio.run(main())
+    metrics = service.metrics()
+    assert metrics["cache_misses"] == 4  # a, a, b, then c
+    assert metrics["cache_hits"] == 1
+    assert metrics["cache_hits"] + metrics["cache_misses"] == metrics["texts"]
+
+
+def test_cancelled_requests_are_not_encoded():
+    batches = []
+    service = stub_service(batches, seconds=0.02)
+
+    async def main():
+        first = asyncio.create_task(service.embed(["first"], use_cache=False, bulk=True))
+        await asyncio.sleep(0.005)
+        second = asyncio.create_task(service.embed(["second"], use_cache=False, bulk=True))
+        await asyncio.sleep(0)
+        second.cancel()
+        await first
+        await asyncio.sleep(0.03)
+        await service.close()
+
+    asyncio.run(main())
+    assert batches == [["first"]]
@@ -0,0 +1,90 @@
+import asyncio
+import os
+
+import pytest
+
+from app.config import settings
+from app.services.ingestion_service import IngestionService
+from app.services.knowledge_store import KnowledgeStore
+from app.services.url_policy import BlockedURL, check_url
+
+
+def read_all(service, source_config):
+    async def collect():
+        return [document async for document in service._read_files(source_config)]
+    return asyncio.run(collect())
+
+
+@pytest.fixture
+def ingest_root(tmp_path, monkeypatch):
+    root = tmp_path / "ingest"
+    (root / "docs").mkdir(parents=True)
+    (root / "docs" / "a.txt").write_text("inside")
+    (tmp_path / "secret.txt").write_text("outside")
+    monkeypatch.setattr(settings, "kb_ingest_root", str(root))
+    return root
+
+
+def test_file_sources_are_read_from_the_ingestion_root(ingest_root):
+    service = IngestionService(None, None)
+    assert read_all(service, {"path": "docs"}) == [("a.txt", "inside")]
+    assert read_all(service, {"path": str(ingest_root / "docs" / "a.txt")}) == [("a.txt", "inside")]
+
+
+def test_file_sources_outside_the_root_are_rejected(ingest_root, tmp_path):
+    service = IngestionService(None, None)
+    for path in ("../secret.txt", str(tmp_path / "secret.txt"), "/proc/self/environ", "docs/../../secret.txt"):
+        with pytest.raises(PermissionError):
+            read_all(service, {"path": path})
+
+
+def test_symlinks_out_of_the_root_are_rejected(ingest_root, tmp_path):
+    os.symlink(tmp_path / "secret.txt", ingest_root / "docs" / "link.txt")
+    with pytest.raises(PermissionError):
+        read_all(IngestionService(None, None), {"path": "docs"})
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/admin",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://10.0.0.5:6379/",
+    "http://[::1]/",
+    "http://[::ffff:127.0.0.1]/",
+    "http://localhost:8000/debug",
+    "file:///etc/passwd",
+    "gopher://example.com/",
+])
+def test_internal_and_non_http_urls_are_blocked(url):
+    with pytest.raises(BlockedURL):
+        asyncio.run(check_url(url))
+
+
+def test_host_allowlist(monkeypatch):
+    monkeypatch.setattr(settings, "outbound_allowed_hosts", [".example.com"])
+    monkeypatch.setattr(settings, "outbound_allow_private", True)  # no DNS in tests
+    asyncio.run(check_url("https://docs.example.com/page"))
+    asyncio.run(check_url("https://example.com/"))
+    for url in ("https://example.com.evil.net/", "https://notexample.com/"):
+        with pytest.raises(BlockedURL):
+            asyncio.run(check_url(url))
+
+
+def test_start_rejects_a_blocked_source_before_taking_the_lock():
+    class Redis:
+        def get(self, decode_responses=False):
+            return self
+
+        async def set(self, *args, **kwargs):
+            raise AssertionError("lock taken for a rejected source")
+
+    service = IngestionService(None, Redis())
+    with pytest.raises(PermissionError):
+        asyncio.run(service.start("acme", "kb", "website", {"urls": ["http://169.254.169.254/"]}))
+
+
+@pytest.mark.parametrize("company_id, knowledge_base_id", [
+    ("..", "kb"), ("acme", "../other"), ("acme/kb", "x"), ("acme", ""), ("acme", "kb\0"),
+])
+def test_ids_that_are_not_one_path_component_are_rejected(company_id, knowledge_base_id):
+    with pytest.raises(ValueError):
+        KnowledgeStore(company_id, knowledge_base_id)
@@ -0,0 +1,169 @@
+import asyncio
+
+import pytest
+from platform_common.codec import dumps
+
+from app.config import settings
+from app.services.job_service import JobService
+from app.services.url_policy import BlockedURL
+
+
+class RecordingRedis:
+    def __init__(self):
+        self.writes = []
+
+    def get(self, **kwargs):
+        return self
+
+    def pipeline(self, transaction=True):
+        raise AssertionError("job queued with a blocked webhook")
+
+    async def hset(self, key, field=None, value=None, mapping=None):
+        self.writes.append((key, field, value))
+
+
+def test_jobs_with_internal_webhooks_are_rejected():
+    service = JobService(RecordingRedis())
+    for url in ("http://169.254.169.254/latest/meta-data/", "http://redis:6379/", "file:///etc/passwd"):
+        with pytest.raises(BlockedURL):
+            asyncio.run(service.submit("summarize", {"text": "x"}, "acme", url))
+
+
+def test_webhooks_are_checked_again_at_delivery():
+    redis = RecordingRedis()
+    service = JobService(redis)
+    asyncio.run(service._notify("http://127.0.0.1:8000/hook", "job-1", {"status": "completed", "result": b"{}"}))
+    assert redis.writes == [("ai_job:job-1", "webhook_status", "blocked")]
+
+
+class QuotaRedis:
+    def __init__(self, reservation):
+        self.counters = {"token_quota:acme:minute": 5000, "token_quota:acme:month": 90000, "token_quota:other:month": 100}
+        self.strings = {"token_reservation:r-1": dumps(reservation)}
+
+    def get(self, key=None, **kwargs):
+        return self if key is None else self._get(key)
+
+    async def _get(self, key):
+        return self.strings.get(key)
+
+    async def delete(self, key):
+        return 1 if self.strings.pop(key, None) else 0
+
+    async def eval(self, script, numkeys, *args):
+        keys, delta = args[:numkeys], int(args[numkeys])
+        for key in keys:
+            if key in self.counters:
+                self.counters[key] += delta
+
+
+def reservation(reserved, keys=("token_quota:acme:minute", "token_quota:acme:month", "token_quota:acme:gone")):
+    return {"company_id": "acme", "keys": list(keys), "tokens": reserved}
+
+
+def finished_job(company_id="acme"):
+    return {"job_id": "job-1", "company_id": company_id, "token_reservation_id": "r-1"}
+
+
+def test_finished_jobs_settle_their_token_reservation_once():
+    redis = QuotaRedis(reservation(3000))
+    service = JobService(redis)
+    fields = {"status": "completed", "result": dumps({"data": {}, "tokens_used": 1200})}
+
+    async def main():
+        await service._reconcile_tokens(finished_job(), fields)
+        await service._reconcile_tokens(finished_job(), fields)
+
+    asyncio.run(main())
+    # 1800 of the 3000 reserved tokens refunded, once; expired counters are not recreated
+    assert redis.counters["token_quota:acme:minute"] == 3200
+    assert redis.counters["token_quota:acme:month"] == 88200
+    assert "token_quota:acme:gone" not in redis.counters
+
+
+def test_failed_jobs_refund_their_whole_reservation():
+    redis = QuotaRedis(reservation(1000))
+    asyncio.run(JobService(redis)._reconcile_tokens(finished_job(), {"status": "failed", "error": "x"}))
+    assert redis.counters["token_quota:acme:minute"] == 4000
+    assert redis.counters["token_quota:acme:month"] == 89000
+
+
+def test_reservations_only_settle_the_jobs_own_company_counters():
+    redis = QuotaRedis(reservation(1000, keys=("token_quota:acme:month", "token_quota:other:month")))
+    service = JobService(redis)
+    failed = {"status": "failed", "error": "x"}
+
+    # Another company's job cannot settle (or discard) acme's reservation
+    asyncio.run(service._reconcile_tokens(finished_job("other"), failed))
+    assert redis.counters["token_quota:other:month"] == 100
+    assert "token_reservation:r-1" in redis.strings
+
+    # and acme's reservation never touches counters outside its own layout
+    asyncio.run(service._reconcile_tokens(finished_job(), failed))
+    assert redis.counters == {"token_quota:acme:minute": 5000, "token_quota:acme:month": 89000, "token_quota:other:month": 100}
+
+
+class RedeliveredRedis:
+    """A job whose worker died on its last allowed attempt, as XAUTOCLAIM hands it to the next worker"""
+
+    def __init__(self, attempts):
+        self.job = {"job_id": "job-1", "operation": "summarize", "payload": dumps({"text": "x"}), "status": "running",
+                    "attempts": attempts}
+        self.acked = []
+
+    def get(self, **kwargs):
+        return self
+
+    async def hgetall(self, key):
+        return dict(self.job)
+
+    async def hincrby(self, key, field, amount):
+        self.job[field] += amount
+        return self.job[field]
+
+    async def hset(self, key, field=None, value=None, mapping=None):
+        self.job.update(mapping or {field: value})
+
+    def pipeline(self, transaction=True):
+        return Pipeline(self)
+
+
+class Pipeline:
+    def __init__(self, redis):
+        self.redis = redis
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def hset(self, key, mapping):
+        self.redis.job.update(mapping)
+
+    def expire(self, key, seconds):
+        pass
+
+    def xack(self, stream, group, entry_id):
+        self.redis.acked.append(entry_id)
+
+    def xdel(self, stream, entry_id):
+        pass
+
+    async def execute(self):
+        pass
+
+
+def test_jobs_that_keep_killing_their_worker_are_failed_without_running(monkeypatch):
+    monkeypatch.setattr(settings, "job_max_attempts", 3)
+    redis = RedeliveredRedis(attempts=3)
+    ran = []
+
+    async def handler(payload):
+        ran.append(payload)
+        return {}
+
+    asyncio.run(JobService(redis)._process("1-0", "job-1", {"summarize": handler}))
+    assert ran == []
+    assert redis.job["status"] == "failed" and redis.job["attempts"] == 4
+    assert redis.acked == ["1-0"]
@@ -0,0 +1,119 @@
+import asyncio
+import time
+
+import pytest
+
+from app.config import settings
+from app.services.scheduler import (
+    Overloaded, RequestContext, RequestContextMiddleware, SchedulerTimeout, TenantScheduler, request_context
+)
+
+
+@pytest.fixture
+def small(monkeypatch):
+    monkeypatch.setattr(settings, "scheduler_max_concurrency", 1)
+    monkeypatch.setattr(settings, "scheduler_max_tenant_queue", 1)
+    monkeypatch.setattr(settings, "scheduler_max_queue", 2)
+
+
+async def hold(scheduler, tenant, release, deadline=None):
+    request_context.set(RequestContext(tenant, "pro", deadline=deadline))
+    async with scheduler.slot():
+        await release.wait()
+
+
+async def shed(scheduler, tenant, deadline=None):
+    request_context.set(RequestContext(tenant, "pro", deadline=deadline))
+    async with scheduler.slot():
+        pass
+
+
+def test_tenant_queue_limit_sheds_with_429_and_global_limit_with_503(small):
+    async def main():
+        scheduler, release = TenantScheduler(), asyncio.Event()
+        held = [asyncio.create_task(hold(scheduler, "acme", release))]
+        await asyncio.sleep(0)
+        held.append(asyncio.create_task(hold(scheduler, "acme", release)))
+        await asyncio.sleep(0)
+
+        with pytest.raises(Overloaded) as tenant_full:
+            await shed(scheduler, "acme")
+        # Another tenant still gets a queue slot
+        held.append(asyncio.create_task(hold(scheduler, "globex", release)))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as process_full:
+            await shed(scheduler, "initech")
+
+        metrics = scheduler.metrics()
+        release.set()
+        await asyncio.gather(*held)
+        return tenant_full.value, process_full.value, metrics, scheduler.metrics()
+
+    tenant_full, process_full, busy, idle = asyncio.run(main())
+    assert tenant_full.status_code == 429 and not isinstance(tenant_full, SchedulerTimeout)
+    assert process_full.status_code == 503
+    assert busy["shed"] == 2 and busy["running"] == 1 and busy["queued"] == 2
+    assert idle["running"] == 0 and idle["queued"] == 0
+    assert idle["tenants"]["acme"]["dispatched"] == 2
+
+
+def test_calls_are_shed_once_the_oldest_waiter_waited_too_long(small, monkeypatch):
+    monkeypatch.setattr(settings, "scheduler_max_queue", 100)
+    monkeypatch.setattr(settings, "scheduler_shed_wait_seconds", 0.05)
+
+    async def main():
+        scheduler, release = TenantScheduler(), asyncio.Event()
+        held = [asyncio.create_task(hold(scheduler, "acme", release))]
+        await asyncio.sleep(0)
+        held.append(asyncio.create_task(hold(scheduler, "acme", release)))
+        await asyncio.sleep(0.06)
+        with pytest.raises(Overloaded) as overloaded:
+            await shed(scheduler, "globex")
+        release.set()
+        await asyncio.gather(*held)
+        return overloaded.value
+
+    overloaded = asyncio.run(main())
+    assert overloaded.status_code == 503
+    assert overloaded.headers == {"Retry-After": "1"}
+
+
+def call_middleware(middleware, headers):
+    scope = {
+        "type": "http", "method": "POST", "path": "/chat",
+        "headers": [(name.encode(), value.encode()) for name, value in headers.items()]
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    start = messages[0]
+    return start["status"], dict(start["headers"])
+
+
+def test_middleware_sheds_expired_and_excess_requests(monkeypatch):
+    seen = []
+
+    async def app(scope, receive, send):
+        context = request_context.get()
+        seen.append((context.tenant, context.plan, context.priority))
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    middleware = RequestContextMiddleware(app)
+    status, _ = call_middleware(middleware, {"x-request-deadline": str(time.time() - 1)})
+    assert status == 504
+
+    status, _ = call_middleware(middleware, {"x-tenant-id": "acme", "x-tenant-plan": "free", "x-request-priority": "batch"})
+    assert status == 200 and seen == [("acme", "free", "batch")]
+
+    monkeypatch.setattr(settings, "max_inflight_requests", 1)
+    middleware.inflight = 1
+    status, headers = call_middleware(middleware, {"x-tenant-id": "acme"})
+    assert status == 503 and headers[b"retry-after"] == b"1"
+    assert len(seen) == 1
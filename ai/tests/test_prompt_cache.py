@@ -0,0 +1,126 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.config import settings
+from app.services import tokenizer
+from app.services.ai_service import AIService
+from app.services.prompt_cache import EPHEMERAL, plan_prompt_cache
+
+INSTRUCTIONS = "You are a support agent for Acme. " * 200
+SUMMARY = "Earlier the customer asked about invoices."
+
+CONVERSATION = [
+    {"role": "system", "content": INSTRUCTIONS},
+    {"role": "user", "content": "Where is my invoice?"},
+    {"role": "system", "content": SUMMARY},
+    {"role": "assistant", "content": "It was emailed on Monday."},
+    {"role": "user", "content": "Can you resend it?"},
+]
+
+
+@pytest.fixture(autouse=True)
+def offline_tokenizer(monkeypatch):
+    # Count gpt- models at CHARS_PER_TOKEN too; tiktoken would download its encodings
+    monkeypatch.setattr(tokenizer, "get_encoding", lambda model: None)
+
+
+class StubAnthropic:
+    """Records messages.create calls and reports a cache read of the marked prefix"""
+
+    def __init__(self):
+        self.calls = []
+        self.messages = self
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        usage = SimpleNamespace(input_tokens=20, output_tokens=5, cache_read_input_tokens=1600, cache_creation_input_tokens=0)
+        return SimpleNamespace(usage=usage, content=[SimpleNamespace(text="Sent.")])
+
+
+class StubOpenAI:
+    def __init__(self):
+        self.calls = []
+        self.chat = SimpleNamespace(completions=self)
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        usage = SimpleNamespace(prompt_tokens=1620, completion_tokens=5, prompt_tokens_details=SimpleNamespace(cached_tokens=1536))
+        return SimpleNamespace(usage=usage, choices=[SimpleNamespace(message=SimpleNamespace(content="Sent."))])
+
+
+def test_leading_system_messages_are_hoisted_and_marked():
+    plan = plan_prompt_cache(CONVERSATION, "claude-3-haiku-20240307")
+    assert [m["content"] for m in plan.messages[:2]] == [INSTRUCTIONS, SUMMARY]
+    assert plan.system_count == 2
+    # End of the pinned prompt, end of the system block (the summary) and the last reply
+    assert plan.breakpoints == [0, 1, 3]
+    assert plan.prefix_tokens >= settings.prompt_cache_min_tokens
+
+
+def test_short_prefixes_are_not_marked():
+    plan = plan_prompt_cache([{"role": "system", "content": "Be brief."}, {"role": "user", "content": "Hi"}], "gpt-4o")
+    assert not plan.cacheable and plan.breakpoints == []
+
+
+def test_system_prefix_key_ignores_the_conversation():
+    first = plan_prompt_cache(CONVERSATION[:2], "gpt-4o")
+    second = plan_prompt_cache(CONVERSATION[:1] + [{"role": "user", "content": "Hello"}], "gpt-4o")
+    other = plan_prompt_cache([{"role": "system", "content": "Other"}] + CONVERSATION[1:2], "gpt-4o")
+    assert first.prefix_key == second.prefix_key != other.prefix_key
+
+
+def test_anthropic_requests_carry_cache_breakpoints():
+    service = AIService()
+    service.anthropic_client = StubAnthropic()
+
+    async def main():
+        with service.track_usage() as usage:
+            answer = await service.chat_completion(CONVERSATION, model="claude-3-haiku-20240307")
+        return answer, usage
+
+    answer, usage = asyncio.run(main())
+    call = service.anthropic_client.calls[0]
+    assert answer == "Sent."
+    assert call["system"] == [
+        {"type": "text", "text": INSTRUCTIONS, "cache_control": EPHEMERAL},
+        {"type": "text", "text": SUMMARY, "cache_control": EPHEMERAL},
+    ]
+    assert call["messages"] == [
+        {"role": "user", "content": "Where is my invoice?"},
+        {"role": "assistant", "content": [{"type": "text", "text": "It was emailed on Monday.", "cache_control": EPHEMERAL}]},
+        {"role": "user", "content": "Can you resend it?"},
+    ]
+    # Cache reads are part of the prompt and reported separately
+    assert (usage.prompt_tokens, usage.cached_tokens, usage.completion_tokens) == (1620, 1600, 5)
+
+
+def test_uncacheable_anthropic_requests_are_sent_unmarked():
+    service = AIService()
+    service.anthropic_client = StubAnthropic()
+    asyncio.run(service.chat_completion([{"role": "user", "content": "Hi"}], model="claude-3-haiku-20240307"))
+    call = service.anthropic_client.calls[0]
+    assert "system" not in call
+    assert call["messages"] == [{"role": "user", "content": "Hi"}]
+
+
+@pytest.mark.parametrize("messages, keyed", [(CONVERSATION, True), ([{"role": "system", "content": "Be brief."}], False)])
+def test_openai_requests_are_routed_by_their_system_prefix(messages, keyed):
+    service = AIService()
+    service.openai_client = StubOpenAI()
+
+    async def main():
+        with service.track_usage() as usage:
+            await service.chat_completion(messages, model="gpt-4o")
+        return usage
+
+    usage = asyncio.run(main())
+    call = service.openai_client.calls[0]
+    plan = plan_prompt_cache(messages, "gpt-4o")
+    assert call["messages"] == plan.messages
+    if keyed:
+        assert call["extra_body"] == {"prompt_cache_key": plan.prefix_key}
+    else:
+        assert call["extra_body"] is None
+    assert usage.cached_tokens == 1536
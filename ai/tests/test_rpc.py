@@ -0,0 +1,115 @@
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from app.models import ChatRequest, SummarizeRequest
+from app.rpc import RpcServer
+from app.services.scheduler import Overloaded, request_context
+
+# The gateway's side of the transport, imported as the `src` package like its own tests do
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "api-gateway"))
+from src.ai_transport import AIServiceError, AITransport  # noqa: E402
+
+HEADERS = {"X-Tenant-Id": "acme", "X-Tenant-Plan": "enterprise", "X-Request-Priority": "batch",
+           "X-Request-Deadline": "0"}
+CHAT = {"messages": [{"role": "user", "content": "hi"}], "model": "gpt-4o"}
+
+
+async def chat(request: ChatRequest):
+    context = request_context.get()
+    return {"message": request.messages[0].content.upper(), "tenant": context.tenant, "plan": context.plan,
+            "priority": context.priority, "deadline_set": context.deadline is not None}
+
+
+async def summarize(request: SummarizeRequest):
+    if request.text == "shed":
+        raise Overloaded("AI service is overloaded", status_code=429, retry_after=3)
+    if request.text == "missing":
+        raise HTTPException(status_code=404, detail="No such document")
+    raise RuntimeError("provider exploded")
+
+
+async def chat_stream(request: ChatRequest):
+    yield {"delta": "hel"}
+    yield {"delta": "lo"}
+    if request.messages[0].content == "fail":
+        raise Overloaded("AI service is overloaded", status_code=503, retry_after=2)
+    yield {"usage": {"total_tokens": 5}}
+
+
+async def with_transport(test, grpc=True):
+    server = RpcServer({"Chat": (ChatRequest, chat), "Summarize": (SummarizeRequest, summarize)},
+                       {"ChatStream": (ChatRequest, chat_stream)})
+    port = await server.start(0)
+    http = httpx.AsyncClient(base_url="http://ai.test", transport=httpx.MockTransport(
+        lambda request: httpx.Response(200, json={"via": "http", "path": request.url.path})
+    ))
+    transport = AITransport(http, f"127.0.0.1:{port}" if grpc else None)
+    try:
+        return await test(transport)
+    finally:
+        await transport.close()
+        await http.aclose()
+        await server.stop(0)
+
+
+def test_unary_calls_carry_json_bodies_and_tenant_metadata():
+    async def test(transport):
+        return await transport.post("/chat", CHAT, HEADERS, timeout=5), transport.metrics
+
+    result, metrics = asyncio.run(with_transport(test))
+    assert result.status_code == 200
+    # The deadline header travels as the gRPC deadline, not as metadata
+    assert result.json() == {"message": "HI", "tenant": "acme", "plan": "enterprise", "priority": "batch",
+                             "deadline_set": True}
+    assert metrics == {"grpc_calls": 1, "http_calls": 0}
+
+
+def test_failures_map_back_to_http_statuses():
+    async def test(transport):
+        return [
+            await transport.post("/summarize", {"text": text}, HEADERS, timeout=5)
+            for text in ("shed", "missing", "boom")
+        ] + [await transport.post("/summarize", {"model": "gpt-4o"}, HEADERS, timeout=5)]
+
+    shed, missing, failed, invalid = asyncio.run(with_transport(test))
+    assert (shed.status_code, shed.headers["Retry-After"]) == (429, "3")
+    assert shed.json() == {"detail": "AI service is overloaded"}
+    assert (missing.status_code, missing.json()) == (404, {"detail": "No such document"})
+    assert (failed.status_code, failed.json()) == (500, {"detail": "provider exploded"})
+    assert invalid.status_code == 422
+
+
+def test_streams_yield_events_and_raise_mapped_errors():
+    async def test(transport):
+        events = [event async for event in transport.stream("/chat/stream", CHAT, HEADERS, timeout=5)]
+        failing = {**CHAT, "messages": [{"role": "user", "content": "fail"}]}
+        partial = []
+        with pytest.raises(AIServiceError) as error:
+            async for event in transport.stream("/chat/stream", failing, HEADERS, timeout=5):
+                partial.append(event)
+        return events, partial, error.value.result
+
+    events, partial, result = asyncio.run(with_transport(test))
+    assert events == [{"delta": "hel"}, {"delta": "lo"}, {"usage": {"total_tokens": 5}}]
+    assert partial == [{"delta": "hel"}, {"delta": "lo"}]
+    assert (result.status_code, result.headers["Retry-After"]) == (503, "2")
+
+
+def test_calls_without_a_grpc_target_or_method_use_http():
+    async def test(transport):
+        results = [await transport.post("/chat", CHAT, HEADERS, timeout=5),
+                   await transport.post("/retrieve", {}, HEADERS, timeout=5)]
+        return results, transport.metrics
+
+    (chat_result, _), metrics = asyncio.run(with_transport(test, grpc=False))
+    assert chat_result.json() == {"via": "http", "path": "/chat"}
+    assert metrics == {"grpc_calls": 0, "http_calls": 2}
+
+    (_, retrieve), metrics = asyncio.run(with_transport(test))
+    assert retrieve.json() == {"via": "http", "path": "/retrieve"}
+    assert metrics == {"grpc_calls": 1, "http_calls": 1}
@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+import pytest
+
+from app.config import settings
+from app.services.scheduler import RequestContext, SchedulerTimeout, TenantScheduler, request_context
+
+
+@pytest.fixture
+def one_slot(monkeypatch):
+    monkeypatch.setattr(settings, "scheduler_max_concurrency", 1)
+
+
+async def call(scheduler, tenant, plan="pro", priority="interactive", order=None, release=None, deadline=None):
+    request_context.set(RequestContext(tenant, plan, priority, deadline))
+    async with scheduler.slot():
+        if order is not None:
+            order.append(f"{tenant}/{priority}")
+        if release is not None:
+            await release.wait()
+        await asyncio.sleep(0)
+
+
+async def queue_behind_holder(scheduler, calls):
+    """Start calls while another call holds the only slot, then let them run; returns the dispatch order"""
+    order, release = [], asyncio.Event()
+    holder = asyncio.create_task(call(scheduler, "holder", release=release))
+    await asyncio.sleep(0)
+    tasks = []
+    for tenant, plan, priority in calls:
+        tasks.append(asyncio.create_task(call(scheduler, tenant, plan, priority, order)))
+        await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(holder, *tasks)
+    return order
+
+
+def test_capacity_is_shared_in_proportion_to_plan_weight(one_slot):
+    calls = [("free-co", "free", "batch")] * 4 + [("big-co", "enterprise", "batch")] * 4
+    order = asyncio.run(queue_behind_holder(TenantScheduler(), calls))
+    # Enterprise calls advance the virtual clock 16 times slower than free ones
+    assert order == ["free-co/batch"] + ["big-co/batch"] * 4 + ["free-co/batch"] * 3
+
+
+def test_interactive_calls_overtake_batch_work_of_the_same_tenant(one_slot):
+    calls = [("acme", "pro", "batch")] * 3 + [("acme", "pro", "interactive")] * 2
+    order = asyncio.run(queue_behind_holder(TenantScheduler(), calls))
+    # Interactive calls overtake batch calls queued ahead of them without starving them
+    assert order == ["acme/interactive", "acme/batch", "acme/interactive", "acme/batch", "acme/batch"]
+
+
+def test_a_tenant_never_exceeds_its_plan_concurrency(monkeypatch):
+    monkeypatch.setattr(settings, "scheduler_max_concurrency", 4)
+    monkeypatch.setattr(settings, "scheduler_plan_concurrency", {"free": 1, "pro": 16, "enterprise": 48})
+
+    async def main():
+        scheduler, release = TenantScheduler(), asyncio.Event()
+        first = asyncio.create_task(call(scheduler, "free-co", "free", release=release))
+        second = asyncio.create_task(call(scheduler, "free-co", "free", release=release))
+        await asyncio.sleep(0)
+        busy = scheduler.metrics()
+        # Other tenants still use the spare capacity
+        await asyncio.wait_for(call(scheduler, "acme"), 1.0)
+        release.set()
+        await asyncio.gather(first, second)
+        return busy
+
+    busy = asyncio.run(main())
+    assert busy["running"] == 1
+    assert busy["tenants"]["free-co"]["queued"] == {"interactive": 1, "batch": 0}
+
+
+def test_queued_calls_time_out_at_their_deadline(one_slot):
+    async def main():
+        scheduler, release = TenantScheduler(), asyncio.Event()
+        holder = asyncio.create_task(call(scheduler, "acme", release=release))
+        await asyncio.sleep(0)
+        started = time.monotonic()
+        with pytest.raises(SchedulerTimeout) as timeout:
+            await call(scheduler, "globex", deadline=time.time() + 0.05)
+        waited = time.monotonic() - started
+        with pytest.raises(SchedulerTimeout):
+            await call(scheduler, "globex", deadline=time.time() - 1)
+        release.set()
+        await holder
+        return timeout.value, waited, scheduler.metrics()
+
+    timeout, waited, metrics = asyncio.run(main())
+    assert timeout.status_code == 503 and waited < 0.5
+    assert metrics["tenants"]["globex"]["expired"] == 2
+    assert metrics["tenants"]["globex"]["dispatched"] == 0
+    # A timed-out waiter does not hold on to a queue slot
+    assert metrics["queued"] == 0
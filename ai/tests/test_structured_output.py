@@ -0,0 +1,67 @@
+from app.services.structured_output import (
+    IncrementalObjectParser, compile_schema, normalize_schema, repair_json
+)
+
+
+def test_short_form_with_a_type_field_is_not_json_schema():
+    schema = normalize_schema({"type": "string", "date": "string", "total": "number"})
+    assert schema["type"] == "object"
+    assert set(schema["properties"]) == {"type", "date", "total"}
+    assert schema["properties"]["total"] == {"type": ["number", "null"]}
+
+    value, errors = compile_schema({"type": "string", "date": "string", "total": "number"}).parse(
+        '{"type": "invoice", "date": "2024-01-31", "total": "12.50"}'
+    )
+    assert errors == []
+    assert value == {"type": "invoice", "date": "2024-01-31", "total": 12.5}
+
+
+def test_short_form_with_a_properties_field_is_not_json_schema():
+    compiled = compile_schema({"properties": "list of addresses", "owner": "string"})
+    assert compiled.schema["properties"]["properties"]["description"] == "list of addresses"
+    value, errors = compiled.parse('{"properties": "1 Main St", "owner": "Ann"}')
+    assert errors == []
+    assert value["owner"] == "Ann"
+
+
+def test_json_schemas_are_used_as_given():
+    object_schema = {"type": "object", "properties": {"a": {"type": "integer"}}, "required": ["a"]}
+    assert normalize_schema(object_schema) is object_schema
+    properties_only = {"properties": {"a": {"type": "string"}}}
+    assert normalize_schema(properties_only) is properties_only
+    array_schema = {"type": "array", "items": {"type": "string"}, "description": "tags"}
+    assert normalize_schema(array_schema) is array_schema
+    nullable = {"type": ["string", "null"], "enum": ["a", "b", None]}
+    assert normalize_schema(nullable) is nullable
+
+
+def test_nested_short_form_field_named_type():
+    schema = normalize_schema({"vehicle": {"type": "string", "wheels": "integer"}})
+    vehicle = schema["properties"]["vehicle"]
+    assert vehicle["type"] == "object"
+    assert set(vehicle["properties"]) == {"type", "wheels"}
+
+
+def test_validation_coerces_and_reports_missing_fields():
+    compiled = compile_schema({"name": "string", "age": "integer", "tags": ["string"]})
+    value, errors = compiled.validate({"name": "Ann", "age": "41", "tags": "vip"})
+    assert value == {"name": "Ann", "age": 41, "tags": ["vip"]}
+    assert errors == []
+    _, errors = compiled.validate({"name": "Ann"})
+    assert compiled.missing_fields(errors) == ["age", "tags"]
+
+
+def test_repair_json():
+    assert repair_json('Here you go:\n```json\n{"a": 1, "b": [1, 2,],}\n```') == {"a": 1, "b": [1, 2]}
+    assert repair_json('{"a": True, "b": None}') == {"a": True, "b": None}
+    assert repair_json('{"a": "cut off mid') == {"a": "cut off mid"}
+    assert repair_json('{"a": 1, "b": {"c": 2, "d"') == {"a": 1, "b": {"c": 2}}
+    assert repair_json("no json here") is None
+
+
+def test_incremental_parser_yields_completed_members():
+    parser = IncrementalObjectParser()
+    fields = []
+    for piece in ('{"na', 'me": "Ann", "ag', 'e": 41, "tags": ["a",', ' "b"]}'):
+        fields.extend(parser.feed(piece))
+    assert fields == [("name", "Ann"), ("age", 41), ("tags", ["a", "b"])]
@@ -0,0 +1,36 @@
+import random
+
+from app.services.tokenizer import chunk_text, count_tokens
+
+# Models without a local tokenizer are counted at CHARS_PER_TOKEN, which keeps these tests exact
+MODEL = "claude-test"
+WORDS = "alpha beta gamma delta epsilon zeta eta theta iota kappa lambda mu".split()
+
+
+def _document(sentences: int = 2000) -> str:
+    rng = random.Random(7)
+    return " ".join(
+        " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 30))).capitalize() + "."
+        for _ in range(sentences)
+    )
+
+
+def test_chunks_fit_the_token_budget():
+    for max_tokens, overlap in ((3000, 200), (256, 32)):
+        chunks = chunk_text(_document(), MODEL, max_tokens, overlap)
+        assert chunks
+        assert all(count_tokens(chunk, MODEL) <= max_tokens for chunk in chunks)
+
+
+def test_edit_near_the_start_keeps_later_chunks():
+    text = _document()
+    for max_tokens, overlap in ((3000, 200), (256, 32)):
+        before = chunk_text(text, MODEL, max_tokens, overlap)
+        after = chunk_text("An inserted opening sentence. " + text, MODEL, max_tokens, overlap)
+        # Boundaries are content-defined: only the chunks around the edit change
+        assert len(set(before) - set(after)) <= 2
+        assert before[-1] == after[-1]
+
+
+def test_short_text_is_one_chunk():
+    assert chunk_text("One sentence. Two sentences.", MODEL, 100, 10) == ["One sentence. Two sentences."]
@@ -0,0 +1,160 @@
+import asyncio
+import os
+
+import pytest
+
+from app.config import settings
+from app.services import value_codec
+from app.services.memory_budget import MemoryBudgets
+from app.services.value_codec import JSON, MAGIC, MSGPACK, UNCOMPRESSED, ZLIB, ZSTD, UnknownFormat
+
+VALUE = {"summary": "The quarterly report shows growth. " * 60, "tokens_used": 412, "scores": [0.5, 0.25]}
+
+
+def format_of(stored: bytes):
+    """(encoding, compression) of an encoded value"""
+    assert stored[0] == MAGIC
+    return stored[1] & 0x0F, stored[1] >> 4
+
+
+@pytest.mark.parametrize("compression, expected", [("zstd", ZSTD), ("zlib", ZLIB), ("none", UNCOMPRESSED)])
+def test_large_values_are_compressed_and_round_trip(monkeypatch, compression, expected):
+    monkeypatch.setattr(settings, "cache_compression", compression)
+    stored = value_codec.encode(VALUE)
+    assert format_of(stored) == (MSGPACK, expected)
+    if expected != UNCOMPRESSED:
+        assert len(stored) < len(VALUE["summary"])
+    assert value_codec.decode(stored) == VALUE
+
+
+def test_values_below_the_threshold_are_stored_uncompressed(monkeypatch):
+    small = {"answer": "yes " * 100}
+    stored = value_codec.encode(small)
+    assert len(stored) < settings.cache_compression_min_size
+    assert format_of(stored) == (MSGPACK, UNCOMPRESSED)
+    assert value_codec.decode(stored) == small
+
+    monkeypatch.setattr(settings, "cache_compression_min_size", 64)
+    assert format_of(value_codec.encode(small))[1] == ZSTD
+
+
+def test_incompressible_values_are_kept_as_they_are():
+    noise = os.urandom(4096)
+    stored = value_codec.encode({"blob": noise})
+    assert format_of(stored)[1] == UNCOMPRESSED
+    assert value_codec.decode(stored) == {"blob": noise}
+
+
+def test_json_encoding_is_tagged_when_msgpack_is_missing(monkeypatch):
+    monkeypatch.setattr(value_codec, "msgpack", None)
+    stored = value_codec.encode(VALUE)
+    assert format_of(stored) == (JSON, ZSTD)
+    assert value_codec.decode(stored) == VALUE
+
+
+def test_values_stored_before_the_format_byte_still_decode():
+    assert value_codec.decode(b'{"summary": "old entry", "tokens_used": 7}') == {"summary": "old entry", "tokens_used": 7}
+    assert value_codec.decode(b'["legacy", 1]') == ["legacy", 1]
+
+
+def test_unknown_formats_are_rejected():
+    for format_byte in (0x0F, 0xF1):
+        with pytest.raises(UnknownFormat):
+            value_codec.decode(bytes((MAGIC, format_byte)) + b"payload")
+
+
+class BudgetRedis:
+    """
+    Key/value store with MEMORY USAGE reported as the value length, running the
+    accounting script with the same semantics as ACCOUNT_SCRIPT
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.index = {}
+        self.sizes = {}
+        self.totals = {}
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def pipeline(self, transaction=True):
+        return BudgetPipeline(self)
+
+    def register_script(self, script):
+        async def account(keys, args):
+            index, sizes, total = keys
+            key, size, expires_at, now, budget = args
+            members = self.index.setdefault(index, {})
+            member_sizes = self.sizes.setdefault(sizes, {})
+
+            def forget(member):
+                del members[member]
+                self.totals[total] = self.totals.get(total, 0) - member_sizes.pop(member, 0)
+
+            for member in [m for m, score in members.items() if score <= now]:
+                forget(member)
+            previous = member_sizes.get(key, 0)
+            member_sizes[key] = size
+            members[key] = expires_at
+            self.totals[total] = self.totals.get(total, 0) + size - previous
+            evicted = 0
+            while self.totals[total] > budget:
+                first = min(members, key=lambda m: (members[m], m))
+                if first == key:
+                    break
+                self.data.pop(first, None)
+                forget(first)
+                evicted += 1
+            return evicted
+
+        account.registered_client = self
+        return account
+
+
+class BudgetPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def set(self, key, value, ex=None):
+        self.commands.append(("set", key, value))
+
+    def memory_usage(self, key, samples=0):
+        self.commands.append(("memory_usage", key, None))
+
+    async def execute(self):
+        results = []
+        for command, key, value in self.commands:
+            if command == "set":
+                self.redis.data[key] = value
+                results.append(True)
+            else:
+                results.append(len(self.redis.data[key]))
+        return results
+
+
+def test_namespace_over_budget_evicts_the_entries_nearest_expiry(monkeypatch):
+    monkeypatch.setattr(settings, "cache_namespace_budgets", {"summarize:chunk": 300})
+    redis, budgets = BudgetRedis(), MemoryBudgets()
+
+    async def main():
+        for name, ttl in (("a", 300), ("b", 100), ("c", 200)):
+            await budgets.store(redis, f"summarize:chunk:{name}", b"x" * 100, ttl)
+        # Rewriting a key replaces its size instead of adding to it
+        await budgets.store(redis, "summarize:chunk:a", b"x" * 100, 300)
+        assert budgets.evicted == 0
+        await budgets.store(redis, "summarize:chunk:d", b"x" * 150, 400)
+        # Keys outside budgeted namespaces are not tracked
+        await budgets.store(redis, "other:key", b"x" * 1000, 10)
+
+    asyncio.run(main())
+    assert sorted(redis.data) == ["other:key", "summarize:chunk:a", "summarize:chunk:d"]
+    assert budgets.evicted == 2
+    assert redis.totals == {"cache_budget:summarize:chunk:bytes": 250}
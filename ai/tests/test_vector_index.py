@@ -0,0 +1,73 @@
+import asyncio
+import os
+import time
+
+import numpy as np
+import pytest
+
+from app.config import settings
+from app.services.knowledge_store import KnowledgeStore
+from app.services.vector_index import VectorIndex, VectorShard
+
+
+def write(store, document_id, texts):
+    chunks = [
+        {"id": f"{document_id}-{index}".ljust(32, "0")[:32], "document_id": document_id, "text": text}
+        for index, text in enumerate(texts)
+    ]
+    embeddings = np.random.default_rng(len(texts)).normal(size=(len(texts), 8)).astype(np.float32)
+    store.write_segment(chunks, embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True))
+    store.bump_generation()
+    # Generations are file mtimes; make each commit distinct on coarse clocks
+    stat = os.stat(store._file("generation"))
+    os.utime(store._file("generation"), ns=(stat.st_atime_ns, stat.st_mtime_ns + len(store.segment_ids())))
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "knowledge_base_dir", str(tmp_path))
+    return KnowledgeStore("acme", "kb")
+
+
+def test_plans_of_an_old_generation_are_not_cached_for_the_new_one(store):
+    write(store, "a", ["refund policy for invoices", "shipping times"])
+    shard = VectorShard(store)
+    old = shard.refresh()
+    assert [hit["document_id"] for hit in shard.search_lexical("refund", 5)] == ["a"]
+
+    write(store, "b", ["refund requests are answered within a day"])
+    new = shard.refresh()
+    assert new is not old and new.generation != old.generation
+    # A search that started before the reload finishes on its own snapshot
+    stale_plan = shard._query_plan(old, "refund requests")
+    assert len(stale_plan) == 1 and "refund requests" not in new.plans
+
+    hits = shard.search_lexical("refund requests", 5)
+    assert {hit["document_id"] for hit in hits} == {"a", "b"}
+    assert len(new.plans["refund requests"]) == 2
+
+
+def test_hybrid_search_does_not_leave_the_lexical_half_running(store):
+    write(store, "a", ["refund policy"])
+
+    class FailingEmbeddings:
+        async def embed(self, texts):
+            await asyncio.sleep(0)
+            raise RuntimeError("embedding model unavailable")
+
+    index = VectorIndex(FailingEmbeddings())
+    search_lexical = index.search_lexical
+
+    def slow_lexical(*args):
+        time.sleep(0.1)
+        return search_lexical(*args)
+
+    index.search_lexical = slow_lexical
+
+    async def main():
+        before = asyncio.all_tasks()
+        with pytest.raises(RuntimeError):
+            await index.search("acme", ["kb"], "refund", 3)
+        return asyncio.all_tasks() - before
+
+    assert asyncio.run(main()) == set()
@@ -0,0 +1,32 @@
+"""
+Multi-process serving of the public API gateway:
+
+    gunicorn -c gunicorn.conf.py src.main:app
+
+Redis and HTTP connection pools are created per worker in the app's lifespan,
+after fork.
+"""
+import os
+
+
+def available_cpus() -> int:
+    """CPUs this container may use: affinity mask, capped by the cgroup quota"""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max", "r", encoding="utf-8") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+bind = os.getenv("BIND", "0.0.0.0:8080")
+workers = int(os.getenv("WEB_CONCURRENCY") or os.getenv("WORKERS") or available_cpus())
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# SIGTERM: stop accepting, let in-flight requests (and their lifespan shutdown) finish
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+keepalive = 5
@@ -0,0 +1,155 @@
+"""
+Gateway -> AI service transport.
+
+When a gRPC target is configured, the operations the AI service serves over
+gRPC (ai/app/rpc.py) go over one pooled HTTP/2 channel per worker that
+multiplexes every concurrent call; other paths, and all paths without a
+target, use the pooled HTTP/JSON client. Either way callers get an AIResult
+that reads like the httpx response the endpoints already handle.
+"""
+from typing import Any, AsyncIterator, Dict, Optional
+
+import grpc
+import httpx
+
+from platform_common.codec import dumps, loads
+
+SERVICE = "ai.AIService"
+GRPC_METHODS = {
+    "/chat": "Chat",
+    "/summarize": "Summarize",
+    "/extract": "Extract",
+    "/classify": "Classify",
+    "/generate": "Generate"
+}
+GRPC_STREAMS = {"/chat/stream": "ChatStream"}
+
+# HTTP status of gRPC failures that carry no x-http-status trailer (raised by gRPC itself):
+# RESOURCE_EXHAUSTED is the server's concurrency cap; UNAVAILABLE an unreachable server
+HTTP_STATUS = {
+    grpc.StatusCode.RESOURCE_EXHAUSTED: 503,
+    grpc.StatusCode.UNAVAILABLE: 502,
+    grpc.StatusCode.DEADLINE_EXCEEDED: 504,
+    grpc.StatusCode.INVALID_ARGUMENT: 422,
+    grpc.StatusCode.NOT_FOUND: 404,
+    grpc.StatusCode.PERMISSION_DENIED: 403
+}
+
+
+class AIResult:
+    """Status, body and headers of an AI service call"""
+
+    def __init__(self, status_code: int, content: bytes, headers: Optional[httpx.Headers] = None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers if headers is not None else httpx.Headers()
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", "replace")
+
+    def json(self) -> Any:
+        return loads(self.content)
+
+
+class AIServiceError(Exception):
+    """A streamed call was refused or failed"""
+
+    def __init__(self, result: AIResult):
+        super().__init__(f"AI service error: {result.status_code}")
+        self.result = result
+
+
+def _metadata(headers: Dict[str, str]):
+    # The deadline travels as the gRPC deadline (the call timeout)
+    return tuple((name.lower(), value) for name, value in headers.items() if name.lower() != "x-request-deadline")
+
+
+def _error_result(error: grpc.aio.AioRpcError) -> AIResult:
+    trailers = dict(tuple(error.trailing_metadata() or ()))
+    status_code = int(trailers.get("x-http-status") or HTTP_STATUS.get(error.code(), 502))
+    headers = httpx.Headers()
+    if "retry-after" in trailers:
+        headers["Retry-After"] = trailers["retry-after"]
+    elif status_code in (503, 504):
+        headers["Retry-After"] = "1"
+    return AIResult(status_code, dumps({"detail": error.details() or error.code().name}), headers)
+
+
+class AITransport:
+    """Pooled connections to the AI service: a gRPC channel when a target is given, HTTP always"""
+
+    def __init__(self, http: httpx.AsyncClient, grpc_target: Optional[str] = None, max_message_bytes: int = 32 * 1024 * 1024):
+        self.http = http
+        self.channel: Optional[grpc.aio.Channel] = None
+        if grpc_target:
+            self.channel = grpc.aio.insecure_channel(grpc_target, options=[
+                ("grpc.keepalive_time_ms", 30000),
+                ("grpc.keepalive_permit_without_calls", 1),
+                ("grpc.max_receive_message_length", max_message_bytes),
+                ("grpc.max_send_message_length", max_message_bytes)
+            ])
+        self.metrics = {"grpc_calls": 0, "http_calls": 0}
+        self._unary: Dict[str, Any] = {}
+        self._streams: Dict[str, Any] = {}
+
+    async def close(self):
+        if self.channel is not None:
+            await self.channel.close()
+
+    async def post(self, path: str, payload: Dict[str, Any], headers: Dict[str, str], timeout: float) -> AIResult:
+        """Call an operation and return its result (errors included, as statuses)"""
+        method = GRPC_METHODS.get(path)
+        if self.channel is None or method is None:
+            self.metrics["http_calls"] += 1
+            response = await self.http.post(
+                path,
+                content=dumps(payload),
+                headers={**headers, "Content-Type": "application/json"},
+                timeout=timeout
+            )
+            return AIResult(response.status_code, response.content, response.headers)
+
+        self.metrics["grpc_calls"] += 1
+        call = self._unary.get(method)
+        if call is None:
+            call = self._unary[method] = self.channel.unary_unary(f"/{SERVICE}/{method}")
+        try:
+            return AIResult(200, await call(dumps(payload), timeout=timeout, metadata=_metadata(headers)))
+        except grpc.aio.AioRpcError as e:
+            return _error_result(e)
+
+    async def stream(self, path: str, payload: Dict[str, Any], headers: Dict[str, str], timeout: float) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Events of a streamed operation: {"delta": text} and, over gRPC, a final
+        {"usage": {...}}. Raises AIServiceError when the call is refused or fails.
+        """
+        method = GRPC_STREAMS.get(path)
+        if self.channel is None or method is None:
+            self.metrics["http_calls"] += 1
+            async with self.http.stream(
+                "POST",
+                path,
+                content=dumps(payload),
+                headers={**headers, "Content-Type": "application/json"},
+                timeout=timeout
+            ) as response:
+                if response.status_code != 200:
+                    raise AIServiceError(AIResult(response.status_code, await response.aread(), response.headers))
+                async for chunk in response.aiter_text():
+                    yield {"delta": chunk}
+            return
+
+        self.metrics["grpc_calls"] += 1
+        multicallable = self._streams.get(method)
+        if multicallable is None:
+            multicallable = self._streams[method] = self.channel.unary_stream(f"/{SERVICE}/{method}")
+        call = multicallable(dumps(payload), timeout=timeout, metadata=_metadata(headers))
+        try:
+            async for message in call:
+                yield loads(message)
+        except grpc.aio.AioRpcError as e:
+            raise AIServiceError(_error_result(e))
+        finally:
+            # The consumer stopped early (cancelled stream, client gone): free the server side
+            call.cancel()
@@ -1,16 +1,27 @@
-from fastapi import FastAPI, HTTPException, Depends, Request, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request, BackgroundTasks, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+import hashlib
 import httpx
-import json
 import time
 import uuid
 import asyncio
-from typing import Dict, Any, List, Optional, AsyncGenerator
+import os
+import weakref
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional, AsyncGenerator, Tuple
 from datetime import datetime, timedelta
 import redis.asyncio as redis
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
+from platform_common.codec import CompressionMiddleware, FastJSONResponse, dumps, dumps_str, loads
+from platform_common.diagnostics import CaptureInProgress, Diagnostics, ProfilingMiddleware
+from platform_common.token_quota import (
+    RECONCILE_TOKENS_LUA, RESERVE_TOKENS_LUA, quota_keys, save_reservation, settle_reservation
+)
+
+from .ai_transport import AIServiceError, AITransport
 
 # Models
 class APIKeyAuth(BaseModel):
@@ -21,7 +32,14 @@ class ChatMessage(BaseModel):
     content: str = Field(..., description="Message content")
 
 class ChatRequest(BaseModel):
-    messages: List[ChatMessage] = Field(..., description="Conversation messages")
+    messages: List[ChatMessage] = Field(
+        ...,
+        description="Conversation messages, or only the new messages of the turn when session_id is set"
+    )
+    session_id: Optional[str] = Field(
+        default=None,
+        description="Continue a server-side conversation session; its history is kept by the platform"
+    )
     model: str = Field(default="gpt-3.5-turbo", description="AI model to use")
     temperature: float = Field(default=0.7, ge=0, le=2, description="Response creativity")
     max_tokens: int = Field(default=1000, ge=1, le=4000, description="Maximum response length")
@@ -33,6 +51,12 @@ class AgentWorkflowRequest(BaseModel):
     input_data: Dict[str, Any] = Field(default={}, description="Input data for workflow")
     company_id: str = Field(..., description="Your company ID")
 
+class JobSubmitRequest(BaseModel):
+    operation: str = Field(..., description="Operation to run: summarize, extract or generate")
+    payload: Dict[str, Any] = Field(..., description="Operation input, e.g. {\"text\": ..., \"model\": ...}")
+    webhook_url: Optional[str] = Field(default=None, description="URL notified with the result when the job finishes")
+    company_id: str = Field(..., description="Your company ID")
+
 class APIResponse(BaseModel):
     success: bool
     data: Dict[str, Any]
@@ -43,8 +67,36 @@ class APIResponse(BaseModel):
 REDIS_URL = "redis://redis:6379"
 INTERNAL_API_BASE = "http://company:3000"
 AI_SERVICE_URL = "http://ai-service:8000"
+# Internal gRPC endpoint of the AI service (host:port); unset keeps every call on HTTP/JSON
+AI_SERVICE_GRPC_TARGET = os.getenv("AI_SERVICE_GRPC_TARGET")
+RESPONSE_COMPRESSION_MIN_SIZE = 1024
+# Request profiling (X-Profile header) and the /debug endpoints need this token
+DIAGNOSTICS_TOKEN = os.getenv("DIAGNOSTICS_TOKEN")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create connection pools in each worker process (after fork) and close them on shutdown"""
+    global redis_client, ai_client, ai_transport, company_client, reserve_tokens_script, reconcile_tokens_script
+    global release_idempotency_script, save_idempotency_script
+    redis_client = redis.from_url(REDIS_URL)
+    reserve_tokens_script = redis_client.register_script(RESERVE_TOKENS_LUA)
+    reconcile_tokens_script = redis_client.register_script(RECONCILE_TOKENS_LUA)
+    release_idempotency_script = redis_client.register_script(RELEASE_IDEMPOTENCY_LUA)
+    save_idempotency_script = redis_client.register_script(SAVE_IDEMPOTENCY_LUA)
+    ai_client = httpx.AsyncClient(base_url=AI_SERVICE_URL, timeout=30.0)
+    ai_transport = AITransport(ai_client, AI_SERVICE_GRPC_TARGET)
+    company_client = httpx.AsyncClient(base_url=INTERNAL_API_BASE, timeout=10.0)
+    diagnostics.start()
+    yield
+    await diagnostics.stop()
+    await ai_transport.close()
+    await ai_client.aclose()
+    await company_client.aclose()
+    await redis_client.close()
 
 app = FastAPI(
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
     title="AI Agent Platform - Public API",
     description="""
     # AI Agent Platform - Public API
@@ -90,18 +142,99 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware, minimum_size=RESPONSE_COMPRESSION_MIN_SIZE)
 
-# Services
-redis_client = redis.from_url(REDIS_URL)
+# Loop monitor and on-demand profiling of this worker
+diagnostics = Diagnostics(DIAGNOSTICS_TOKEN)
+app.add_middleware(ProfilingMiddleware, diagnostics=diagnostics)
+
+# Services (connection pools are created per worker process in lifespan)
+redis_client: Optional[redis.Redis] = None
 security = HTTPBearer()
+# Pooled keep-alive connections to the AI service, and the gRPC channel next to them
+ai_client: Optional[httpx.AsyncClient] = None
+ai_transport: Optional[AITransport] = None
+
+# Pooled keep-alive connections to the company service
+company_client: Optional[httpx.AsyncClient] = None
+reserve_tokens_script = None
+reconcile_tokens_script = None
+release_idempotency_script = None
+save_idempotency_script = None
+
+# Longest a job status request may wait for completion (below the AI client timeout)
+JOB_MAX_WAIT_SECONDS = 25.0
+
+# End-to-end time budget per route, sent downstream as X-Request-Deadline (epoch seconds)
+REQUEST_BUDGETS = {
+    "chat": 30.0,
+    "chat_stream": 120.0,
+    "workflow": 60.0,
+    "jobs": 10.0
+}
+# Downstream statuses that mean "shed, retry later" and are passed on to the client
+SHED_STATUSES = (429, 503, 504)
+
+# WebSocket chat channel: concurrent streams per connection and outgoing frames
+# buffered before a slow reader pauses its streams
+CHAT_WS_MAX_STREAMS = 8
+CHAT_WS_SEND_BUFFER = 64
+# Replies to client frames (pong, errors, cancelled) queued ahead of stream frames
+CHAT_WS_CONTROL_BUFFER = 64
+
+# Workflow execution status caching and push
+WORKFLOW_FINAL_STATUSES = ("completed", "failed", "cancelled")
+WORKFLOW_STATUS_REFRESH_SECONDS = 1.0
+WORKFLOW_STATUS_FINAL_TTL = 24 * 60 * 60
+WORKFLOW_STATUS_STREAM_SECONDS = 15 * 60
+
+# Idempotency-Key: lifetime of stored responses, lock lifetime and how long duplicates wait.
+# The lock outlives the longest request budget, so it cannot expire under a running request.
+IDEMPOTENCY_TTL = 24 * 60 * 60
+IDEMPOTENCY_LOCK_SECONDS = int(max(REQUEST_BUDGETS.values())) + 60
+IDEMPOTENCY_WAIT_SECONDS = 60.0
+
+# Validated API keys, cached briefly so polling clients do not re-validate every request
+# (least recently used keys beyond the cap are dropped). Nothing invalidates an entry:
+# a revoked, deleted or regenerated key keeps working in each gateway worker for up
+# to API_KEY_CACHE_TTL seconds after the change.
+API_KEY_CACHE_TTL = 10.0
+API_KEY_CACHE_SIZE = 10000
+_api_key_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
 
 # Rate limiting configuration
 RATE_LIMITS = {
-    "free": {"requests_per_minute": 10, "requests_per_month": 1000},
-    "pro": {"requests_per_minute": 100, "requests_per_month": 100000},
-    "enterprise": {"requests_per_minute": 1000, "requests_per_month": 1000000}
+    "free": {
+        "requests_per_minute": 10, "requests_per_month": 1000,
+        "tokens_per_minute": 20000, "tokens_per_month": 1000000
+    },
+    "pro": {
+        "requests_per_minute": 100, "requests_per_month": 100000,
+        "tokens_per_minute": 200000, "tokens_per_month": 50000000
+    },
+    "enterprise": {
+        "requests_per_minute": 1000, "requests_per_month": 1000000,
+        "tokens_per_minute": 2000000, "tokens_per_month": 1000000000
+    }
 }
 
+# Idempotency lock release and response save, only by the request holding the lock.
+# KEYS: idempotency key; ARGV[1]: the holder's lock value (unique per request)
+RELEASE_IDEMPOTENCY_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+# ARGV[2]: stored response record, ARGV[3]: its TTL
+SAVE_IDEMPOTENCY_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
 async def get_api_key_info(api_key: str) -> Dict[str, Any]:
     """Validate API key and get company info"""
     
@@ -126,15 +259,22 @@ async def get_api_key_info(api_key: str) -> Dict[str, Any]:
         }
     
     # Production mode - validate with company service
+    cached = _api_key_cache.get(api_key)
+    if cached:
+        if cached[0] > time.monotonic():
+            _api_key_cache.move_to_end(api_key)
+            return cached[1]
+        del _api_key_cache[api_key]
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{INTERNAL_API_BASE}/api-keys/validate",
-                json={"api_key": api_key}
-            )
-            if response.status_code == 200:
-                return response.json()
-            raise HTTPException(status_code=401, detail="Invalid API key")
+        response = await company_client.post("/api-keys/validate", json={"api_key": api_key})
+        if response.status_code == 200:
+            info = response.json()
+            _api_key_cache[api_key] = (time.monotonic() + API_KEY_CACHE_TTL, info)
+            _api_key_cache.move_to_end(api_key)
+            while len(_api_key_cache) > API_KEY_CACHE_SIZE:
+                _api_key_cache.popitem(last=False)
+            return info
+        raise HTTPException(status_code=401, detail="Invalid API key")
     except Exception as e:
         # For testing, if company service is not available, use test mode
         if "test" in api_key.lower():
@@ -175,6 +315,52 @@ async def check_rate_limit(company_id: str, plan: str) -> bool:
     
     return True
 
+class TokenReservation:
+    """Tokens reserved at admission, reconciled once actual usage is known"""
+    
+    def __init__(self, keys: List[str], tokens: int):
+        self.keys = keys
+        self.tokens = tokens
+    
+    async def reconcile(self, actual_tokens: int):
+        """Refund or charge the difference between actual usage and the reservation"""
+        delta = int(actual_tokens) - self.tokens
+        if delta and self.keys:
+            await reconcile_tokens_script(keys=self.keys, args=[delta])
+        self.tokens += delta
+
+def estimate_chat_tokens(request: ChatRequest) -> int:
+    """Upper-bound estimate of a chat call: prompt size (~4 characters per token) plus max_tokens"""
+    prompt_tokens = sum(len(msg.content) // 4 + 4 for msg in request.messages) + 3
+    return prompt_tokens + request.max_tokens
+
+def estimate_job_tokens(request: JobSubmitRequest) -> int:
+    """Estimate of a job: its input size plus the requested or default output budget"""
+    payload = request.payload
+    input_chars = sum(len(value) for value in payload.values() if isinstance(value, str))
+    return input_chars // 4 + int(payload.get("max_tokens") or payload.get("max_length") or 1000)
+
+async def reserve_tokens(company_id: str, plan: str, tokens: int) -> TokenReservation:
+    """Reserve estimated tokens against the per-minute and monthly token quotas, or raise 429"""
+    now = datetime.now()
+    keys = quota_keys(company_id, now)
+    # Estimates come from client-supplied sizes; a negative one would refund quota
+    tokens = max(int(tokens), 0)
+    limits = RATE_LIMITS.get(plan, RATE_LIMITS["free"])
+    result = await reserve_tokens_script(
+        keys=keys,
+        args=[tokens, limits["tokens_per_minute"], limits["tokens_per_month"], 60, 60 * 60 * 24 * 31]
+    )
+    if result == 1:
+        raise HTTPException(
+            status_code=429,
+            detail="Token rate limit exceeded",
+            headers={"Retry-After": str(60 - now.second)}
+        )
+    if result == 2:
+        raise HTTPException(status_code=429, detail="Monthly token quota exceeded")
+    return TokenReservation(keys, tokens)
+
 async def track_usage(company_id: str, endpoint: str, tokens_used: int, model: str):
     """Track API usage for billing"""
     usage_data = {
@@ -185,9 +371,160 @@ async def track_usage(company_id: str, endpoint: str, tokens_used: int, model: s
         "timestamp": datetime.now().isoformat()
     }
     
-    await redis_client.lpush("usage_tracking", json.dumps(usage_data))
+    await redis_client.lpush("usage_tracking", dumps(usage_data))
     await redis_client.ltrim("usage_tracking", 0, 9999)  # Keep last 10k records
 
+def _ai_headers(company_info: Dict[str, Any], priority: str = "interactive", deadline: Optional[float] = None) -> Dict[str, str]:
+    """Tenant and deadline headers the AI service schedules provider capacity by"""
+    headers = {
+        "X-Tenant-Id": company_info["company_id"],
+        "X-Tenant-Plan": company_info.get("plan", "free"),
+        "X-Request-Priority": priority
+    }
+    if deadline is not None:
+        headers["X-Request-Deadline"] = f"{deadline:.3f}"
+    return headers
+
+def _remaining(deadline: float) -> float:
+    """Seconds left of a request's budget, used as the downstream timeout"""
+    return max(deadline - time.time(), 0.001)
+
+def _error_detail(response: httpx.Response, default: str) -> Any:
+    """`detail` of a downstream error body, which may not be JSON (proxy pages, truncated bodies)"""
+    try:
+        body = response.json()
+    except ValueError:
+        return default
+    return body.get("detail", default) if isinstance(body, dict) else default
+
+def _shed_exception(response: httpx.Response) -> HTTPException:
+    """Pass a downstream overload response on to the client with its Retry-After"""
+    retry_after = response.headers.get("Retry-After", "1")
+    detail = _error_detail(response, "Service overloaded")
+    return HTTPException(status_code=response.status_code, detail=detail, headers={"Retry-After": retry_after})
+
+def _build_ai_chat_request(request: ChatRequest) -> Dict[str, Any]:
+    """Build the internal AI service chat payload (only the turn's delta for sessions)"""
+    ai_request = {
+        "messages": [{"role": msg.role, "content": msg.content} for msg in request.messages],
+        "model": request.model,
+        "temperature": request.temperature,
+        "max_tokens": request.max_tokens
+    }
+    if request.session_id:
+        ai_request["session_id"] = request.session_id
+        ai_request["company_id"] = request.company_id
+    return ai_request
+
+def _api_response(data: Dict[str, Any], usage: Dict[str, Any]) -> FastJSONResponse:
+    """APIResponse body rendered directly, without building and re-validating the model"""
+    return FastJSONResponse({
+        "success": True,
+        "data": data,
+        "usage": usage,
+        "timestamp": datetime.now().isoformat()
+    })
+
+class IdempotentRequest:
+    """
+    Idempotency-Key handling of one request.
+    
+    The first request with a key takes a Redis lock on (company, key) holding the
+    request body digest and a random token; once it finishes its response is
+    stored under the same key for IDEMPOTENCY_TTL and replayed to later
+    duplicates. Duplicates that arrive while it is running wait for the stored
+    response. Failed requests release the key so the client's retry runs again.
+    Saving and releasing only touch the key while it still holds this request's
+    lock, so a request that outlived its lock cannot drop or overwrite another's.
+    """
+    
+    def __init__(self, key: Optional[str] = None, digest: str = "", lock: bytes = b""):
+        self.key = key
+        self.digest = digest
+        self.lock = lock
+        self.replay: Optional[Any] = None
+    
+    async def store(self, response: FastJSONResponse) -> FastJSONResponse:
+        """Keep a complete response for replay"""
+        if self.key:
+            await self._save({"status_code": response.status_code, "body": response.body.decode("utf-8")})
+        return response
+    
+    async def record_stream(self, stream: AsyncGenerator[str, None]) -> AsyncGenerator[str, None]:
+        """Pass a streamed response through, keeping its chunks for replay if it completes"""
+        chunks: List[str] = []
+        try:
+            async for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            if chunks and chunks[-1] == "data: [DONE]\n\n":
+                await self._save({"status_code": 200, "chunks": chunks})
+            else:
+                await self.release()
+    
+    async def release(self):
+        """Drop the lock of a failed request"""
+        if self.key:
+            await release_idempotency_script(keys=[self.key], args=[self.lock])
+            self.key = None
+    
+    async def _save(self, record: Dict[str, Any]):
+        record.update({"state": "done", "digest": self.digest})
+        await save_idempotency_script(keys=[self.key], args=[self.lock, dumps(record), IDEMPOTENCY_TTL])
+        self.key = None
+
+async def begin_idempotent_request(http_request: Request, company_id: str, payload: BaseModel) -> IdempotentRequest:
+    """
+    Claim the request's Idempotency-Key, or prepare the replay of an earlier
+    request with the same key (`replay` is then set).
+    """
+    idempotency_key = http_request.headers.get("Idempotency-Key")
+    if not idempotency_key:
+        return IdempotentRequest()
+    if len(idempotency_key) > 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key must be at most 255 characters")
+    
+    key = f"idempotency:{company_id}:{idempotency_key}"
+    digest = hashlib.sha256(http_request.url.path.encode() + b"\0" + dumps(payload.model_dump())).hexdigest()
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    interval = 0.05
+    lock = dumps({"state": "pending", "digest": digest, "token": uuid.uuid4().hex})
+    while True:
+        if await redis_client.set(key, lock, nx=True, ex=IDEMPOTENCY_LOCK_SECONDS):
+            return IdempotentRequest(key, digest, lock)
+        
+        stored = await redis_client.get(key)
+        if stored is None:
+            # Released or expired in between; try to claim it again
+            continue
+        record = loads(stored)
+        if record["digest"] != digest:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+        if record["state"] == "done":
+            idempotent = IdempotentRequest()
+            idempotent.replay = _replay_response(record)
+            return idempotent
+        if time.monotonic() >= deadline:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+        await asyncio.sleep(interval)
+        interval = min(interval * 2, 1.0)
+
+def _replay_response(record: Dict[str, Any]):
+    headers = {"Idempotent-Replayed": "true"}
+    if "chunks" in record:
+        async def replay_stream() -> AsyncGenerator[str, None]:
+            for chunk in record["chunks"]:
+                yield chunk
+        headers.update({"Cache-Control": "no-cache", "Content-Type": "text/event-stream"})
+        return StreamingResponse(replay_stream(), media_type="text/event-stream", headers=headers)
+    return Response(
+        content=record["body"],
+        status_code=record["status_code"],
+        media_type="application/json",
+        headers=headers
+    )
+
 async def authenticate_request(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict[str, Any]:
     """Authenticate API key and return company info"""
     api_key = credentials.credentials
@@ -201,6 +538,7 @@ async def health_check():
 @app.post("/v1/chat/completions", response_model=APIResponse)
 async def chat_completions(
     request: ChatRequest,
+    http_request: Request,
     background_tasks: BackgroundTasks,
     company_info: Dict[str, Any] = Depends(authenticate_request)
 ):
@@ -208,156 +546,208 @@ async def chat_completions(
     Chat completions API - OpenAI compatible endpoint
     
     Send messages to AI models and get intelligent responses.
-    Supports streaming for real-time conversations.
+    Supports streaming for real-time conversations. Retries carrying the same
+    `Idempotency-Key` header get the first response replayed.
     """
+    deadline = time.time() + REQUEST_BUDGETS["chat"]
     
     # Validate company access
     if company_info["company_id"] != request.company_id:
         raise HTTPException(status_code=403, detail="Company ID mismatch")
     
+    # Replayed duplicates neither call the AI service nor count against rate limits
+    idempotency = await begin_idempotent_request(http_request, request.company_id, request)
+    if idempotency.replay is not None:
+        return idempotency.replay
+    
     # Check rate limits
     if not await check_rate_limit(request.company_id, company_info["plan"]):
+        await idempotency.release()
         raise HTTPException(status_code=429, detail="Rate limit exceeded")
+    try:
+        reservation = await reserve_tokens(request.company_id, company_info["plan"], estimate_chat_tokens(request))
+    except HTTPException:
+        await idempotency.release()
+        raise
     
     # Prepare request for internal AI service
-    ai_request = {
-        "messages": [{"role": msg.role, "content": msg.content} for msg in request.messages],
-        "model": request.model,
-        "temperature": request.temperature,
-        "max_tokens": request.max_tokens
-    }
+    ai_request = _build_ai_chat_request(request)
     
+    degraded = False
     try:
         # Test mode - mock AI response
         if request.company_id == "test-company-123":
             ai_response = {
                 "message": "Hello! I'm a test AI assistant. This is a mock response for testing purposes.",
-                "tokens_used": 25
+                "tokens_used": 25,
+                "prompt_tokens": 5,
+                "completion_tokens": 20
             }
         else:
             # Production mode - call AI service
             try:
-                async with httpx.AsyncClient() as client:
-                    response = await client.post(
-                        f"{AI_SERVICE_URL}/chat",
-                        json=ai_request,
-                        timeout=30.0
-                    )
-                    
-                    if response.status_code == 200:
-                        ai_response = response.json()
-                    else:
-                        # Fallback to mock response if AI service fails
-                        print(f"AI service error: {response.status_code} - {response.text}")
-                        ai_response = {
-                            "message": f"I'm sorry, but I'm currently experiencing technical difficulties. Please try again later. (Error: {response.status_code})",
-                            "tokens_used": 50
-                        }
+                response = await ai_transport.post(
+                    "/chat",
+                    ai_request,
+                    headers=_ai_headers(company_info, deadline=deadline),
+                    timeout=_remaining(deadline)
+                )
+                
+                if response.status_code == 200:
+                    ai_response = response.json()
+                elif response.status_code in SHED_STATUSES:
+                    # Overloaded or out of time: let the client back off instead of faking an answer
+                    raise _shed_exception(response)
+                else:
+                    # Fallback to mock response if AI service fails
+                    print(f"AI service error: {response.status_code} - {response.text}")
+                    degraded = True
+                    ai_response = {
+                        "message": f"I'm sorry, but I'm currently experiencing technical difficulties. Please try again later. (Error: {response.status_code})",
+                        "tokens_used": 50
+                    }
+            except HTTPException:
+                raise
             except Exception as e:
                 # Fallback to mock response if AI service is unreachable
                 print(f"AI service connection error: {str(e)}")
+                degraded = True
                 ai_response = {
                     "message": "I'm sorry, but I'm currently experiencing technical difficulties. Please try again later. (Connection Error)",
                     "tokens_used": 50
                 }
         
+        # Settle the reservation on actual usage; fallback answers are not charged
+        tokens_used = 0 if degraded else ai_response.get("tokens_used", 0)
+        await reservation.reconcile(tokens_used)
+        
         # Track usage
         background_tasks.add_task(
             track_usage,
             request.company_id,
             "chat_completions",
-            ai_response.get("tokens_used", 0),
+            tokens_used,
             request.model
         )
         
-        return APIResponse(
-                success=True,
-                data={
-                    "id": str(uuid.uuid4()),
-                    "object": "chat.completion",
-                    "created": int(time.time()),
-                    "model": request.model,
-                    "choices": [{
-                        "index": 0,
-                        "message": {
-                            "role": "assistant",
-                            "content": ai_response["message"]
-                        },
-                        "finish_reason": "stop"
-                    }],
-                    "usage": {
-                        "prompt_tokens": ai_response.get("tokens_used", 0),
-                        "completion_tokens": ai_response.get("tokens_used", 0),
-                        "total_tokens": ai_response.get("tokens_used", 0)
-                    }
-                },
-                usage={
-                    "tokens_used": ai_response.get("tokens_used", 0),
-                    "model": request.model,
-                    "endpoint": "chat_completions"
-                },
-                timestamp=datetime.now()
-            )
+        api_response = _api_response(
+            data={
+                "id": str(uuid.uuid4()),
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.model,
+                "session_id": request.session_id,
+                "choices": [{
+                    "index": 0,
+                    "message": {
+                        "role": "assistant",
+                        "content": ai_response["message"]
+                    },
+                    "finish_reason": "stop"
+                }],
+                "usage": {
+                    "prompt_tokens": ai_response.get("prompt_tokens", 0),
+                    "completion_tokens": ai_response.get("completion_tokens", 0),
+                    "total_tokens": tokens_used
+                }
+            },
+            usage={
+                "tokens_used": tokens_used,
+                "model": request.model,
+                "endpoint": "chat_completions"
+            },
+        )
+        if degraded:
+            # Fallback answers are not worth replaying; let the retry reach the AI service
+            await idempotency.release()
+            return api_response
+        return await idempotency.store(api_response)
             
+    except HTTPException:
+        await reservation.reconcile(0)
+        await idempotency.release()
+        raise
     except Exception as e:
+        await reservation.reconcile(0)
+        await idempotency.release()
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/v1/chat/completions/stream")
 async def chat_completions_stream(
     request: ChatRequest,
+    http_request: Request,
     background_tasks: BackgroundTasks,
     company_info: Dict[str, Any] = Depends(authenticate_request)
 ):
     """
     Streaming chat completions API
     
-    Get real-time streaming responses from AI models.
+    Get real-time streaming responses from AI models. A completed stream is
+    replayed to retries carrying the same `Idempotency-Key` header.
     """
+    deadline = time.time() + REQUEST_BUDGETS["chat_stream"]
     
     # Validate company access
     if company_info["company_id"] != request.company_id:
         raise HTTPException(status_code=403, detail="Company ID mismatch")
     
+    idempotency = await begin_idempotent_request(http_request, request.company_id, request)
+    if idempotency.replay is not None:
+        return idempotency.replay
+    
     # Check rate limits
     if not await check_rate_limit(request.company_id, company_info["plan"]):
+        await idempotency.release()
         raise HTTPException(status_code=429, detail="Rate limit exceeded")
+    estimate = estimate_chat_tokens(request)
+    try:
+        reservation = await reserve_tokens(request.company_id, company_info["plan"], estimate)
+    except HTTPException:
+        await idempotency.release()
+        raise
     
     async def generate_stream() -> AsyncGenerator[str, None]:
         """Generate streaming response"""
+        # Streams over gRPC end with their usage; otherwise charge the prompt plus the streamed text (~4 characters per token)
+        streamed_chars = 0
+        usage: Optional[Dict[str, Any]] = None
         try:
             # Test mode - mock streaming response
             if request.company_id == "test-company-123":
                 mock_response = "Hello! I'm a test AI assistant. This is a streaming response for testing purposes."
                 words = mock_response.split()
                 for word in words:
+                    streamed_chars += len(word) + 1
                     yield f"data: {{\"choices\": [{{\"delta\": {{\"content\": \"{word} \"}}}}]}}\n\n"
                     await asyncio.sleep(0.1)  # Simulate streaming delay
                 yield "data: [DONE]\n\n"
             else:
                 # Production mode - call AI service
-                async with httpx.AsyncClient() as client:
-                    async with client.stream(
-                        "POST",
-                        f"{AI_SERVICE_URL}/chat/stream",
-                        json={
-                            "messages": [{"role": msg.role, "content": msg.content} for msg in request.messages],
-                            "model": request.model,
-                            "temperature": request.temperature,
-                            "max_tokens": request.max_tokens
-                        },
-                        timeout=30.0
-                    ) as response:
-                        async for chunk in response.aiter_text():
-                            yield f"data: {chunk}\n\n"
-                        
-                        # Send completion signal
-                        yield "data: [DONE]\n\n"
+                async for event in ai_transport.stream(
+                    "/chat/stream",
+                    _build_ai_chat_request(request),
+                    headers=_ai_headers(company_info, deadline=deadline),
+                    timeout=_remaining(deadline)
+                ):
+                    if "usage" in event:
+                        usage = event["usage"]
+                        continue
+                    streamed_chars += len(event["delta"])
+                    yield f"data: {event['delta']}\n\n"
+                
+                # Send completion signal
+                yield "data: [DONE]\n\n"
                     
         except Exception as e:
             yield f"data: {{\"error\": \"{str(e)}\"}}\n\n"
+        finally:
+            if usage is not None:
+                await reservation.reconcile(usage["total_tokens"])
+            else:
+                await reservation.reconcile(estimate - request.max_tokens + streamed_chars // 4)
     
     return StreamingResponse(
-        generate_stream(),
+        idempotency.record_stream(generate_stream()),
         media_type="text/plain",
         headers={
             "Cache-Control": "no-cache",
@@ -366,24 +756,289 @@ async def chat_completions_stream(
         }
     )
 
+class SlowReader(Exception):
+    """A WebSocket client stopped reading its frames"""
+
+class ChatChannel:
+    """
+    One authenticated WebSocket carrying many chat turns.
+    
+    Client frames are JSON objects: {"type": "chat", "id": ..., <chat completion
+    fields>}, {"type": "cancel", "id": ...} and {"type": "ping"}. Turns run
+    concurrently and answer with "delta" frames followed by "done" (or "error"),
+    tagged with the turn's id; a cancelled turn answers "cancelled" and sends
+    nothing after it. Each turn is rate limited and charged like a
+    /v1/chat/completions call. Stream frames pass through a bounded queue
+    drained by one writer, so a client that reads slowly pauses its streams
+    (and their upstream reads) instead of having them buffered in the gateway.
+    Replies to the client's own frames (pong, errors, cancelled) never wait for
+    that queue: they go first, from a separate queue of CHAT_WS_CONTROL_BUFFER
+    frames, so cancels are handled however far behind the streams are; a
+    client that lets even that queue fill up is disconnected.
+    """
+    
+    def __init__(self, websocket: WebSocket, company_info: Dict[str, Any]):
+        self.websocket = websocket
+        self.company_info = company_info
+        self.streams: Dict[str, asyncio.Task] = {}
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=CHAT_WS_SEND_BUFFER)
+        self.control: deque = deque()
+        self._cancelled: weakref.WeakSet = weakref.WeakSet()
+        self._wakeup = asyncio.Event()
+    
+    async def send(self, frame: Dict[str, Any]):
+        """Queue a stream frame, waiting while the client is CHAT_WS_SEND_BUFFER frames behind"""
+        await self.outbox.put((asyncio.current_task(), frame))
+        self._wakeup.set()
+    
+    def send_control(self, frame: Dict[str, Any]):
+        """Queue a reply to a client frame without waiting; raises SlowReader when the client is too far behind"""
+        if len(self.control) >= CHAT_WS_CONTROL_BUFFER:
+            raise SlowReader()
+        self.control.append(frame)
+        self._wakeup.set()
+    
+    async def _write(self):
+        while True:
+            if self.control:
+                frame = self.control.popleft()
+            elif not self.outbox.empty():
+                owner, frame = self.outbox.get_nowait()
+                if owner in self._cancelled:
+                    # Buffered before its stream was cancelled
+                    continue
+            else:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            await self.websocket.send_text(dumps_str(frame))
+    
+    async def run(self):
+        """Serve the connection until the client disconnects"""
+        writer = asyncio.create_task(self._write())
+        slow_reader = False
+        try:
+            while True:
+                try:
+                    frame = loads(await self.websocket.receive_text())
+                except ValueError:
+                    frame = None
+                if not isinstance(frame, dict):
+                    self.send_control({"type": "error", "status": 400, "detail": "Frames must be JSON objects"})
+                    continue
+                
+                kind = frame.get("type")
+                if kind == "chat":
+                    self._start(frame)
+                elif kind == "cancel":
+                    self._cancel(str(frame.get("id")))
+                elif kind == "ping":
+                    self.send_control({"type": "pong"})
+                else:
+                    self.send_control({"type": "error", "status": 400, "detail": f"Unknown frame type: {kind}"})
+        except WebSocketDisconnect:
+            pass
+        except SlowReader:
+            slow_reader = True
+        finally:
+            streams = list(self.streams.values())
+            for task in streams:
+                task.cancel()
+            await asyncio.gather(*streams, return_exceptions=True)
+            writer.cancel()
+            await asyncio.gather(writer, return_exceptions=True)
+        if slow_reader:
+            try:
+                await asyncio.wait_for(self.websocket.close(code=1008, reason="Client is not reading its frames"), 1.0)
+            except Exception:
+                pass
+    
+    def _start(self, frame: Dict[str, Any]):
+        stream_id = str(frame.get("id") or uuid.uuid4())
+        if stream_id in self.streams:
+            self.send_control({"type": "error", "id": stream_id, "status": 409, "detail": "Stream id already in use"})
+            return
+        if len(self.streams) >= CHAT_WS_MAX_STREAMS:
+            self.send_control({
+                "type": "error", "id": stream_id, "status": 429,
+                "detail": f"At most {CHAT_WS_MAX_STREAMS} concurrent streams per connection"
+            })
+            return
+        task = asyncio.create_task(self._turn(stream_id, frame))
+        self.streams[stream_id] = task
+        task.add_done_callback(lambda _: self.streams.pop(stream_id, None) if self.streams.get(stream_id) is task else None)
+    
+    def _cancel(self, stream_id: str):
+        task = self.streams.pop(stream_id, None)
+        if task is None:
+            self.send_control({"type": "error", "id": stream_id, "status": 404, "detail": "No such stream"})
+            return
+        task.cancel()
+        self._cancelled.add(task)
+        self.send_control({"type": "cancelled", "id": stream_id})
+    
+    async def _turn(self, stream_id: str, frame: Dict[str, Any]):
+        """Run one chat turn; partial streams are charged for the text already sent"""
+        company_id = self.company_info["company_id"]
+        plan = self.company_info["plan"]
+        request: Optional[ChatRequest] = None
+        reservation: Optional[TokenReservation] = None
+        prompt_tokens = completion_tokens = 0
+        try:
+            # Only this turn's messages are validated; the connection fixes the company
+            request = ChatRequest.model_validate({**frame, "company_id": company_id})
+            if not await check_rate_limit(company_id, plan):
+                raise HTTPException(status_code=429, detail="Rate limit exceeded")
+            estimate = estimate_chat_tokens(request)
+            reservation = await reserve_tokens(company_id, plan, estimate)
+            
+            if request.stream:
+                prompt_tokens = estimate - request.max_tokens
+                streamed_chars = 0
+                async for event in self._stream_events(request):
+                    if "usage" in event:
+                        prompt_tokens = event["usage"]["prompt_tokens"]
+                        completion_tokens = event["usage"]["completion_tokens"]
+                        continue
+                    streamed_chars += len(event["delta"])
+                    completion_tokens = streamed_chars // 4
+                    await self.send({"type": "delta", "id": stream_id, "content": event["delta"]})
+            else:
+                ai_response = await self._complete(request)
+                prompt_tokens = ai_response.get("prompt_tokens", 0)
+                completion_tokens = ai_response.get("completion_tokens", ai_response.get("tokens_used", 0) - prompt_tokens)
+                await self.send({"type": "delta", "id": stream_id, "content": ai_response["message"]})
+            
+            await self.send({
+                "type": "done",
+                "id": stream_id,
+                "model": request.model,
+                "session_id": request.session_id,
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens
+                }
+            })
+        except ValidationError as e:
+            await self.send({"type": "error", "id": stream_id, "status": 422, "detail": e.errors(include_url=False)})
+        except HTTPException as e:
+            error = {"type": "error", "id": stream_id, "status": e.status_code, "detail": e.detail}
+            if e.headers and "Retry-After" in e.headers:
+                error["retry_after"] = e.headers["Retry-After"]
+            await self.send(error)
+        except Exception as e:
+            print(f"WebSocket chat error: {str(e)}")
+            await self.send({"type": "error", "id": stream_id, "status": 502, "detail": str(e)})
+        finally:
+            if reservation is not None:
+                tokens_used = prompt_tokens + completion_tokens
+                await reservation.reconcile(tokens_used)
+                await track_usage(company_id, "chat_websocket", tokens_used, request.model)
+    
+    async def _stream_events(self, request: ChatRequest) -> AsyncGenerator[Dict[str, Any], None]:
+        """Deltas of a streamed answer (and its usage, over gRPC) from the pooled AI service connection"""
+        # Test mode - mock streaming response
+        if request.company_id == "test-company-123":
+            for word in "Hello! I'm a test AI assistant. This is a streaming response for testing purposes.".split():
+                yield {"delta": f"{word} "}
+                await asyncio.sleep(0.1)  # Simulate streaming delay
+            return
+        
+        deadline = time.time() + REQUEST_BUDGETS["chat_stream"]
+        try:
+            async for event in ai_transport.stream(
+                "/chat/stream",
+                _build_ai_chat_request(request),
+                headers=_ai_headers(self.company_info, deadline=deadline),
+                timeout=_remaining(deadline)
+            ):
+                yield event
+        except AIServiceError as e:
+            if e.result.status_code in SHED_STATUSES:
+                raise _shed_exception(e.result)
+            raise HTTPException(status_code=502, detail=f"AI service error: {e.result.status_code}")
+    
+    async def _complete(self, request: ChatRequest) -> Dict[str, Any]:
+        """Complete answer of a non-streamed turn"""
+        # Test mode - mock AI response
+        if request.company_id == "test-company-123":
+            return {
+                "message": "Hello! I'm a test AI assistant. This is a mock response for testing purposes.",
+                "tokens_used": 25,
+                "prompt_tokens": 5,
+                "completion_tokens": 20
+            }
+        
+        deadline = time.time() + REQUEST_BUDGETS["chat"]
+        response = await ai_transport.post(
+            "/chat",
+            _build_ai_chat_request(request),
+            headers=_ai_headers(self.company_info, deadline=deadline),
+            timeout=_remaining(deadline)
+        )
+        if response.status_code in SHED_STATUSES:
+            raise _shed_exception(response)
+        if response.status_code != 200:
+            raise HTTPException(status_code=502, detail=f"AI service error: {response.status_code}")
+        return response.json()
+
+@app.websocket("/v1/chat/ws")
+async def chat_websocket(websocket: WebSocket):
+    """
+    Persistent chat channel
+    
+    Authenticates once (`Authorization: Bearer` header, or the `api_key` query
+    parameter for browsers, which cannot set headers) and then carries any
+    number of chat turns and concurrent streams; see ChatChannel for the frames.
+    """
+    authorization = websocket.headers.get("authorization", "")
+    api_key = authorization[7:].strip() if authorization.lower().startswith("bearer ") else websocket.query_params.get("api_key")
+    company_info = None
+    if api_key:
+        try:
+            company_info = await get_api_key_info(api_key)
+        except HTTPException:
+            pass
+    if company_info is None:
+        await websocket.close(code=1008, reason="Invalid API key")
+        return
+    
+    await websocket.accept()
+    await websocket.send_text(dumps_str({
+        "type": "ready",
+        "company_id": company_info["company_id"],
+        "max_streams": CHAT_WS_MAX_STREAMS
+    }))
+    await ChatChannel(websocket, company_info).run()
+
 @app.post("/v1/agents/workflows/execute", response_model=APIResponse)
 async def execute_agent_workflow(
     request: AgentWorkflowRequest,
+    http_request: Request,
     background_tasks: BackgroundTasks,
     company_info: Dict[str, Any] = Depends(authenticate_request)
 ):
     """
     Execute autonomous agent workflows
     
-    Trigger and monitor the execution of complex AI workflows.
+    Trigger and monitor the execution of complex AI workflows. Retries carrying
+    the same `Idempotency-Key` header get the first execution back instead of
+    starting another one.
     """
+    deadline = time.time() + REQUEST_BUDGETS["workflow"]
     
     # Validate company access
     if company_info["company_id"] != request.company_id:
         raise HTTPException(status_code=403, detail="Company ID mismatch")
     
+    idempotency = await begin_idempotent_request(http_request, request.company_id, request)
+    if idempotency.replay is not None:
+        return idempotency.replay
+    
     # Check rate limits
     if not await check_rate_limit(request.company_id, company_info["plan"]):
+        await idempotency.release()
         raise HTTPException(status_code=429, detail="Rate limit exceeded")
     
     try:
@@ -401,21 +1056,23 @@ async def execute_agent_workflow(
             }
         else:
             # Production mode - call company service
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{INTERNAL_API_BASE}/workflows/{request.workflow_id}/execute",
-                    json={
-                        "input_data": request.input_data,
-                        "company_id": request.company_id,
-                        "user_id": company_info["user_id"]
-                    },
-                    timeout=60.0
-                )
-                
-                if response.status_code != 200:
-                    raise HTTPException(status_code=500, detail="Workflow execution failed")
-                
-                workflow_response = response.json()
+            response = await company_client.post(
+                f"/workflows/{request.workflow_id}/execute",
+                json={
+                    "input_data": request.input_data,
+                    "company_id": request.company_id,
+                    "user_id": company_info["user_id"]
+                },
+                headers={"X-Request-Deadline": f"{deadline:.3f}"},
+                timeout=_remaining(deadline)
+            )
+            
+            if response.status_code in SHED_STATUSES:
+                raise _shed_exception(response)
+            if response.status_code != 200:
+                raise HTTPException(status_code=500, detail="Workflow execution failed")
+            
+            workflow_response = response.json()
         
         # Track usage
         background_tasks.add_task(
@@ -426,8 +1083,7 @@ async def execute_agent_workflow(
             "workflow"
         )
         
-        return APIResponse(
-            success=True,
+        return await idempotency.store(_api_response(
             data={
                 "execution_id": workflow_response["execution_id"],
                 "status": workflow_response["status"],
@@ -438,54 +1094,296 @@ async def execute_agent_workflow(
                 "tokens_used": 0,
                 "model": "workflow",
                 "endpoint": "workflow_execution"
-            },
-            timestamp=datetime.now()
-        )
+            }
+        ))
             
+    except HTTPException:
+        await idempotency.release()
+        raise
     except Exception as e:
+        await idempotency.release()
         raise HTTPException(status_code=500, detail=str(e))
 
+def _workflow_status_key(company_id: str, execution_id: str) -> str:
+    """Cache key (and pub/sub channel) of an execution's latest status"""
+    return f"workflow_status:{company_id}:{execution_id}"
+
+async def _cache_workflow_status(company_id: str, execution_id: str, status: Dict[str, Any]):
+    """Cache an execution status and publish it to waiters if it changed"""
+    key = _workflow_status_key(company_id, execution_id)
+    payload = dumps(status)
+    final = status.get("status") in WORKFLOW_FINAL_STATUSES
+    # Final statuses never change; in-flight ones are only trusted for one refresh interval
+    ttl_ms = WORKFLOW_STATUS_FINAL_TTL * 1000 if final else int(WORKFLOW_STATUS_REFRESH_SECONDS * 1000)
+    previous = await redis_client.set(key, payload, px=ttl_ms, get=True)
+    if previous != payload:
+        await redis_client.publish(key, payload)
+
+async def _refresh_workflow_status(
+    company_info: Dict[str, Any],
+    execution_id: str,
+    force: bool = False
+) -> Optional[Dict[str, Any]]:
+    """
+    Read an execution status from the company service, at most once per refresh
+    interval across all waiters and gateway processes (unless forced).
+    
+    Returns None if another waiter holds the refresh slot.
+    """
+    key = _workflow_status_key(company_info["company_id"], execution_id)
+    if (
+        not await redis_client.set(f"{key}:refresh", 1, nx=True, px=int(WORKFLOW_STATUS_REFRESH_SECONDS * 1000))
+        and not force
+    ):
+        return None
+    response = await company_client.get(
+        f"/workflows/executions/{execution_id}",
+        headers={"Authorization": f"Bearer {company_info['internal_token']}"}
+    )
+    if response.status_code != 200:
+        raise HTTPException(status_code=404, detail="Execution not found")
+    status = response.json()
+    await _cache_workflow_status(company_info["company_id"], execution_id, status)
+    return status
+
+async def _get_cached_workflow_status(company_id: str, execution_id: str) -> Optional[Dict[str, Any]]:
+    cached = await redis_client.get(_workflow_status_key(company_id, execution_id))
+    return loads(cached) if cached else None
+
+async def _workflow_status_updates(
+    company_info: Dict[str, Any],
+    execution_id: str,
+    timeout: float
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Yield an execution's status, then every change, until it is final or the
+    timeout passes.
+    
+    Changes arrive on the status pub/sub channel; while nobody else refreshes the
+    status, one waiter at a time reads it from the company service.
+    """
+    key = _workflow_status_key(company_info["company_id"], execution_id)
+    deadline = time.monotonic() + timeout
+    pubsub = redis_client.pubsub()
+    await pubsub.subscribe(key)
+    try:
+        status = await _get_cached_workflow_status(company_info["company_id"], execution_id)
+        if status is None:
+            status = await _refresh_workflow_status(company_info, execution_id)
+        # Another waiter is reading it right now: use its read if it lands within
+        # the refresh interval (whatever the timeout, even 0), else read it too
+        slot_expires = time.monotonic() + WORKFLOW_STATUS_REFRESH_SECONDS
+        while status is None and time.monotonic() < slot_expires:
+            await asyncio.sleep(0.05)
+            status = await _get_cached_workflow_status(company_info["company_id"], execution_id)
+        if status is None:
+            status = await _refresh_workflow_status(company_info, execution_id, force=True)
+        yield status
+        
+        while status.get("status") not in WORKFLOW_FINAL_STATUSES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True,
+                timeout=min(remaining, WORKFLOW_STATUS_REFRESH_SECONDS)
+            )
+            if message is not None:
+                status = loads(message["data"])
+                yield status
+            elif await _get_cached_workflow_status(company_info["company_id"], execution_id) is None:
+                # The in-flight status expired without an update: refresh it (or let another waiter)
+                await _refresh_workflow_status(company_info, execution_id)
+    finally:
+        await pubsub.unsubscribe(key)
+        await pubsub.close()
+
 @app.get("/v1/agents/workflows/{execution_id}/status")
 async def get_workflow_status(
     execution_id: str,
+    wait: float = 0,
     company_info: Dict[str, Any] = Depends(authenticate_request)
 ):
-    """Get workflow execution status"""
+    """
+    Get workflow execution status
+    
+    With `wait`, long-polls up to that many seconds (at most 60) until the
+    execution completes, fails or is cancelled.
+    """
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{INTERNAL_API_BASE}/workflows/executions/{execution_id}",
-                headers={"Authorization": f"Bearer {company_info['internal_token']}"}
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(status_code=404, detail="Execution not found")
-            
-            return response.json()
-            
+        status = None
+        async for status in _workflow_status_updates(company_info, execution_id, min(max(wait, 0), 60)):
+            pass
+        return status
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/v1/agents/workflows/{execution_id}/status/stream")
+async def stream_workflow_status(
+    execution_id: str,
+    company_info: Dict[str, Any] = Depends(authenticate_request)
+):
+    """
+    Stream workflow execution status changes
+    
+    Server-sent events: one event with the current status, then one per change
+    until the execution completes, fails or is cancelled.
+    """
+    
+    async def generate_stream() -> AsyncGenerator[str, None]:
+        try:
+            async for status in _workflow_status_updates(company_info, execution_id, WORKFLOW_STATUS_STREAM_SECONDS):
+                yield f"data: {dumps_str(status)}\n\n"
+        except HTTPException as e:
+            yield f"data: {dumps_str({'error': e.detail})}\n\n"
+        except Exception as e:
+            yield f"data: {dumps_str({'error': str(e)})}\n\n"
+    
+    return StreamingResponse(
+        generate_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "Connection": "keep-alive"}
+    )
+
+@app.post("/v1/jobs", status_code=202)
+async def submit_job(
+    request: JobSubmitRequest,
+    company_info: Dict[str, Any] = Depends(authenticate_request)
+):
+    """
+    Submit a long-running AI job
+    
+    Returns a job id immediately; fetch the result from `/v1/jobs/{job_id}`
+    (optionally long-polling with `wait`) or receive it on `webhook_url`.
+    """
+    
+    # Validate company access
+    if company_info["company_id"] != request.company_id:
+        raise HTTPException(status_code=403, detail="Company ID mismatch")
+    
+    # Check rate limits
+    if not await check_rate_limit(request.company_id, company_info["plan"]):
+        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+    # Jobs finish after the response: they are charged their estimate, and the
+    # worker settles the saved reservation by id with the tokens the job used
+    reservation = await reserve_tokens(request.company_id, company_info["plan"], estimate_job_tokens(request))
+    reservation_id = await save_reservation(redis_client, request.company_id, reservation.keys, reservation.tokens)
+    body = request.model_dump()
+    body["token_reservation_id"] = reservation_id
+    
+    deadline = time.time() + REQUEST_BUDGETS["jobs"]
+    try:
+        response = await ai_client.post(
+            "/jobs",
+            json=body,
+            headers=_ai_headers(company_info, "batch", deadline),
+            timeout=_remaining(deadline)
+        )
+    except httpx.HTTPError as e:
+        await settle_reservation(redis_client, reservation_id, request.company_id, 0)
+        raise HTTPException(status_code=503, detail=f"AI service unavailable: {e}")
+    if response.status_code in SHED_STATUSES:
+        await settle_reservation(redis_client, reservation_id, request.company_id, 0)
+        raise _shed_exception(response)
+    if response.status_code != 202:
+        await settle_reservation(redis_client, reservation_id, request.company_id, 0)
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=_error_detail(response, f"AI service error: {response.status_code}")
+        )
+    return response.json()
+
+@app.get("/v1/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    wait: float = 0,
+    company_info: Dict[str, Any] = Depends(authenticate_request)
+):
+    """Get an AI job's status and result, waiting up to `wait` seconds for it to finish"""
+    
+    try:
+        response = await ai_client.get(
+            f"/jobs/{job_id}",
+            params={"wait": min(max(wait, 0), JOB_MAX_WAIT_SECONDS), "company_id": company_info["company_id"]}
+        )
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=503, detail=f"AI service unavailable: {e}")
+    if response.status_code != 200:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return response.json()
+
 @app.get("/v1/usage")
 async def get_usage_stats(
     company_info: Dict[str, Any] = Depends(authenticate_request)
 ):
     """Get API usage statistics"""
     
-    current_month = datetime.now().strftime("%Y-%m")
+    now = datetime.now()
+    current_month = now.strftime("%Y-%m")
     month_key = f"rate_limit:{company_info['company_id']}:{current_month}"
+    token_keys = quota_keys(company_info["company_id"], now)
     
-    usage_count = await redis_client.get(month_key) or 0
+    usage_count, minute_tokens, month_tokens = await redis_client.mget([month_key] + token_keys)
+    usage_count = int(usage_count or 0)
+    month_tokens = int(month_tokens or 0)
+    limits = RATE_LIMITS[company_info["plan"]]
     
     return {
         "company_id": company_info["company_id"],
         "plan": company_info["plan"],
-        "current_month_usage": int(usage_count),
-        "monthly_limit": RATE_LIMITS[company_info["plan"]]["requests_per_month"],
-        "usage_percentage": (int(usage_count) / RATE_LIMITS[company_info["plan"]]["requests_per_month"]) * 100
+        "current_month_usage": usage_count,
+        "monthly_limit": limits["requests_per_month"],
+        "usage_percentage": (usage_count / limits["requests_per_month"]) * 100,
+        "current_minute_tokens": int(minute_tokens or 0),
+        "tokens_per_minute_limit": limits["tokens_per_minute"],
+        "current_month_tokens": month_tokens,
+        "monthly_token_limit": limits["tokens_per_month"],
+        "token_usage_percentage": (month_tokens / limits["tokens_per_month"]) * 100
     }
 
+def require_diagnostics_token(x_diagnostics_token: Optional[str] = Header(default=None)):
+    """Guard of the /debug endpoints, which do not exist without a configured token"""
+    if diagnostics.token is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not diagnostics.authorized(x_diagnostics_token):
+        raise HTTPException(status_code=403, detail="Invalid diagnostics token")
+
+@app.get("/debug/loop", dependencies=[Depends(require_diagnostics_token)], include_in_schema=False)
+async def get_loop_diagnostics():
+    """Event-loop lag and recent stalls (with the blocking stack) of this worker"""
+    return diagnostics.metrics()
+
+@app.post("/debug/profile", dependencies=[Depends(require_diagnostics_token)], include_in_schema=False)
+async def capture_cpu_profile(seconds: float = Query(default=10.0, gt=0, le=60)):
+    """Sample every thread of this worker for a while; folded stacks for flamegraph tools"""
+    try:
+        return PlainTextResponse(await diagnostics.capture_cpu(seconds))
+    except CaptureInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/debug/profiles/{profile_id}", dependencies=[Depends(require_diagnostics_token)], include_in_schema=False)
+async def get_request_profile(profile_id: str):
+    """Folded stacks of a request profiled with the X-Profile header (named by its X-Profile-Id)"""
+    profile = diagnostics.profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(profile)
+
+@app.post("/debug/memory", dependencies=[Depends(require_diagnostics_token)], include_in_schema=False)
+async def capture_memory_snapshot(
+    seconds: float = Query(default=5.0, ge=0, le=60),
+    limit: int = Query(default=25, ge=1, le=500)
+):
+    """Allocations of this worker that were made during the window and are still alive"""
+    try:
+        return await diagnostics.capture_memory(seconds, limit)
+    except CaptureInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+    # Multi-process serving: gunicorn -c gunicorn.conf.py src.main:app
+    uvicorn.run("src.main:app", host="0.0.0.0", port=8080, workers=int(os.getenv("WORKERS", "1")))
@@ -0,0 +1,82 @@
+import asyncio
+
+from fastapi import WebSocketDisconnect
+
+import src.main as gateway
+
+COMPANY = {"company_id": "acme", "internal_token": "token", "plan": "pro"}
+
+
+class StalledSocket:
+    """A client that sends frames but does not read until `reading` is set"""
+
+    def __init__(self):
+        self.incoming = asyncio.Queue()
+        self.reading = asyncio.Event()
+        self.sent = []
+        self.closed = None
+
+    async def receive_text(self):
+        frame = await self.incoming.get()
+        if frame is None:
+            raise WebSocketDisconnect()
+        return gateway.dumps_str(frame)
+
+    async def send_text(self, text):
+        await self.reading.wait()
+        self.sent.append(gateway.loads(text))
+
+    async def close(self, code=1000, reason=None):
+        self.closed = code
+
+
+async def endless_turn(self, stream_id, frame):
+    while True:
+        await self.send({"type": "delta", "id": stream_id, "content": "x"})
+
+
+def test_pings_and_cancels_are_answered_while_streams_are_blocked(monkeypatch):
+    monkeypatch.setattr(gateway.ChatChannel, "_turn", endless_turn)
+
+    async def main():
+        socket = StalledSocket()
+        channel = gateway.ChatChannel(socket, COMPANY)
+        run = asyncio.create_task(channel.run())
+        socket.incoming.put_nowait({"type": "chat", "id": "s1"})
+        await asyncio.sleep(0.01)
+        assert channel.outbox.full()
+
+        socket.incoming.put_nowait({"type": "ping"})
+        socket.incoming.put_nowait({"type": "cancel", "id": "s1"})
+        await asyncio.sleep(0.01)
+        assert channel.streams == {}
+        assert list(channel.control) == [{"type": "pong"}, {"type": "cancelled", "id": "s1"}]
+
+        socket.reading.set()
+        await asyncio.sleep(0.01)
+        socket.incoming.put_nowait(None)
+        await run
+        return socket.sent
+
+    sent = asyncio.run(main())
+    # At most the delta that was being written when the client stalled precedes the replies
+    replies = [frame for frame in sent if frame["type"] != "delta"]
+    assert replies == [{"type": "pong"}, {"type": "cancelled", "id": "s1"}]
+    assert sent.index({"type": "pong"}) <= 1
+    assert sent[-1] == {"type": "cancelled", "id": "s1"}
+
+
+def test_a_client_that_never_reads_is_disconnected(monkeypatch):
+    monkeypatch.setattr(gateway, "CHAT_WS_CONTROL_BUFFER", 4)
+
+    async def main():
+        socket = StalledSocket()
+        channel = gateway.ChatChannel(socket, COMPANY)
+        for _ in range(10):
+            socket.incoming.put_nowait({"type": "ping"})
+        await asyncio.wait_for(channel.run(), 1.0)
+        return socket
+
+    socket = asyncio.run(main())
+    assert socket.closed == 1008
+    assert socket.sent == []
@@ -0,0 +1,106 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from pydantic import BaseModel
+
+import src.main as gateway
+
+
+class FakeRedis:
+    """SET NX/GET plus the two idempotency scripts, with the same compare-then-write semantics"""
+
+    def __init__(self):
+        self.data = {}
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def release(self, keys, args):
+        if self.data.get(keys[0]) == args[0]:
+            del self.data[keys[0]]
+            return 1
+        return 0
+
+    async def save(self, keys, args):
+        if self.data.get(keys[0]) == args[0]:
+            self.data[keys[0]] = args[1]
+            return 1
+        return 0
+
+
+class Body(BaseModel):
+    text: str
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(gateway, "redis_client", fake)
+    monkeypatch.setattr(gateway, "release_idempotency_script", fake.release)
+    monkeypatch.setattr(gateway, "save_idempotency_script", fake.save)
+    monkeypatch.setattr(gateway, "IDEMPOTENCY_WAIT_SECONDS", 0.2)
+    return fake
+
+
+def http_request(key="key-1"):
+    return SimpleNamespace(headers={"Idempotency-Key": key}, url=SimpleNamespace(path="/v1/chat"))
+
+
+def begin(body="hello"):
+    return gateway.begin_idempotent_request(http_request(), "acme", Body(text=body))
+
+
+def test_a_request_that_outlived_its_lock_cannot_release_or_overwrite_the_next_one(redis):
+    async def main():
+        first = await begin()
+        # The first request's lock expires while it is still running; a retry takes the key
+        redis.data.clear()
+        second = await begin()
+        second_lock = redis.data["idempotency:acme:key-1"]
+        assert second.lock == second_lock != first.lock
+
+        await first.release()
+        assert redis.data["idempotency:acme:key-1"] == second_lock
+        await first.store(gateway.FastJSONResponse({"answer": "stale"}))
+        assert redis.data["idempotency:acme:key-1"] == second_lock
+
+        await second.store(gateway.FastJSONResponse({"answer": "fresh"}))
+        replayed = await begin()
+        assert replayed.replay is not None and replayed.replay.body == b'{"answer":"fresh"}'
+
+    asyncio.run(main())
+
+
+def test_failed_requests_release_their_own_lock(redis):
+    async def main():
+        first = await begin()
+        await first.release()
+        assert redis.data == {}
+        retry = await begin()
+        assert retry.key and retry.replay is None
+
+    asyncio.run(main())
+
+
+def test_duplicates_of_a_running_request_wait_and_then_conflict(redis):
+    async def main():
+        await begin()
+        with pytest.raises(gateway.HTTPException) as running:
+            await begin()
+        assert running.value.status_code == 409
+        with pytest.raises(gateway.HTTPException) as different:
+            await begin("another body")
+        assert different.value.status_code == 422
+
+    asyncio.run(main())
+
+
+def test_lock_outlives_every_request_budget():
+    assert gateway.IDEMPOTENCY_LOCK_SECONDS > max(gateway.REQUEST_BUDGETS.values())
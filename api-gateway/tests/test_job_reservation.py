@@ -0,0 +1,93 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import src.main as gateway
+
+COMPANY = {"company_id": "acme", "internal_token": "token", "plan": "pro"}
+
+
+class QuotaRedis:
+    def __init__(self):
+        self.strings = {}
+        self.counters = {}
+
+    async def set(self, key, value, ex=None):
+        self.strings[key] = value
+
+    async def get(self, key):
+        return self.strings.get(key)
+
+    async def delete(self, key):
+        return 1 if self.strings.pop(key, None) else 0
+
+    async def eval(self, script, numkeys, *args):
+        keys, delta = args[:numkeys], int(args[numkeys])
+        for key in keys:
+            if key in self.counters:
+                self.counters[key] += delta
+
+
+class FakeAIService:
+    def __init__(self, response):
+        self.response = response
+        self.bodies = []
+
+    async def post(self, path, json=None, headers=None, timeout=None):
+        self.bodies.append(json)
+        return self.response
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = QuotaRedis()
+
+    async def allow(company_id, plan):
+        return True
+
+    async def reserve(keys, args):
+        for key in keys:
+            redis.counters[key] = redis.counters.get(key, 0) + int(args[0])
+        return 0
+
+    monkeypatch.setattr(gateway, "redis_client", redis)
+    monkeypatch.setattr(gateway, "check_rate_limit", allow)
+    monkeypatch.setattr(gateway, "reserve_tokens_script", reserve)
+    return redis
+
+
+def submit(payload):
+    request = gateway.JobSubmitRequest(operation="summarize", payload=payload, company_id="acme")
+    return asyncio.run(gateway.submit_job(request, COMPANY))
+
+
+def test_jobs_carry_only_an_opaque_reservation_id(redis, monkeypatch):
+    ai = FakeAIService(httpx.Response(202, json={"success": True, "job_id": "job-1", "status": "queued"}))
+    monkeypatch.setattr(gateway, "ai_client", ai)
+    submit({"text": "x" * 400, "max_tokens": 100})
+
+    body = ai.bodies[0]
+    assert "token_reservation" not in body
+    record = gateway.loads(redis.strings[f"token_reservation:{body['token_reservation_id']}"])
+    assert record["company_id"] == "acme" and record["tokens"] == 200
+    assert sorted(record["keys"]) == sorted(redis.counters)
+
+
+def test_refused_jobs_refund_their_reservation(redis, monkeypatch):
+    ai = FakeAIService(httpx.Response(503, json={"detail": "overloaded"}, headers={"Retry-After": "3"}))
+    monkeypatch.setattr(gateway, "ai_client", ai)
+    with pytest.raises(HTTPException):
+        submit({"text": "x" * 400})
+
+    assert redis.strings == {}
+    assert set(redis.counters.values()) == {0}
+
+
+def test_negative_estimates_do_not_refund_quota(redis, monkeypatch):
+    ai = FakeAIService(httpx.Response(202, json={"success": True, "job_id": "job-1", "status": "queued"}))
+    monkeypatch.setattr(gateway, "ai_client", ai)
+    submit({"text": "x", "max_tokens": -1_000_000})
+
+    assert set(redis.counters.values()) == {0}
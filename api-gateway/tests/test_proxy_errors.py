@@ -0,0 +1,17 @@
+import httpx
+
+from src.main import _error_detail, _shed_exception
+
+
+def test_error_detail_of_json_and_non_json_bodies():
+    assert _error_detail(httpx.Response(422, json={"detail": "bad payload"}), "x") == "bad payload"
+    assert _error_detail(httpx.Response(502, text="<html>Bad Gateway</html>"), "AI service error: 502") == "AI service error: 502"
+    assert _error_detail(httpx.Response(500, json=["not", "an", "object"]), "fallback") == "fallback"
+    assert _error_detail(httpx.Response(400, json={"error": "no detail"}), "fallback") == "fallback"
+
+
+def test_shed_exception_keeps_retry_after_for_non_json_bodies():
+    error = _shed_exception(httpx.Response(503, text="upstream overloaded", headers={"Retry-After": "7"}))
+    assert error.status_code == 503
+    assert error.detail == "Service overloaded"
+    assert error.headers == {"Retry-After": "7"}
@@ -0,0 +1,154 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+import src.main as gateway
+
+COMPANY = {"company_id": "acme", "internal_token": "token", "plan": "pro"}
+
+
+class FakePubSub:
+    async def subscribe(self, key):
+        pass
+
+    async def unsubscribe(self, key):
+        pass
+
+    async def close(self):
+        pass
+
+    async def get_message(self, ignore_subscribe_messages=True, timeout=0):
+        await asyncio.sleep(timeout)
+        return None
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    async def set(self, key, value, nx=False, px=None, get=False):
+        previous = self.data.get(key)
+        if nx and previous is not None:
+            return None
+        self.data[key] = value
+        return previous if get else True
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def publish(self, key, payload):
+        pass
+
+    def pubsub(self):
+        return FakePubSub()
+
+
+class FakeCompanyService:
+    def __init__(self):
+        self.reads = 0
+
+    async def get(self, path, headers=None):
+        self.reads += 1
+        return httpx.Response(200, json={"execution_id": path.rsplit("/", 1)[1], "status": "running"})
+
+
+@pytest.fixture
+def services(monkeypatch):
+    redis, company = FakeRedis(), FakeCompanyService()
+    monkeypatch.setattr(gateway, "redis_client", redis)
+    monkeypatch.setattr(gateway, "company_client", company)
+    return redis, company
+
+
+def test_wait_zero_reads_the_status_while_another_waiter_holds_the_refresh_slot(services):
+    redis, company = services
+    # A waiter that took the slot and then died never writes the status
+    redis.data[f"{gateway._workflow_status_key('acme', 'exec-1')}:refresh"] = 1
+
+    started = time.monotonic()
+    status = asyncio.run(gateway.get_workflow_status("exec-1", wait=0, company_info=COMPANY))
+    assert status == {"execution_id": "exec-1", "status": "running"}
+    assert company.reads == 1
+    assert time.monotonic() - started < gateway.WORKFLOW_STATUS_REFRESH_SECONDS + 0.5
+
+
+def test_cached_status_is_served_without_a_read(services):
+    redis, company = services
+    redis.data[gateway._workflow_status_key("acme", "exec-2")] = gateway.dumps({"status": "completed"})
+    assert asyncio.run(gateway.get_workflow_status("exec-2", wait=0, company_info=COMPANY)) == {"status": "completed"}
+    assert company.reads == 0
+
+
+def test_api_key_cache_is_bounded(monkeypatch):
+    class Validator:
+        calls = 0
+
+        async def post(self, path, json=None):
+            Validator.calls += 1
+            return httpx.Response(200, json={"company_id": json["api_key"], "plan": "pro"})
+
+    monkeypatch.setattr(gateway, "company_client", Validator())
+    monkeypatch.setattr(gateway, "API_KEY_CACHE_SIZE", 3)
+    monkeypatch.setattr(gateway, "_api_key_cache", gateway.OrderedDict())
+
+    async def main():
+        for key in ("key-a", "key-b", "key-c", "key-a", "key-d"):
+            await gateway.get_api_key_info(key)
+
+    asyncio.run(main())
+    # key-b was the least recently used when key-d arrived
+    assert list(gateway._api_key_cache) == ["key-c", "key-a", "key-d"]
+    assert Validator.calls == 4
+
+
+def test_workflow_execution_uses_the_pooled_company_client(monkeypatch):
+    class Executor:
+        calls = []
+
+        async def post(self, path, json=None, headers=None, timeout=None):
+            Executor.calls.append((path, timeout))
+            return httpx.Response(200, json={"execution_id": "exec-3", "status": "running"})
+
+    async def allowed(company_id, plan):
+        return True
+
+    monkeypatch.setattr(gateway, "company_client", Executor())
+    monkeypatch.setattr(gateway, "check_rate_limit", allowed)
+    monkeypatch.setattr(gateway.httpx, "AsyncClient", None)
+
+    request = gateway.AgentWorkflowRequest(workflow_id="wf-1", company_id="acme")
+    http_request = SimpleNamespace(headers={}, url=SimpleNamespace(path="/v1/agents/workflow"))
+    response = asyncio.run(gateway.execute_agent_workflow(
+        request, http_request, gateway.BackgroundTasks(), {**COMPANY, "user_id": "user-1"}
+    ))
+    assert response.status_code == 200
+    path, timeout = Executor.calls[0]
+    assert path == "/workflows/wf-1/execute"
+    assert 0 < timeout <= gateway.REQUEST_BUDGETS["workflow"]
+
+
+def test_revoked_api_keys_stop_working_once_their_cache_entry_expires(monkeypatch):
+    class Validator:
+        revoked = False
+
+        async def post(self, path, json=None):
+            if Validator.revoked:
+                return httpx.Response(401, json={"detail": "API key revoked"})
+            return httpx.Response(200, json={"company_id": "acme", "plan": "pro"})
+
+    now = [1000.0]
+    monkeypatch.setattr(gateway, "company_client", Validator())
+    monkeypatch.setattr(gateway, "_api_key_cache", gateway.OrderedDict())
+    monkeypatch.setattr(gateway.time, "monotonic", lambda: now[0])
+
+    assert asyncio.run(gateway.get_api_key_info("live-key"))["company_id"] == "acme"
+    Validator.revoked = True
+    assert asyncio.run(gateway.get_api_key_info("live-key"))["company_id"] == "acme"
+    now[0] += gateway.API_KEY_CACHE_TTL
+    with pytest.raises(gateway.HTTPException) as revoked:
+        asyncio.run(gateway.get_api_key_info("live-key"))
+    assert revoked.value.status_code == 401
+    assert gateway.API_KEY_CACHE_TTL <= 10
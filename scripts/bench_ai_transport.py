@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Gateway -> AI service transport benchmark.
+
+Sends the same operation to a running AI service over HTTP/JSON (pooled
+httpx client) and over its internal gRPC port, through the gateway's
+AITransport, and reports latency percentiles, throughput and the client CPU
+time per request of each.
+
+Usage (from the repository root, in the gateway environment, with the AI
+service running):
+
+    python scripts/bench_ai_transport.py [requests] [concurrency] [path]
+
+AI_SERVICE_URL and AI_SERVICE_GRPC_TARGET select the service (defaults:
+http://localhost:8000 and localhost:50053). The default path, /classify, is
+the smallest payload; use a cached /summarize to keep provider time out of it.
+"""
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api-gateway"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shared"))
+
+from src.ai_transport import AITransport  # noqa: E402
+
+AI_SERVICE_URL = os.getenv("AI_SERVICE_URL", "http://localhost:8000")
+AI_SERVICE_GRPC_TARGET = os.getenv("AI_SERVICE_GRPC_TARGET", "localhost:50053")
+HEADERS = {"X-Tenant-Id": "bench", "X-Tenant-Plan": "enterprise"}
+PAYLOADS = {
+    "/classify": {"text": "My invoice was charged twice this month", "categories": ["billing", "support", "sales"]},
+    "/summarize": {"text": "The quarterly report shows revenue growth across all regions. " * 40, "max_length": 100},
+    "/chat": {"messages": [{"role": "user", "content": "Say hello"}], "max_tokens": 16}
+}
+
+
+async def run(transport: AITransport, path: str, requests: int, concurrency: int):
+    payload = PAYLOADS[path]
+    latencies = []
+    failures = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            result = await transport.post(path, payload, HEADERS, 30.0)
+            latencies.append(time.perf_counter() - start)
+            if result.status_code != 200:
+                failures += 1
+
+    # Warm up connections (and the service's cache for the payload)
+    await asyncio.gather(*(one() for _ in range(min(concurrency, requests))))
+    latencies.clear()
+    failures = 0
+
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+
+    latencies.sort()
+    return {
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "rps": requests / wall,
+        "cpu_us": cpu / requests * 1e6,
+        "failures": failures
+    }
+
+
+async def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    path = sys.argv[3] if len(sys.argv) > 3 else "/classify"
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=AI_SERVICE_URL, limits=limits) as http:
+        for name, target in (("http", None), ("grpc", AI_SERVICE_GRPC_TARGET)):
+            transport = AITransport(http, target)
+            try:
+                stats = await run(transport, path, requests, concurrency)
+            finally:
+                await transport.close()
+            print(
+                f"{name:5} {path}: p50 {stats['p50_ms']:7.2f} ms  p99 {stats['p99_ms']:7.2f} ms  "
+                f"{stats['rps']:8.0f} req/s  {stats['cpu_us']:7.1f} us CPU / request  "
+                f"({stats['failures']} failed)"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
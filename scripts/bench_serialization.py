@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Serialization microbenchmark for the AI service response path.
+
+Compares the CPU time per request of the previous path (response model
+construction and validation, stdlib json for the response, cache entry and an
+indented log line) with the current one (plain dicts through the fast codec).
+
+Usage (from the repository root, in the AI service environment):
+
+    python scripts/bench_serialization.py [iterations]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ai"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shared"))
+
+from app.models import AIResponse  # noqa: E402
+from platform_common import codec  # noqa: E402
+
+SUMMARY = "The quarterly report shows revenue growth across all regions. " * 20
+LOG_ENTRY = {
+    "id": "log_1700000000000",
+    "service_name": "ai",
+    "request_type": "summarize",
+    "request_data": {"text_length": 24000},
+    "response_data": {"summary_length": len(SUMMARY)},
+    "model_used": "gpt-3.5-turbo",
+    "tokens_used": 6123,
+    "cached_tokens": 0,
+    "cost": 0.0,
+    "execution_time_ms": 2140,
+    "status": "success",
+    "error_message": None,
+    "created_at": 1700000000.0
+}
+
+
+def before():
+    response = AIResponse(
+        success=True,
+        data={"summary": SUMMARY},
+        model_used="gpt-3.5-turbo",
+        tokens_used=6123,
+        execution_time_ms=2140
+    )
+    # FastAPI re-validates the returned model against response_model, then encodes it
+    body = AIResponse.model_validate(response.model_dump()).model_dump()
+    json.dumps(body, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+    json.loads(json.dumps(SUMMARY))
+    json.dumps(LOG_ENTRY, indent=2)
+    json.dumps(LOG_ENTRY)
+
+
+def after():
+    body = {
+        "success": True,
+        "data": {"summary": SUMMARY},
+        "model_used": "gpt-3.5-turbo",
+        "tokens_used": 6123,
+        "cached_tokens": 0,
+        "execution_time_ms": 2140,
+        "error_message": None
+    }
+    codec.FastJSONResponse(body).body
+    codec.loads(codec.dumps(SUMMARY))
+    codec.dumps_str(LOG_ENTRY)
+    codec.dumps(LOG_ENTRY)
+
+
+def measure(function, iterations: int) -> float:
+    for _ in range(min(iterations, 1000)):
+        function()
+    start = time.process_time()
+    for _ in range(iterations):
+        function()
+    return (time.process_time() - start) / iterations * 1e6
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(f"codec backend: {'orjson' if codec.orjson is not None else 'json (orjson not installed)'}")
+    baseline = measure(before, iterations)
+    current = measure(after, iterations)
+    print(f"before: {baseline:8.2f} us CPU / request")
+    print(f"after:  {current:8.2f} us CPU / request")
+    print(f"speed-up: {baseline / current:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+"""
+Modules shared by the Python services (ai/ and api-gateway/).
+
+Both images install this package from the "shared" build context, so a fix
+here reaches every service with its next build.
+"""
@@ -0,0 +1,386 @@
+import asyncio
+import contextvars
+import gc
+import hmac
+import os
+import resource
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+import uuid
+import weakref
+from collections import Counter, OrderedDict, deque
+from typing import Any, Dict, List, Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Id of the profile the current request is sampled into (inherited by the tasks it starts)
+_profiled: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("profiled_request", default=None)
+
+
+class CaptureInProgress(RuntimeError):
+    """Another time-boxed capture is already running in this worker"""
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    path = "/".join(code.co_filename.rsplit(os.sep, 2)[-2:])
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({path}:{frame.f_lineno})"
+
+
+def fold(frame, root: str) -> str:
+    """A thread's stack in folded form: root;outermost;...;innermost"""
+    names: List[str] = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.append(root)
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler: a thread samples Python stacks every interval and
+    counts them in folded form, one "frame;frame;... count" line per stack
+    (the input of flamegraph.pl, inferno and speedscope). Nothing runs unless
+    a profiler is started.
+
+    With a loop only the event-loop thread is sampled, and each sample is
+    rooted by who was running: the profiled request (or a task it started),
+    another task, or no task (idle or plain callbacks). Without one every
+    thread is sampled, rooted by thread name.
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        profile_id: Optional[str] = None,
+        owners: Optional["weakref.WeakKeyDictionary[asyncio.Task, str]"] = None
+    ):
+        self.interval = interval
+        self.loop = loop
+        self.profile_id = profile_id
+        self.owners = owners if owners is not None else weakref.WeakKeyDictionary()
+        # Created on the loop thread
+        self.loop_thread = threading.get_ident()
+        self.samples: Counter = Counter()
+        self.context_token: Optional[contextvars.Token] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> str:
+        """Stop sampling and return the folded stacks, most frequent first"""
+        self._stopped.set()
+        self._thread.join()
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            if self.loop is not None:
+                frame = frames.get(self.loop_thread)
+                if frame is not None:
+                    self.samples[fold(frame, self._owner())] += 1
+                continue
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident != own:
+                    self.samples[fold(frame, names.get(ident, str(ident)))] += 1
+
+    def _owner(self) -> str:
+        task = asyncio.current_task(self.loop)
+        if task is None:
+            return "(no task)"
+        return "(request)" if self.owners.get(task) == self.profile_id else "(other tasks)"
+
+
+class LoopMonitor:
+    """
+    Event-loop health.
+
+    A task ticks every interval and records how late each tick wakes up (the
+    loop lag). A watchdog thread notices when no tick has run for
+    slow_callback seconds past its time, i.e. one callback is holding the loop,
+    and logs the task running it with the loop thread's stack, once per stall.
+    """
+
+    def __init__(self, interval: float = 0.1, slow_callback: float = 0.25, history: int = 20):
+        self.interval = interval
+        self.slow_callback = slow_callback
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread: Optional[int] = None
+        self.stalls: deque = deque(maxlen=history)
+        self._lags: deque = deque(maxlen=600)
+        self._metrics = {"lag_ms": 0.0, "max_lag_ms": 0.0, "stalls": 0}
+        self._beat = 0.0
+        self._open_stall: Optional[Dict[str, Any]] = None
+        self._ticker: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Start ticking on the running loop"""
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._ticker = asyncio.create_task(self._tick())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._ticker is not None:
+            self._ticker.cancel()
+            await asyncio.gather(self._ticker, return_exceptions=True)
+            self._ticker = None
+
+    async def _tick(self):
+        while True:
+            started = self.loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(self.loop.time() - started - self.interval, 0.0)
+            self._beat = time.monotonic()
+            self._lags.append(lag)
+            self._metrics["lag_ms"] = lag * 1000
+            self._metrics["max_lag_ms"] = max(self._metrics["max_lag_ms"], lag * 1000)
+            stall, self._open_stall = self._open_stall, None
+            if stall is not None:
+                # The watchdog saw the stall start; now its length is known
+                stall["blocked_ms"] = round(lag * 1000, 1)
+
+    def _watch(self):
+        reported = False
+        while not self._stopped.wait(self.interval):
+            blocked = time.monotonic() - self._beat - self.interval
+            if blocked < self.slow_callback:
+                reported = False
+            elif not reported:
+                reported = True
+                self._report(blocked)
+
+    def _report(self, blocked: float):
+        frame = sys._current_frames().get(self.loop_thread)
+        task = asyncio.current_task(self.loop)
+        coroutine = None
+        if task is not None:
+            coro = task.get_coro()
+            coroutine = getattr(coro, "__qualname__", repr(coro))
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+        stall = {
+            "at": time.time(),
+            "blocked_ms": round(blocked * 1000, 1),
+            "task": task.get_name() if task is not None else None,
+            "coroutine": coroutine,
+            "stack": stack
+        }
+        self._metrics["stalls"] += 1
+        self.stalls.append(stall)
+        self._open_stall = stall
+        print(f"Event loop blocked for over {blocked * 1000:.0f} ms by {coroutine or 'a callback'}:\n{stack}")
+
+    def metrics(self) -> Dict[str, Any]:
+        lags = sorted(self._lags)
+        return {
+            **self._metrics,
+            "p99_lag_ms": lags[int(len(lags) * 0.99)] * 1000 if lags else 0.0,
+            "slow_callback_ms": self.slow_callback * 1000,
+            "recent_stalls": list(self.stalls)
+        }
+
+
+class Diagnostics:
+    """
+    On-demand diagnostics of one worker process: the loop monitor, per-request
+    and time-boxed sampling profiles, and memory snapshots.
+
+    Everything but the loop monitor is off until asked for, and asking needs
+    the diagnostics token; without a token profiling is disabled.
+    """
+
+    def __init__(
+        self,
+        token: Optional[str],
+        sample_interval: float = 0.005,
+        loop_monitor: bool = True,
+        loop_interval: float = 0.1,
+        slow_callback: float = 0.25,
+        max_profiles: int = 20,
+        memory_frames: int = 10
+    ):
+        self.token = token or None
+        self.sample_interval = sample_interval
+        self.monitor = LoopMonitor(loop_interval, slow_callback) if loop_monitor else None
+        self.max_profiles = max_profiles
+        self.memory_frames = memory_frames
+        self._profiles: "OrderedDict[str, str]" = OrderedDict()
+        self._owners: "weakref.WeakKeyDictionary[asyncio.Task, str]" = weakref.WeakKeyDictionary()
+        self._active = 0
+        self._previous_factory = None
+        self._capturing = False
+
+    def authorized(self, value: Optional[str]) -> bool:
+        return self.token is not None and value is not None and hmac.compare_digest(value.encode(), self.token.encode())
+
+    def start(self):
+        if self.monitor is not None:
+            self.monitor.start()
+
+    async def stop(self):
+        if self.monitor is not None:
+            await self.monitor.stop()
+
+    def begin_request_profile(self) -> SamplingProfiler:
+        """Start sampling the current request; the tasks it starts are attributed to it as well"""
+        profile_id = uuid.uuid4().hex
+        context_token = _profiled.set(profile_id)
+        loop = asyncio.get_running_loop()
+        self._owners[asyncio.current_task()] = profile_id
+        # A task factory only while profiling, so other requests pay nothing
+        if self._active == 0:
+            self._previous_factory = loop.get_task_factory()
+            loop.set_task_factory(self._task_factory)
+        self._active += 1
+        profiler = SamplingProfiler(self.sample_interval, loop, profile_id, self._owners)
+        profiler.context_token = context_token
+        profiler.start()
+        return profiler
+
+    def end_request_profile(self, profiler: SamplingProfiler):
+        """Stop sampling and keep the profile for /debug/profiles/{id}"""
+        self._active -= 1
+        if self._active == 0:
+            profiler.loop.set_task_factory(self._previous_factory)
+        _profiled.reset(profiler.context_token)
+        self._profiles[profiler.profile_id] = profiler.stop()
+        while len(self._profiles) > self.max_profiles:
+            self._profiles.popitem(last=False)
+
+    def _task_factory(self, loop, coro, **kwargs):
+        if self._previous_factory is not None:
+            task = self._previous_factory(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        profile_id = _profiled.get()
+        if profile_id is not None:
+            self._owners[task] = profile_id
+        return task
+
+    def profile(self, profile_id: str) -> Optional[str]:
+        return self._profiles.get(profile_id)
+
+    async def capture_cpu(self, seconds: float) -> str:
+        """Folded stacks of every thread of this worker, sampled for the given time"""
+        self._begin_capture()
+        try:
+            profiler = SamplingProfiler(self.sample_interval)
+            profiler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                folded = profiler.stop()
+            return folded
+        finally:
+            self._capturing = False
+
+    async def capture_memory(self, seconds: float, limit: int = 25) -> Dict[str, Any]:
+        """
+        Allocations made during the given time and still alive, by traceback.
+
+        tracemalloc is started for the window unless it already runs; taking the
+        snapshots pauses the worker briefly.
+        """
+        self._begin_capture()
+        try:
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start(self.memory_frames)
+            try:
+                baseline = tracemalloc.take_snapshot()
+                await asyncio.sleep(seconds)
+                snapshot = tracemalloc.take_snapshot()
+                traced, peak = tracemalloc.get_traced_memory()
+            finally:
+                if started:
+                    tracemalloc.stop()
+        finally:
+            self._capturing = False
+
+        ignored = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen *>")]
+        growth = [
+            stat for stat in snapshot.filter_traces(ignored).compare_to(baseline.filter_traces(ignored), "traceback")
+            if stat.size_diff > 0
+        ]
+        growth.sort(key=lambda stat: stat.size_diff, reverse=True)
+        return {
+            "seconds": seconds,
+            "traced_bytes": traced,
+            "peak_traced_bytes": peak,
+            "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "gc_counts": gc.get_count(),
+            "gc_objects": len(gc.get_objects()),
+            "top": [
+                {"where": str(stat.traceback[-1]), "size_diff": stat.size_diff, "count_diff": stat.count_diff}
+                for stat in growth[:limit]
+            ],
+            # Flamegraph input weighted by bytes
+            "folded": "\n".join(
+                ";".join(f"{frame.filename}:{frame.lineno}" for frame in stat.traceback) + f" {stat.size_diff}"
+                for stat in growth
+            )
+        }
+
+    def _begin_capture(self):
+        if self._capturing:
+            raise CaptureInProgress("A capture is already running in this worker")
+        self._capturing = True
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "loop": self.monitor.metrics() if self.monitor is not None else None,
+            "profiling_enabled": self.token is not None,
+            "active_request_profiles": self._active,
+            "stored_profiles": list(self._profiles)
+        }
+
+
+class ProfilingMiddleware:
+    """
+    Profile single requests on demand: a request whose X-Profile header carries
+    the diagnostics token is sampled while it runs, and its response names the
+    stored profile in X-Profile-Id. Other requests pass straight through (a
+    header scan, and only when a token is configured).
+    """
+
+    def __init__(self, app: ASGIApp, diagnostics: Diagnostics):
+        self.app = app
+        self.diagnostics = diagnostics
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or self.diagnostics.token is None:
+            await self.app(scope, receive, send)
+            return
+        value = next((value for name, value in scope["headers"] if name == b"x-profile"), None)
+        if value is None or not self.diagnostics.authorized(value.decode("latin-1")):
+            await self.app(scope, receive, send)
+            return
+
+        profiler = self.diagnostics.begin_request_profile()
+
+        async def send_with_profile_id(message: Message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", profiler.profile_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            self.diagnostics.end_request_profile(profiler)
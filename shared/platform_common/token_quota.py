@@ -0,0 +1,89 @@
+import uuid
+from datetime import datetime
+from typing import Any, List, Optional
+
+from .codec import dumps, loads
+
+# Reservations of jobs that never settle expire with the monthly counter they charged
+RESERVATION_TTL = 60 * 60 * 24 * 31
+
+# Atomically admit a token reservation against the minute and month token counters.
+# KEYS: minute counter, month counter
+# ARGV: tokens, minute limit, month limit, minute TTL, month TTL
+# Returns 0 when admitted, 1 / 2 when the minute / month quota would be exceeded.
+# A request larger than the whole minute quota is admitted into an empty minute.
+RESERVE_TOKENS_LUA = """
+local tokens = tonumber(ARGV[1])
+local minute = tonumber(redis.call('GET', KEYS[1]) or '0')
+local month = tonumber(redis.call('GET', KEYS[2]) or '0')
+if minute > 0 and minute + tokens > tonumber(ARGV[2]) then
+    return 1
+end
+if month + tokens > tonumber(ARGV[3]) then
+    return 2
+end
+for i, key in ipairs(KEYS) do
+    redis.call('INCRBY', key, tokens)
+    if redis.call('TTL', key) < 0 then
+        redis.call('EXPIRE', key, ARGV[i + 3])
+    end
+end
+return 0
+"""
+
+# Apply the difference between actual and reserved tokens to counters that still exist.
+# KEYS: counters; ARGV[1]: delta (negative refunds)
+RECONCILE_TOKENS_LUA = """
+for _, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('INCRBY', key, ARGV[1])
+    end
+end
+return 0
+"""
+
+
+def quota_keys(company_id: str, now: Optional[datetime] = None) -> List[str]:
+    """A company's minute and month token counters"""
+    now = now or datetime.now()
+    return [
+        f"token_quota:{company_id}:{now.strftime('%Y-%m-%d-%H-%M')}",
+        f"token_quota:{company_id}:{now.strftime('%Y-%m')}"
+    ]
+
+
+async def save_reservation(redis_client: Any, company_id: str, keys: List[str], tokens: int) -> str:
+    """
+    Record a reservation that outlives the request (a queued job) and return its id.
+
+    Whoever finishes the work settles it by id; the keys and tokens never leave Redis.
+    """
+    reservation_id = str(uuid.uuid4())
+    record = {"company_id": company_id, "keys": keys, "tokens": tokens}
+    await redis_client.set(f"token_reservation:{reservation_id}", dumps(record), ex=RESERVATION_TTL)
+    return reservation_id
+
+
+async def settle_reservation(redis_client: Any, reservation_id: str, company_id: str, tokens_used: int) -> bool:
+    """
+    Settle a saved reservation against the tokens used, once.
+
+    Only the company's own counters are adjusted. Returns False when the
+    reservation is unknown, expired, already settled or another company's.
+    """
+    key = f"token_reservation:{reservation_id}"
+    record = await redis_client.get(key)
+    if not record:
+        return False
+    reservation = loads(record)
+    if reservation.get("company_id") != company_id:
+        return False
+    # Whoever deletes the record settles it
+    if not await redis_client.delete(key):
+        return False
+    prefix = f"token_quota:{company_id}:"
+    keys = [counter for counter in reservation.get("keys") or [] if isinstance(counter, str) and counter.startswith(prefix)]
+    delta = max(int(tokens_used), 0) - max(int(reservation.get("tokens") or 0), 0)
+    if delta and keys:
+        await redis_client.eval(RECONCILE_TOKENS_LUA, len(keys), *keys, delta)
+    return True